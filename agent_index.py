@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+智能体索引：GET /panel/agents 一次返回全部模型的结构化配置（底座模型、系统提示词、参数）
+- 前端不必再逐个调用 /api/show 再在浏览器里解析 Modelfile
+- /api/show 并发请求（上限 SHOW_CONCURRENCY），结果按模型 digest 缓存：
+  模型被重新 create 后 digest 改变，自然失效；不在 /api/tags 里的 digest 随之清理
+- ?refresh=1 忽略缓存重新获取
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from async_server import Request, Response
+from modelfile import parse_modelfile
+
+SHOW_CONCURRENCY = 8
+
+
+def _base_model(show: Dict[str, Any], from_: str) -> str:
+    """底座模型：优先 details.parent_model；FROM 是 blob 路径时无法还原名字"""
+    parent = (show.get("details") or {}).get("parent_model")
+    if isinstance(parent, str) and parent:
+        return parent
+    if from_.startswith(("/", ".", "~")) or "sha256" in from_:
+        return ""
+    return from_
+
+
+class AgentIndex:
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self._by_digest: Dict[str, Dict[str, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def install(self, app) -> None:
+        app.add_route("/panel/agents", self.handle, methods=("GET",))
+
+    async def _describe(self, name: str, sem: asyncio.Semaphore) -> Optional[Dict[str, Any]]:
+        async with sem:
+            show = await self.proxy.fetch_json("POST", "/api/show", {"name": name})
+        if not isinstance(show, dict):
+            self.failures += 1
+            return None
+        mf = parse_modelfile(show.get("modelfile"))
+        return {
+            "from": mf.from_,
+            "base_model": _base_model(show, mf.from_),
+            "system": mf.system or show.get("system") or "",
+            "parameters": mf.parameters,
+            "template": mf.template or show.get("template") or "",
+            "adapters": mf.adapters,
+            "messages": mf.messages,
+            "details": show.get("details") or {},
+        }
+
+    async def agents(self, refresh: bool = False) -> Optional[List[Dict[str, Any]]]:
+        tags = await self.proxy.fetch_json("GET", "/api/tags")
+        if not isinstance(tags, dict):
+            return None
+        models = [m for m in tags.get("models") or [] if isinstance(m, dict) and m.get("name")]
+
+        sem = asyncio.Semaphore(SHOW_CONCURRENCY)
+        pending: Dict[str, "asyncio.Future[Optional[Dict[str, Any]]]"] = {}
+        for m in models:
+            digest = m.get("digest") or ""
+            if not refresh and digest and digest in self._by_digest:
+                self.hits += 1
+                continue
+            key = digest or m["name"]  # 同一 digest 的多个名字（ollama cp）只取一次
+            if key not in pending:
+                self.misses += 1
+                pending[key] = asyncio.ensure_future(self._describe(m["name"], sem))
+        if pending:
+            results = await asyncio.gather(*pending.values())
+            fresh = dict(zip(pending, results))
+        else:
+            fresh = {}
+
+        out: List[Dict[str, Any]] = []
+        for m in models:
+            digest = m.get("digest") or ""
+            key = digest or m["name"]
+            info = fresh[key] if key in fresh else self._by_digest.get(digest)
+            if info is not None and digest:
+                self._by_digest[digest] = info
+            out.append(dict(
+                info or {"error": "获取模型详情失败"},
+                name=m["name"],
+                digest=digest,
+                size=m.get("size"),
+                modified_at=m.get("modified_at"),
+            ))
+        live = {m.get("digest") for m in models}
+        for digest in [d for d in self._by_digest if d not in live]:
+            del self._by_digest[digest]
+        return out
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._by_digest), "hits": self.hits, "misses": self.misses, "failures": self.failures}
+
+    async def handle(self, req: Request, resp: Response) -> None:
+        agents = await self.agents(refresh=req.query.get("refresh") in ("1", "true"))
+        if agents is None:
+            await resp.send_error(502, "无法获取模型列表")
+            return
+        await resp.send_json(200, {"agents": agents})
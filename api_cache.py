@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+/api/tags 与 /api/show 的服务端缓存
+- TTL 过期；代理看到 /api/create、/api/delete、/api/copy 或 /api/pull 完成时立即整体失效
+- 强 ETag + If-None-Match：面板刷新时命中缓存直接回 304，不再访问上游
+- 多 worker 时每个进程各有一份缓存，跨进程的失效最多滞后一个 TTL
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from async_server import Request
+
+CACHEABLE = {("GET", "/api/tags"), ("POST", "/api/show")}
+INVALIDATING = ("/api/create", "/api/delete", "/api/copy", "/api/pull")
+
+
+def canonical_body(body: bytes) -> str:
+    """JSON 按 key 排序后紧凑序列化，使字段顺序/空白不同的等价请求得到同一个 key"""
+    if not body:
+        return ""
+    try:
+        return json.dumps(json.loads(body.decode("utf-8")), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    except (ValueError, UnicodeDecodeError):
+        return hashlib.sha1(body).hexdigest()
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [t.strip() for t in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+@dataclass
+class CacheEntry:
+    status: int
+    body: bytes
+    content_type: Optional[str]
+    etag: str
+    expires_at: float
+
+
+class ApiCache:
+    def __init__(self, ttl: float = 30.0, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        # 每次失效 +1；上游请求发出前记录代数，回来时代数变了就不写缓存（避免把失效前的旧数据写回去）
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.invalidations = 0
+
+    def key(self, req: Request) -> Optional[str]:
+        if self.ttl <= 0 or (req.method, req.path) not in CACHEABLE:
+            return None
+        return f"{req.method} {req.path} {canonical_body(req.body)}"
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, generation: int, status: int, body: bytes, content_type: Optional[str]) -> CacheEntry:
+        entry = CacheEntry(status, body, content_type, make_etag(body), time.monotonic() + self.ttl)
+        if status == 200 and generation == self.generation:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def is_invalidating(self, req: Request) -> bool:
+        return req.method in ("POST", "DELETE") and req.path in INVALIDATING
+
+    def invalidate(self) -> None:
+        self.generation += 1
+        self.invalidations += 1
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "invalidations": self.invalidations,
+        }
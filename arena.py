@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+多模型擂台：同一组 messages 并发发给多个模型，结果交错流式返回
+- POST /panel/arena  {"models": ["linzhi-lora", "qwen2.5:7b"], "messages": [...], "options": {...}, "concurrency": 2}
+- 返回 NDJSON：每行是对应模型的 Ollama /api/chat 记录，附加 "arena": {"model", "index"} 标记来源
+- 最后一行 {"done": true, "arena_summary": {模型: {ttft_ms, total_ms, eval_tokens_per_sec, ...}}}
+- 并发数受 concurrency（不超过 --arena-concurrency）限制；启用调度器时仍经过其准入与排队
+- 浏览器断开时取消全部上游请求
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from typing import Any, Dict, Optional
+
+from async_server import Request, Response
+from ollama_proxy import UpstreamError
+from scheduler import QueueFull, user_key
+
+MAX_MODELS = 8
+
+_END = object()
+
+
+def _rate(count: Any, duration_ns: Any) -> Optional[float]:
+    if isinstance(count, (int, float)) and isinstance(duration_ns, (int, float)) and duration_ns > 0:
+        return round(count / (duration_ns / 1e9), 2)
+    return None
+
+
+class Arena:
+    def __init__(self, proxy, max_concurrency: int = 2):
+        self.proxy = proxy
+        self.max_concurrency = max_concurrency
+        self.runs = 0
+
+    def install(self, app) -> None:
+        app.add_route("/panel/arena", self.handle, methods=("POST",))
+
+    async def _run_model(
+        self,
+        index: int,
+        model: str,
+        payload: Dict[str, Any],
+        user: str,
+        sem: asyncio.Semaphore,
+        out: "asyncio.Queue[Any]",
+        summary: Dict[str, Any],
+    ) -> None:
+        result: Dict[str, Any] = {"status": "error"}
+        summary[model] = result
+        tag = {"model": model, "index": index}
+        scheduler = self.proxy.scheduler
+        ticket = None
+        final: Dict[str, Any] = {}
+
+        async def emit(line: bytes) -> None:
+            nonlocal final
+            if not line.strip():
+                return
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError(f"上游返回了非对象的 JSON 行: {line[:200]!r}")
+            if "ttft_ms" not in result:
+                result["ttft_ms"] = round((time.monotonic() - sent) * 1000, 1)
+            if record.get("error"):
+                raise UpstreamError(str(record["error"]))
+            if record.get("done"):
+                final = record
+            await out.put(dict(record, arena=tag))
+
+        try:
+            async with sem:
+                if scheduler is not None:
+                    ticket = scheduler.submit(model, user)
+                    await ticket.wait()
+                    result["queue_wait_ms"] = round(ticket.wait_ms, 1)
+                body = json.dumps(dict(payload, model=model, stream=True), ensure_ascii=False).encode("utf-8")
+                # TTFT/总耗时从真正发出上游请求算起，不含并发上限与调度排队的等待
+                sent = time.monotonic()
+                up = await self.proxy.pool.request("POST", "/api/chat", body, {"content-type": "application/json"})
+                try:
+                    if up.status != 200:
+                        text = (await up.read()).decode("utf-8", "replace")
+                        raise UpstreamError(f"HTTP {up.status}: {text[:200]}")
+                    tail = b""
+                    async for chunk in up.iter_chunks():
+                        lines = (tail + chunk).split(b"\n")
+                        tail = lines.pop()
+                        for line in lines:
+                            await emit(line)
+                    await emit(tail)
+                finally:
+                    up.release()
+            result.update(
+                status="ok",
+                total_ms=round((time.monotonic() - sent) * 1000, 1),
+                eval_count=final.get("eval_count"),
+                eval_tokens_per_sec=_rate(final.get("eval_count"), final.get("eval_duration")),
+                prompt_eval_count=final.get("prompt_eval_count"),
+                prompt_eval_tokens_per_sec=_rate(final.get("prompt_eval_count"), final.get("prompt_eval_duration")),
+                load_ms=round(final["load_duration"] / 1e6, 1) if isinstance(final.get("load_duration"), (int, float)) else None,
+            )
+        except (UpstreamError, QueueFull, OSError, ValueError, asyncio.IncompleteReadError) as e:
+            result["error"] = str(e)
+            await out.put({"arena": tag, "error": str(e)})
+        finally:
+            if ticket is not None:
+                scheduler.release(ticket)
+            await out.put(_END)
+
+    async def handle(self, req: Request, resp: Response) -> None:
+        try:
+            payload = req.json() or {}
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            await resp.send_error(400, "请求体不是合法 JSON")
+            return
+        models = payload.pop("models", None)
+        if not isinstance(models, list) or not models or not all(isinstance(m, str) and m for m in models):
+            await resp.send_error(400, "需要 models（模型名列表）")
+            return
+        models = list(dict.fromkeys(models))  # 去重，保持顺序
+        if len(models) > MAX_MODELS:
+            await resp.send_error(400, f"最多同时比较 {MAX_MODELS} 个模型")
+            return
+        if not isinstance(payload.get("messages"), list):
+            await resp.send_error(400, "需要 messages")
+            return
+        try:
+            concurrency = int(payload.pop("concurrency", self.max_concurrency))
+        except (TypeError, ValueError):
+            concurrency = self.max_concurrency
+        concurrency = max(1, min(concurrency, self.max_concurrency))
+        payload.pop("model", None)
+
+        self.runs += 1
+        sem = asyncio.Semaphore(concurrency)
+        out: "asyncio.Queue[Any]" = asyncio.Queue()
+        summary: Dict[str, Any] = {}
+        user = user_key(req)
+        tasks = [
+            asyncio.ensure_future(self._run_model(i, m, payload, user, sem, out, summary))
+            for i, m in enumerate(models)
+        ]
+        started = time.monotonic()
+
+        async def pump() -> None:
+            remaining = len(tasks)
+            while remaining:
+                item = await out.get()
+                if item is _END:
+                    remaining -= 1
+                    continue
+                await resp.write((json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8"))
+            final = {
+                "done": True,
+                "total_ms": round((time.monotonic() - started) * 1000, 1),
+                "concurrency": concurrency,
+                "arena_summary": {m: summary.get(m) for m in models},
+            }
+            await resp.write((json.dumps(final, ensure_ascii=False) + "\n").encode("utf-8"))
+
+        try:
+            await resp.start(200, headers={"X-Accel-Buffering": "no"})
+            # 模型加载、排队时长时间没有输出，写失败发现不了断开，需监视读端
+            await self.proxy._until_disconnect(resp, pump())
+            await resp.end()
+        finally:
+            # 浏览器断开：取消尚未结束的上游请求
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
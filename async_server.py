@@ -0,0 +1,564 @@
+#!/usr/bin/env python3
+"""
+异步 HTTP 服务器（asyncio），替代单线程的 socketserver.TCPServer
+- HTTP/1.1 keep-alive：单进程即可同时承载数百个长连接，慢客户端不会阻塞其他标签页
+- 路由按前缀注册（/api/ 代理等后续功能挂在这里），未命中时回退到静态文件
+- 可选多 worker：POSIX 下先绑定监听 socket 再 fork，由内核在各进程间分发连接
+- 保持与 server.MyHTTPRequestHandler 一致的 CORS 头
+"""
+
+from __future__ import annotations
+
+import asyncio
+import email.utils
+import json
+import mimetypes
+import os
+import posixpath
+import signal
+import socket
+import sys
+import time
+import urllib.parse
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+CORS_HEADERS: Tuple[Tuple[str, str], ...] = (
+    ("Access-Control-Allow-Origin", "*"),
+    ("Access-Control-Allow-Methods", "GET, POST, DELETE, OPTIONS"),
+    ("Access-Control-Allow-Headers", "Content-Type, If-None-Match"),
+)
+
+SERVER_NAME = "OllamaWebPanel"
+# 静态根目录下不对外提供的目录（服务端状态：聊天记录、缓存等）；另外所有以 . 开头的文件/目录都不提供
+PRIVATE_PATHS: Tuple[str, ...] = ("panel_data",)
+
+_date_cache: Tuple[int, str] = (0, "")
+
+
+def http_date(ts: Optional[float] = None) -> str:
+    """RFC 7231 日期；当前时间按秒缓存，避免每个响应都格式化一次"""
+    global _date_cache
+    if ts is not None:
+        return email.utils.formatdate(ts, usegmt=True)
+    now = int(time.time())
+    if _date_cache[0] != now:
+        _date_cache = (now, email.utils.formatdate(now, usegmt=True))
+    return _date_cache[1]
+
+
+class HTTPError(Exception):
+    """请求解析阶段的错误，直接映射为状态码并关闭连接"""
+
+    def __init__(self, status: int, message: str = ""):
+        super().__init__(message or HTTPStatus(status).phrase)
+        self.status = status
+
+
+@dataclass
+class Request:
+    method: str
+    target: str
+    version: str
+    headers: Dict[str, str]  # key 统一小写
+    body: bytes = b""
+    peer: str = ""
+    received_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def path(self) -> str:
+        return urllib.parse.unquote(self.target.split("?", 1)[0].split("#", 1)[0])
+
+    @property
+    def query(self) -> Dict[str, str]:
+        if "?" not in self.target:
+            return {}
+        qs = urllib.parse.parse_qs(self.target.split("?", 1)[1], keep_blank_values=True)
+        return {k: v[0] for k, v in qs.items()}
+
+    @property
+    def keep_alive(self) -> bool:
+        conn = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.1":
+            return "close" not in conn
+        return "keep-alive" in conn
+
+    def json(self) -> Any:
+        if not self.body:
+            return None
+        return json.loads(self.body.decode("utf-8"))
+
+
+class Response:
+    """
+    一个请求对应一个 Response。两种用法：
+    - send()/send_json()：一次性发送（带 Content-Length）
+    - start() + write()... + end()：chunked 流式发送（NDJSON 代理等）
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter, request: Request, reader: Optional[asyncio.StreamReader] = None):
+        self.writer = writer
+        self.request = request
+        self.reader = reader
+        self.keep_alive = request.keep_alive
+        self.status: Optional[int] = None
+        self.chunked = False
+        self.finished = False
+        self.bytes_sent = 0
+
+    @property
+    def started(self) -> bool:
+        return self.status is not None
+
+    @property
+    def client_gone(self) -> bool:
+        """浏览器已关闭连接（收到 EOF 或连接已断开）"""
+        if self.writer.transport.is_closing():
+            return True
+        return self.reader is not None and self.reader.at_eof()
+
+    async def wait_disconnected(self, interval: float = 0.25) -> None:
+        """轮询直到浏览器断开；用于在长时间无输出（排队、prompt 处理）时也能及时发现"""
+        while not self.client_gone:
+            await asyncio.sleep(interval)
+
+    def _head(self, status: int, headers: Dict[str, str]) -> bytes:
+        try:
+            reason = HTTPStatus(status).phrase
+        except ValueError:
+            reason = ""
+        lines = [f"HTTP/1.1 {status} {reason}", f"Date: {http_date()}", f"Server: {SERVER_NAME}"]
+        lines.extend(f"{k}: {v}" for k, v in headers.items())
+        lines.extend(f"{k}: {v}" for k, v in CORS_HEADERS)
+        lines.append("Connection: keep-alive" if self.keep_alive else "Connection: close")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def send(
+        self,
+        status: int,
+        body: bytes = b"",
+        content_type: Optional[str] = "text/plain; charset=utf-8",
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        if self.started:
+            raise RuntimeError("响应头已发送")
+        self.status = status
+        hdrs: Dict[str, str] = {}
+        if content_type and (body or status not in (204, 304)):
+            hdrs["Content-Type"] = content_type
+        hdrs.update(headers or {})
+        if status not in (204, 304):
+            hdrs.setdefault("Content-Length", str(len(body)))
+        payload = self._head(status, hdrs)
+        if self.request.method != "HEAD" and status not in (204, 304):
+            payload += body
+        self.writer.write(payload)
+        self.bytes_sent += len(body)
+        self.finished = True
+        await self.writer.drain()
+
+    async def send_json(self, status: int, obj: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        await self.send(status, body, content_type="application/json; charset=utf-8", headers=headers)
+
+    async def send_error(self, status: int, message: str = "") -> None:
+        await self.send_json(status, {"error": message or HTTPStatus(status).phrase})
+
+    async def start(
+        self,
+        status: int = 200,
+        content_type: Optional[str] = "application/x-ndjson",
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        if self.started:
+            raise RuntimeError("响应头已发送")
+        self.status = status
+        self.chunked = True
+        hdrs: Dict[str, str] = {}
+        if content_type:
+            hdrs["Content-Type"] = content_type
+        hdrs.update(headers or {})
+        hdrs["Transfer-Encoding"] = "chunked"
+        self.writer.write(self._head(status, hdrs))
+        await self.writer.drain()
+
+    async def write(self, data: bytes) -> None:
+        if not data or self.request.method == "HEAD":
+            return
+        self.writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.bytes_sent += len(data)
+        await self.writer.drain()
+
+    async def end(self) -> None:
+        if self.finished:
+            return
+        self.finished = True
+        if self.request.method != "HEAD":
+            self.writer.write(b"0\r\n\r\n")
+        await self.writer.drain()
+
+
+Handler = Callable[[Request, Response], Awaitable[None]]
+
+
+class AsyncHTTPServer:
+    def __init__(
+        self,
+        root: str,
+        log_requests: bool = True,
+        keepalive_timeout: float = 75.0,
+        max_header_bytes: int = 64 * 1024,
+        max_body_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.root = os.path.abspath(root)
+        self.log_requests = log_requests
+        self.keepalive_timeout = keepalive_timeout
+        self.max_header_bytes = max_header_bytes
+        self.max_body_bytes = max_body_bytes
+        self.routes: List[Tuple[str, Optional[Tuple[str, ...]], Handler]] = []
+        self.static_handler: Handler = self.serve_static
+        # 注入到 HTML </head> 之前的片段（例如告诉前端 /api 走同源代理）
+        self.head_snippets: List[str] = []
+        # 相对 root 的路径，静态文件请求命中时一律 404（见 translate_path）
+        self.private_paths: List[Tuple[str, ...]] = [tuple(p.lower().split("/")) for p in PRIVATE_PATHS]
+        self.connections = 0
+        self._startup: List[Callable[[], Awaitable[None]]] = []
+        self._shutdown: List[Callable[[], Awaitable[None]]] = []
+
+    # ------------------------------------------------------------------ 路由
+    def add_route(self, prefix: str, handler: Handler, methods: Optional[Tuple[str, ...]] = None) -> None:
+        """prefix 以 / 结尾时按前缀匹配，否则精确匹配；先注册的优先"""
+        self.routes.append((prefix, methods, handler))
+
+    def on_startup(self, fn: Callable[[], Awaitable[None]]) -> None:
+        self._startup.append(fn)
+
+    def on_shutdown(self, fn: Callable[[], Awaitable[None]]) -> None:
+        self._shutdown.append(fn)
+
+    def _match(self, req: Request) -> Handler:
+        path = req.path
+        for prefix, methods, handler in self.routes:
+            hit = path.startswith(prefix) if prefix.endswith("/") else path == prefix
+            if hit and (methods is None or req.method in methods):
+                return handler
+        return self.static_handler
+
+    # ------------------------------------------------------------------ 连接
+    async def _read_request(self, reader: asyncio.StreamReader, peer: str) -> Optional[Request]:
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keepalive_timeout)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(431)
+
+        lines = head.decode("latin-1").split("\r\n")
+        parts = lines[0].split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            raise HTTPError(400, f"请求行无效: {lines[0][:100]!r}")
+        method, target, version = parts
+
+        headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(":")
+            if not sep:
+                raise HTTPError(400, "请求头无效")
+            key = name.strip().lower()
+            value = value.strip()
+            headers[key] = f"{headers[key]}, {value}" if key in headers else value
+
+        return Request(method=method.upper(), target=target, version=version, headers=headers, peer=peer)
+
+    async def _read_body(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, req: Request) -> None:
+        te = req.headers.get("transfer-encoding", "").lower()
+        length = req.headers.get("content-length")
+        if not te and not length:
+            return
+        if req.headers.get("expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await writer.drain()
+
+        if "chunked" in te:
+            chunks: List[bytes] = []
+            total = 0
+            while True:
+                size_line = await self._read_body_part(reader.readuntil(b"\r\n"))
+                try:
+                    size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+                except ValueError:
+                    raise HTTPError(400, "chunk 大小无效")
+                if size < 0:
+                    raise HTTPError(400, "chunk 大小无效")
+                if size == 0:
+                    # 跳过 trailer
+                    while (await self._read_body_part(reader.readuntil(b"\r\n"))) != b"\r\n":
+                        pass
+                    break
+                total += size
+                if total > self.max_body_bytes:
+                    raise HTTPError(413)
+                chunks.append(await self._read_body_part(reader.readexactly(size)))
+                if await self._read_body_part(reader.readexactly(2)) != b"\r\n":
+                    raise HTTPError(400, "chunk 结尾缺少 CRLF")
+            req.body = b"".join(chunks)
+            return
+
+        try:
+            n = int(length or "0")
+        except ValueError:
+            raise HTTPError(400, "Content-Length 无效")
+        if n < 0:
+            raise HTTPError(400, "Content-Length 无效")
+        if n > self.max_body_bytes:
+            raise HTTPError(413)
+        if n:
+            req.body = await self._read_body_part(reader.readexactly(n))
+
+    async def _read_body_part(self, read: Awaitable[bytes]) -> bytes:
+        """每次读取请求体都有超时：慢速发送者不能无限期占住连接"""
+        try:
+            return await asyncio.wait_for(read, self.keepalive_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(408)
+        except asyncio.LimitOverrunError:
+            raise HTTPError(400, "chunk 行过长")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peername = writer.get_extra_info("peername")
+        peer = peername[0] if isinstance(peername, tuple) else str(peername or "")
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    req = await self._read_request(reader, peer)
+                    if req is None:
+                        break
+                    await self._read_body(reader, writer, req)
+                except HTTPError as e:
+                    bad = Request("GET", "/", "HTTP/1.0", {}, peer=peer)
+                    resp = Response(writer, bad)
+                    await resp.send_error(e.status, str(e))
+                    break
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                resp = Response(writer, req, reader)
+                await self._dispatch(req, resp)
+                if self.log_requests:
+                    self._log(req, resp)
+                if not resp.finished or not resp.keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections -= 1
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    async def _dispatch(self, req: Request, resp: Response) -> None:
+        if req.method == "OPTIONS":
+            # CORS 预检：SimpleHTTPRequestHandler 没有 do_OPTIONS（会回 501），这里直接放行
+            await resp.send(204, content_type=None)
+            return
+        try:
+            await self._match(req)(req, resp)
+            if resp.chunked and not resp.finished:
+                await resp.end()
+        except (ConnectionError, asyncio.CancelledError):
+            resp.keep_alive = False
+            raise
+        except Exception as e:
+            print(f"❌ 处理请求出错 {req.method} {req.target}: {type(e).__name__}: {e}", file=sys.stderr)
+            if not resp.started:
+                resp.keep_alive = False
+                await resp.send_error(500, f"{type(e).__name__}: {e}")
+            else:
+                # 已经开始流式输出，只能断开连接让客户端感知
+                resp.keep_alive = False
+
+    def _log(self, req: Request, resp: Response) -> None:
+        ts = time.strftime("%d/%b/%Y %H:%M:%S")
+        size = resp.bytes_sent if resp.bytes_sent else "-"
+        sys.stderr.write(f'{req.peer} - - [{ts}] "{req.method} {req.target} {req.version}" {resp.status} {size}\n')
+
+    # ------------------------------------------------------------------ 静态文件
+    def hide(self, path: str) -> None:
+        """不通过静态文件对外提供 path（位于 root 之外时无需处理）"""
+        rel = os.path.relpath(os.path.abspath(path), self.root)
+        if rel != "." and not rel.startswith(".."):
+            self.private_paths.append(tuple(rel.replace(os.sep, "/").lower().split("/")))
+
+    def translate_path(self, path: str) -> Optional[str]:
+        """与 SimpleHTTPRequestHandler.translate_path 相同的规则，拒绝 .. 越界；点文件与 private_paths 返回 None"""
+        trailing = path.endswith("/")
+        path = posixpath.normpath(path)
+        parts = [p for p in path.split("/") if p and p not in (".", "..")]
+        if any(p.startswith(".") for p in parts):
+            return None
+        # 按小写比较：大小写不敏感的文件系统（macOS、Windows）上 /Panel_Data/ 指向同一目录
+        lowered = tuple(p.lower() for p in parts)
+        if any(lowered[: len(hidden)] == hidden for hidden in self.private_paths):
+            return None
+        full = os.path.join(self.root, *parts)
+        if not os.path.abspath(full).startswith(self.root):
+            return None
+        if trailing:
+            full += os.sep
+        return full
+
+    async def serve_static(self, req: Request, resp: Response) -> None:
+        if req.method not in ("GET", "HEAD"):
+            await resp.send_error(501, f"不支持的方法: {req.method}")
+            return
+        full = self.translate_path(req.path)
+        if full is None:
+            await resp.send_error(404)
+            return
+        if os.path.isdir(full):
+            if not req.path.endswith("/"):
+                await resp.send(301, headers={"Location": req.path + "/"})
+                return
+            full = os.path.join(full, "index.html")
+        try:
+            st = os.stat(full)
+        except OSError:
+            await resp.send_error(404, "File not found")
+            return
+        if not os.path.isfile(full):
+            await resp.send_error(404, "File not found")
+            return
+
+        last_modified = http_date(st.st_mtime)
+        ims = req.headers.get("if-modified-since")
+        if ims:
+            try:
+                if int(st.st_mtime) <= email.utils.parsedate_to_datetime(ims).timestamp():
+                    await resp.send(304, content_type=None, headers={"Last-Modified": last_modified})
+                    return
+            except (TypeError, ValueError):
+                pass
+
+        ctype = mimetypes.guess_type(full)[0] or "application/octet-stream"
+        if ctype.startswith("text/") or ctype in ("application/javascript", "application/json"):
+            ctype += "; charset=utf-8"
+        loop = asyncio.get_running_loop()
+        body = await loop.run_in_executor(None, _read_file, full)
+        if self.head_snippets and full.endswith(".html"):
+            body = self.inject_head(body)
+        await resp.send(200, body, content_type=ctype, headers={"Last-Modified": last_modified})
+
+    def inject_head(self, html: bytes) -> bytes:
+        snippet = "".join(self.head_snippets).encode("utf-8")
+        idx = html.find(b"</head>")
+        return html[:idx] + snippet + html[idx:] if idx >= 0 else snippet + html
+
+    # ------------------------------------------------------------------ 运行
+    async def serve(self, sock: socket.socket, ready: Optional["asyncio.Future[None]"] = None) -> None:
+        """执行 on_startup 后开始接受连接；ready 不为空时在可以接受连接的那一刻置为完成"""
+        for fn in self._startup:
+            await fn()
+        server = await asyncio.start_server(self.handle_connection, sock=sock, limit=self.max_header_bytes)
+        if ready is not None and not ready.done():
+            ready.set_result(None)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for fn in self._shutdown:
+                try:
+                    await fn()
+                except Exception:
+                    pass
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def create_listen_socket(host: str, port: int, backlog: int = 1024) -> socket.socket:
+    family = socket.AF_INET6 if host and ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+async def _serve_until_terminated(app: AsyncHTTPServer, sock: socket.socket) -> None:
+    """收到 SIGTERM（systemd/docker stop、父进程转发）时停止 serve()，让 on_shutdown 钩子照常执行"""
+    task = asyncio.ensure_future(app.serve(sock))
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+    except (NotImplementedError, AttributeError):  # Windows 事件循环不支持
+        pass
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def _serve_in_process(sock: socket.socket, app_factory: Callable[[], AsyncHTTPServer]) -> None:
+    app = app_factory()
+    try:
+        asyncio.run(_serve_until_terminated(app, sock))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_server(host: str, port: int, app_factory: Callable[[], AsyncHTTPServer], workers: int = 1) -> None:
+    """
+    绑定端口并运行。workers>1 时在 POSIX 下 fork 出多个进程共享同一个监听 socket；
+    每个 worker 调用 app_factory() 构建自己的应用（事件循环、连接池等不跨进程共享）。
+    """
+    sock = create_listen_socket(host, port)
+    if workers > 1 and not hasattr(os, "fork"):
+        print("⚠️  当前平台不支持 fork，--workers 回退为 1")
+        workers = 1
+
+    if workers <= 1:
+        _serve_in_process(sock, app_factory)
+        return
+
+    def _on_term(signum, frame):
+        raise KeyboardInterrupt
+
+    # 父进程收到 SIGTERM（systemd/docker stop）时同样转发给所有 worker；先装好再 fork，避免窗口期内被直接杀死
+    signal.signal(signal.SIGTERM, _on_term)
+    pids: List[int] = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _serve_in_process(sock, app_factory)
+            except Exception as e:
+                print(f"❌ worker 异常退出: {type(e).__name__}: {e}", file=sys.stderr)
+                code = 1
+            finally:
+                os._exit(code)
+        pids.append(pid)
+
+    try:
+        for pid in pids:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in pids:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+    finally:
+        sock.close()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+面板服务器压测：对比 --legacy（单线程 TCPServer）与 asyncio 模式的吞吐和延迟
+- 每个并发连接循环请求静态资源，能复用连接就复用（legacy 是 HTTP/1.0，每次重连）
+- 可选 --slow-clients：额外挂起若干只发了半个请求头的连接，模拟慢客户端
+- 输出 requests/sec、p50/p99 延迟与错误数
+
+用法:
+    python bench_server.py --concurrency 100 --duration 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATHS = ("/", "/style.css", "/js/ui.js", "/js/chat.js", "/js/api.js")
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """最近秩法百分位，q 取 0~100"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(q / 100.0 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"端口 {port} 未就绪")
+
+
+async def read_response(reader: asyncio.StreamReader) -> Tuple[int, bool]:
+    """读取一个完整响应，返回 (状态码, 服务端是否保持连接)"""
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    version, status = lines[0].split()[:2]
+    headers: Dict[str, str] = {}
+    for line in lines[1:]:
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+    keep = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+    if "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    elif "chunked" in headers.get("transfer-encoding", ""):
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.read()
+        keep = False
+    return int(status), keep
+
+
+async def _client(port: int, paths: Sequence[str], stop_at: float, timeout: float,
+                  latencies: List[float], errors: List[str]) -> None:
+    reader: Optional[asyncio.StreamReader] = None
+    writer: Optional[asyncio.StreamWriter] = None
+    i = 0
+    while time.perf_counter() < stop_at:
+        path = paths[i % len(paths)]
+        i += 1
+        t0 = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+            status, keep = await asyncio.wait_for(read_response(reader), timeout)
+            if status >= 400:
+                errors.append(f"HTTP {status}")
+            else:
+                latencies.append(time.perf_counter() - t0)
+            if not keep:
+                writer.close()
+                writer = None
+        except (asyncio.TimeoutError, OSError, asyncio.IncompleteReadError, ValueError) as e:
+            errors.append(type(e).__name__)
+            if writer is not None:
+                writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def _slow_client(port: int, hold: float) -> None:
+    try:
+        _, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET / HTTP/1.1\r\nHost: loc")
+        await writer.drain()
+        await asyncio.sleep(hold)
+        writer.close()
+    except OSError:
+        pass
+
+
+async def run_load(port: int, concurrency: int, duration: float, paths: Sequence[str],
+                   timeout: float = 5.0, slow_clients: int = 0) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors: List[str] = []
+    slow = [asyncio.ensure_future(_slow_client(port, duration + timeout)) for _ in range(slow_clients)]
+    await asyncio.sleep(0.2 if slow_clients else 0)
+    t0 = time.perf_counter()
+    stop_at = t0 + duration
+    await asyncio.gather(*(_client(port, paths, stop_at, timeout, latencies, errors) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    for t in slow:
+        t.cancel()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def start_server(extra: List[str], port: int) -> subprocess.Popen:
+    cmd = [sys.executable, os.path.join(ROOT, "server.py"), "--port", str(port)] + extra
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_port(port)
+    return proc
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="legacy vs asyncio 面板服务器压测")
+    ap.add_argument("--concurrency", type=int, default=100)
+    ap.add_argument("--duration", type=float, default=10.0)
+    ap.add_argument("--workers", type=int, default=1, help="asyncio 模式的 worker 数")
+    ap.add_argument("--slow-clients", type=int, default=0, help="额外挂起的慢客户端数量")
+    ap.add_argument("--timeout", type=float, default=5.0, help="单请求超时（秒）")
+    ap.add_argument("--modes", type=str, default="legacy,asyncio")
+    ap.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = ap.parse_args()
+
+    results: Dict[str, Dict[str, float]] = {}
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        port = free_port()
+        extra = ["--legacy"] if mode == "legacy" else ["--quiet", "--workers", str(args.workers)]
+        if mode != "legacy" and args.workers > 1:
+            extra.append("--no-scheduler")  # 只压测静态文件；调度器仅支持单 worker
+        proc = start_server(extra, port)
+        try:
+            if not args.json:
+                print(f"⏳ 压测 {mode}（并发 {args.concurrency}，{args.duration:.0f}s）...")
+            results[mode] = asyncio.run(run_load(port, args.concurrency, args.duration, DEFAULT_PATHS,
+                                                 timeout=args.timeout, slow_clients=args.slow_clients))
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"\n{'mode':<10}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50(ms)':>10}{'p99(ms)':>10}")
+    for mode, r in results.items():
+        print(f"{mode:<10}{r['requests']:>10}{r['errors']:>8}{r['rps']:>10.1f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
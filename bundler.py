@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+js/*.js 单文件打包（server.py --bundle）
+- 按 index.html 中 <script src> 的出现顺序（即依赖顺序 state -> utils -> storage -> api -> ui -> chat -> main）拼接
+- 产物按内容哈希命名为 js/bundle.<hash>.js，以 immutable 长缓存下发
+- index.html 被改写为只引用这一个 bundle；任一源文件或 index.html 变化后自动重建
+- 不改变运行方式：仍是经典脚本（非 ESM），拼接后的全局作用域与多 <script> 加载一致
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import re
+import sys
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from async_server import AsyncHTTPServer, Handler, Request, Response
+from static_cache import Asset, AssetCache, make_asset
+
+SCRIPT_TAG = re.compile(rb'[ \t]*<script\s+src="([^"]+)"\s*>\s*</script>[ \t]*\r?\n?', re.I)
+IMMUTABLE = "public, max-age=31536000, immutable"
+KEEP_OLD_BUNDLES = 3
+
+Signature = Tuple[Tuple[str, int, int], ...]
+
+
+@dataclass
+class Bundle:
+    name: str  # 例如 js/bundle.3f2a9c1b7e40.js
+    sources: List[str]
+    index: Asset
+    script: Asset
+    signature: Signature
+
+
+def _is_local(src: str) -> bool:
+    return "://" not in src and not src.startswith("//")
+
+
+def _signature(root: str, rel_paths: List[str]) -> Signature:
+    sig = []
+    for rel in rel_paths:
+        st = os.stat(os.path.join(root, rel))
+        sig.append((rel, st.st_mtime_ns, st.st_size))
+    return tuple(sig)
+
+
+def build_bundle(root: str, index_name: str, transform: Optional[Callable[[str, bytes], bytes]] = None) -> Bundle:
+    index_path = os.path.join(root, index_name)
+    with open(index_path, "rb") as f:
+        html = f.read()
+
+    sources = [m.group(1).decode("utf-8") for m in SCRIPT_TAG.finditer(html) if _is_local(m.group(1).decode("utf-8"))]
+    if not sources:
+        raise ValueError(f"{index_name} 中没有可打包的 <script src>")
+
+    parts: List[bytes] = []
+    for src in sources:
+        with open(os.path.join(root, src.lstrip("/")), "rb") as f:
+            code = f.read()
+        # 分号兜底：防止上一个文件末尾缺分号与下一个文件首行拼成一条语句
+        parts.append(b"// ---- " + src.encode("utf-8") + b" ----\n" + code.rstrip() + b"\n;\n")
+    code = b"".join(parts)
+    digest = hashlib.sha256(code).hexdigest()[:12]
+    name = f"js/bundle.{digest}.js"
+
+    replaced = {"first": True}
+
+    def _rewrite(m: "re.Match[bytes]") -> bytes:
+        if not _is_local(m.group(1).decode("utf-8")):
+            return m.group(0)
+        if replaced["first"]:
+            replaced["first"] = False
+            indent = re.match(rb"[ \t]*", m.group(0)).group(0)
+            return indent + f'<script src="{name}"></script>\n'.encode("utf-8")
+        return b""
+
+    new_html = SCRIPT_TAG.sub(_rewrite, html)
+    if transform is not None:
+        new_html = transform(index_path, new_html)
+
+    signature = _signature(root, [index_name] + [s.lstrip("/") for s in sources])
+    now_ns = time.time_ns()
+    return Bundle(
+        name=name,
+        sources=sources,
+        index=make_asset(index_path, new_html, now_ns, len(new_html)),
+        script=make_asset(name, code, now_ns, len(code)),
+        signature=signature,
+    )
+
+
+class ScriptBundler:
+    def __init__(self, app: AsyncHTTPServer, assets: AssetCache, index_name: str = "index.html", check_interval: float = 1.0):
+        self.app = app
+        self.assets = assets
+        self.index_name = index_name
+        self.check_interval = check_interval
+        self.fallback: Handler = app.static_handler
+        self._current: Optional[Bundle] = None
+        self._recent: Dict[str, Bundle] = {}  # 保留最近几个版本，避免重建瞬间旧页面拿不到 bundle
+        self._checked_at = 0.0
+        self._building: Optional["asyncio.Future[Bundle]"] = None
+        self.builds = 0
+
+    def install(self) -> None:
+        """包装当前静态处理器：只接管 /、/index.html 和 /js/bundle.*.js"""
+        self.fallback = self.app.static_handler
+        self.app.static_handler = self.handle
+
+    def _transform(self, path: str, body: bytes) -> bytes:
+        return self.app.inject_head(body) if self.app.head_snippets else body
+
+    def _stale(self) -> bool:
+        if self._current is None:
+            return True
+        rels = [rel for rel, _, _ in self._current.signature]
+        try:
+            return _signature(self.app.root, rels) != self._current.signature
+        except OSError:
+            return True
+
+    async def current(self) -> Optional[Bundle]:
+        # 正在打包时一律等待这次打包：否则首次打包期间到达的请求会拿到未打包的 index.html
+        if self._building is None:
+            now = time.monotonic()
+            if now - self._checked_at < self.check_interval:
+                return self._current
+            self._checked_at = now
+            if not self._stale():
+                return self._current
+            loop = asyncio.get_running_loop()
+            self._building = loop.run_in_executor(None, build_bundle, self.app.root, self.index_name, self._transform)
+        fut = self._building
+        try:
+            bundle = await fut
+        except Exception as e:
+            if self._building is fut:  # 同一次失败只报一次
+                print(f"⚠️  打包 js 失败，回退为逐个加载: {type(e).__name__}: {e}", file=sys.stderr)
+            self._current = None
+            return None
+        finally:
+            if self._building is fut:
+                self._building = None
+
+        if bundle is not self._current:
+            self._current = bundle
+            self._recent.pop(bundle.name, None)
+            self._recent[bundle.name] = bundle
+            while len(self._recent) > KEEP_OLD_BUNDLES:
+                self._recent.pop(next(iter(self._recent)))
+            self.builds += 1
+        return self._current
+
+    async def handle(self, req: Request, resp: Response) -> None:
+        path = req.path
+        if req.method in ("GET", "HEAD"):
+            if path in ("/", "/" + self.index_name):
+                bundle = await self.current()
+                if bundle is not None:
+                    await self.assets.send_asset(req, resp, bundle.index, "no-cache")
+                    return
+            elif path.startswith("/js/bundle.") and path.endswith(".js"):
+                await self.current()
+                bundle = self._recent.get(path.lstrip("/"))
+                if bundle is None:
+                    await resp.send_error(404, "bundle 不存在（可能已过期，请刷新页面）")
+                    return
+                await self.assets.send_asset(req, resp, bundle.script, IMMUTABLE)
+                return
+        await self.fallback(req, resp)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+服务端聊天记录存储（替代 localStorage 整体重写）
+- SQLite + WAL：每条消息一行，只追加；多个 worker 进程可同时读写同一个库文件
+- 按游标分页读取（id 递减翻页），长对话打开时只取最近一页
+- 所有 SQLite 调用都在单线程执行器里串行执行，不阻塞事件循环
+- summaries 表保存长对话的滚动摘要（见 compaction.py），按对话前缀哈希索引，清空聊天时一并删除
+
+HTTP 接口（挂在 /panel/chats 下）:
+    GET    /panel/chats/messages?agent=<模型名>&before=<id>&limit=<n>
+    POST   /panel/chats/messages   {"agent": ..., "messages": [{"role", "content"}], "only_if_empty": false}
+    DELETE /panel/chats?agent=<模型名>
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from async_server import Request, Response
+
+DEFAULT_PAGE = 50
+MAX_PAGE = 500
+VALID_ROLES = ("system", "user", "assistant", "tool")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    agent TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_agent_id ON messages(agent, id);
+CREATE TABLE IF NOT EXISTS summaries (
+    prefix_hash TEXT PRIMARY KEY,
+    agent TEXT NOT NULL,
+    covered INTEGER NOT NULL,
+    summary TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_summaries_agent ON summaries(agent, covered);
+"""
+
+
+def normalize_agent(name: str) -> str:
+    """与前端 getModelNameAliases 对齐：qwen2.5 与 qwen2.5:latest 视为同一个智能体"""
+    name = (name or "").strip()
+    if name and ":" not in name.rsplit("/", 1)[-1]:
+        name += ":latest"
+    return name
+
+
+class ChatStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-store")
+        self._local = threading.local()
+
+    # ------------------------------------------------------------------ 同步实现（执行器线程内）
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def append_sync(self, agent: str, messages: List[Dict[str, Any]], only_if_empty: bool = False) -> List[int]:
+        agent = normalize_agent(agent)
+        conn = self._conn()
+        with conn:
+            if only_if_empty:
+                row = conn.execute("SELECT 1 FROM messages WHERE agent = ? LIMIT 1", (agent,)).fetchone()
+                if row is not None:
+                    return []
+            now = time.time()
+            ids = []
+            for msg in messages:
+                cur = conn.execute(
+                    "INSERT INTO messages (agent, role, content, created_at) VALUES (?, ?, ?, ?)",
+                    (agent, msg["role"], msg["content"], float(msg.get("created_at") or now)),
+                )
+                ids.append(int(cur.lastrowid))
+        return ids
+
+    def page_sync(self, agent: str, before: Optional[int] = None, limit: int = DEFAULT_PAGE) -> Dict[str, Any]:
+        agent = normalize_agent(agent)
+        limit = max(1, min(int(limit), MAX_PAGE))
+        conn = self._conn()
+        if before is None:
+            rows = conn.execute(
+                "SELECT id, role, content, created_at FROM messages WHERE agent = ? ORDER BY id DESC LIMIT ?",
+                (agent, limit + 1),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT id, role, content, created_at FROM messages WHERE agent = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (agent, int(before), limit + 1),
+            ).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        messages = [{"id": r[0], "role": r[1], "content": r[2], "created_at": r[3]} for r in rows]
+        return {
+            "agent": agent,
+            "messages": messages,
+            "has_more": has_more,
+            "next_before": messages[0]["id"] if messages and has_more else None,
+        }
+
+    def clear_sync(self, agent: str) -> int:
+        agent = normalize_agent(agent)
+        conn = self._conn()
+        with conn:
+            cur = conn.execute("DELETE FROM messages WHERE agent = ?", (agent,))
+            conn.execute("DELETE FROM summaries WHERE agent = ?", (agent,))
+        return cur.rowcount
+
+    def count_sync(self, agent: str) -> int:
+        row = self._conn().execute("SELECT COUNT(*) FROM messages WHERE agent = ?", (normalize_agent(agent),)).fetchone()
+        return int(row[0])
+
+    def summaries_sync(self, agent: str) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT prefix_hash, covered, summary, created_at FROM summaries WHERE agent = ? ORDER BY covered",
+            (normalize_agent(agent),),
+        ).fetchall()
+        return [{"prefix_hash": r[0], "covered": r[1], "summary": r[2], "created_at": r[3]} for r in rows]
+
+    def put_summary_sync(self, agent: str, prefix_hash: str, covered: int, summary: str, keep: int = 8) -> None:
+        """保存一条摘要；每个智能体只保留覆盖范围最大的 keep 条"""
+        agent = normalize_agent(agent)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO summaries (prefix_hash, agent, covered, summary, created_at) VALUES (?, ?, ?, ?, ?)",
+                (prefix_hash, agent, int(covered), summary, time.time()),
+            )
+            conn.execute(
+                "DELETE FROM summaries WHERE agent = ? AND prefix_hash NOT IN "
+                "(SELECT prefix_hash FROM summaries WHERE agent = ? ORDER BY covered DESC, created_at DESC LIMIT ?)",
+                (agent, agent, keep),
+            )
+
+    # ------------------------------------------------------------------ 异步包装
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def append(self, agent: str, messages: List[Dict[str, Any]], only_if_empty: bool = False) -> List[int]:
+        return await self._run(self.append_sync, agent, messages, only_if_empty)
+
+    async def page(self, agent: str, before: Optional[int] = None, limit: int = DEFAULT_PAGE) -> Dict[str, Any]:
+        return await self._run(self.page_sync, agent, before, limit)
+
+    async def clear(self, agent: str) -> int:
+        return await self._run(self.clear_sync, agent)
+
+    async def summaries(self, agent: str) -> List[Dict[str, Any]]:
+        return await self._run(self.summaries_sync, agent)
+
+    async def put_summary(self, agent: str, prefix_hash: str, covered: int, summary: str) -> None:
+        await self._run(self.put_summary_sync, agent, prefix_hash, covered, summary)
+
+    async def close(self) -> None:
+        def _close():
+            conn = getattr(self._local, "conn", None)
+            if conn is not None:
+                conn.close()
+                self._local.conn = None
+
+        await self._run(_close)
+        self._executor.shutdown(wait=False)
+
+
+class ChatStoreAPI:
+    def __init__(self, store: ChatStore):
+        self.store = store
+
+    def install(self, app) -> None:
+        app.add_route("/panel/chats/messages", self.handle_messages, methods=("GET", "POST"))
+        app.add_route("/panel/chats", self.handle_clear, methods=("DELETE",))
+
+    async def handle_messages(self, req: Request, resp: Response) -> None:
+        if req.method == "GET":
+            q = req.query
+            agent = q.get("agent", "")
+            if not agent:
+                await resp.send_error(400, "缺少 agent 参数")
+                return
+            try:
+                before = int(q["before"]) if q.get("before") else None
+                limit = int(q.get("limit") or DEFAULT_PAGE)
+            except ValueError:
+                await resp.send_error(400, "before/limit 必须是整数")
+                return
+            await resp.send_json(200, await self.store.page(agent, before, limit))
+            return
+
+        try:
+            payload = req.json() or {}
+        except ValueError:
+            await resp.send_error(400, "请求体不是合法 JSON")
+            return
+        agent = payload.get("agent") or ""
+        messages = payload.get("messages")
+        if messages is None and "role" in payload:
+            messages = [payload]
+        if not agent or not isinstance(messages, list):
+            await resp.send_error(400, "需要 agent 和 messages")
+            return
+        for msg in messages:
+            if not isinstance(msg, dict) or msg.get("role") not in VALID_ROLES or not isinstance(msg.get("content"), str):
+                await resp.send_error(400, "消息格式应为 {role, content}")
+                return
+        ids = await self.store.append(agent, messages, bool(payload.get("only_if_empty")))
+        await resp.send_json(200, {"ids": ids})
+
+    async def handle_clear(self, req: Request, resp: Response) -> None:
+        agent = req.query.get("agent", "")
+        if not agent:
+            await resp.send_error(400, "缺少 agent 参数")
+            return
+        await resp.send_json(200, {"deleted": await self.store.clear(agent)})
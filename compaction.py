@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+长对话压缩：用滚动摘要代替早期轮次（可选，--compact-model 开启）
+- /api/chat 的对话部分（开头的 system 消息之外）超过 num_ctx × threshold 时生效：
+  最近 num_ctx × keep 以内的消息原样保留，更早的轮次由小模型在后台总结成一段摘要
+- 摘要按“对话前缀哈希”保存（有聊天存储时写入 SQLite 的 summaries 表，否则只在内存里）：
+  之后的请求只要前缀相同就能直接复用，发给上游的是 system + 摘要 + 摘要之后的消息
+- 摘要在后台生成，不阻塞当前请求；还没有摘要时本次请求照常转发（由历史裁剪兜底）
+- 摘要之后累积的旧消息超过 keep 的一半时，以“旧摘要 + 新增轮次”滚动生成新摘要，上游 prompt 长度因此保持平稳
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import sys
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from chat_store import normalize_agent
+from context_budget import ContextBudget
+from ollama_proxy import UpstreamError
+from scheduler import QueueFull
+
+SUMMARY_PROMPT = (
+    "你是对话摘要助手。请把给出的角色扮演对话整理成一段简洁的中文摘要，供角色继续对话时参考。\n"
+    "要求：保留人物名字、身份与相互关系，关键事件与时间顺序，已做出的约定和未解决的悬念，"
+    "以及角色的说话风格与态度变化；不要编造对话中没有的内容；直接输出摘要，不要加标题或解释。"
+)
+SUMMARY_HEADER = "以下是此前对话的摘要，请据此保持剧情与人物设定连贯：\n"
+ROLE_NAMES = {"user": "用户", "assistant": "角色", "system": "系统", "tool": "工具"}
+SCHEDULER_USER = "panel-compaction"
+
+
+def prefix_hashes(messages: List[Dict[str, Any]]) -> List[str]:
+    """hashes[k] 是 messages[:k] 的哈希（k = 0..len(messages)）"""
+    h = hashlib.sha256()
+    out = [h.hexdigest()]
+    for msg in messages:
+        h.update(json.dumps([msg.get("role"), msg.get("content")], ensure_ascii=False).encode("utf-8"))
+        h.update(b"\n")
+        out.append(h.copy().hexdigest())
+    return out
+
+
+@dataclass
+class Compaction:
+    messages: List[Dict[str, Any]]
+    covered: int  # 被摘要替代的消息数（含开头的 system 消息）
+    summary_tokens: int
+    saved_tokens: int
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-Panel-Compacted-Messages": str(self.covered),
+            "X-Panel-Summary-Tokens": str(self.summary_tokens),
+        }
+
+
+class Compactor:
+    def __init__(
+        self,
+        proxy,
+        model: str,
+        store=None,
+        threshold: float = 0.6,
+        keep: float = 0.3,
+        counter: Optional[ContextBudget] = None,
+        num_predict: int = 512,
+    ):
+        self.proxy = proxy
+        self.model = model
+        self.store = store
+        self.threshold = threshold
+        self.keep = keep
+        self.counter = counter or ContextBudget()
+        self.num_predict = num_predict
+        self._memory: Dict[str, List[Dict[str, Any]]] = {}  # 没有聊天存储时的摘要
+        self._jobs: Dict[str, "asyncio.Task[None]"] = {}  # 智能体 -> 正在生成的摘要任务
+        self.applied = 0
+        self.created = 0
+        self.failures = 0
+        self.saved_tokens = 0
+
+    # ------------------------------------------------------------------ 摘要存取
+    async def _summaries(self, agent: str) -> List[Dict[str, Any]]:
+        if self.store is not None:
+            return await self.store.summaries(agent)
+        return list(self._memory.get(agent, []))
+
+    async def _save(self, agent: str, prefix_hash: str, covered: int, summary: str) -> None:
+        if self.store is not None:
+            await self.store.put_summary(agent, prefix_hash, covered, summary)
+            return
+        rows = [r for r in self._memory.get(agent, []) if r["prefix_hash"] != prefix_hash]
+        rows.append({"prefix_hash": prefix_hash, "covered": covered, "summary": summary})
+        self._memory[agent] = sorted(rows, key=lambda r: r["covered"])[-8:]
+
+    # ------------------------------------------------------------------ 压缩
+    @staticmethod
+    def _split(messages: List[Dict[str, Any]], costs: List[float], start: int, recent_budget: float) -> Optional[int]:
+        """从末尾往前保留 recent_budget 以内的消息，返回第一条保留消息的下标（对齐到 user 消息）"""
+        used = 0.0
+        split = len(messages) - 1  # 最后一条必留
+        used += costs[split]
+        while split - 1 >= start and used + costs[split - 1] <= recent_budget:
+            split -= 1
+            used += costs[split]
+        while split < len(messages) - 1 and messages[split].get("role") != "user":
+            split += 1
+        return split if split > start else None
+
+    async def apply(self, payload: Dict[str, Any], show: Optional[Dict[str, Any]] = None) -> Optional[Compaction]:
+        messages = payload.get("messages")
+        model = payload.get("model")
+        if not isinstance(model, str) or not isinstance(messages, list) or not messages:
+            return None
+        if not all(isinstance(m, dict) for m in messages):
+            return None
+        start = 0
+        while start < len(messages) and messages[start].get("role") == "system":
+            start += 1
+        costs = [self.counter.count(model, m) for m in messages]
+        num_ctx = self.counter.num_ctx(payload, show)
+        if sum(costs[start:]) <= num_ctx * self.threshold:
+            return None
+        split = self._split(messages, costs, start, num_ctx * self.keep)
+        if split is None:
+            return None
+
+        agent = normalize_agent(model)
+        hashes = prefix_hashes(messages)
+        known = {row["prefix_hash"]: row for row in await self._summaries(agent)}
+        best: Optional[Dict[str, Any]] = None
+        covered = start
+        for k in range(split, start, -1):
+            if hashes[k] in known:
+                best, covered = known[hashes[k]], k
+                break
+
+        # 没有摘要，或摘要之后又积累了足够多的旧消息：后台滚动生成覆盖到 split 的新摘要
+        if best is None or sum(costs[covered:split]) > num_ctx * self.keep / 2:
+            self._schedule(agent, messages, start, covered, split, hashes[split], best)
+        if best is None:
+            return None
+
+        note = {"role": "system", "content": SUMMARY_HEADER + best["summary"]}
+        summary_tokens = int(round(self.counter.count(model, note)))
+        saved = int(round(sum(costs[start:covered]))) - summary_tokens
+        self.applied += 1
+        self.saved_tokens += max(0, saved)
+        return Compaction(
+            messages=messages[:start] + [note] + messages[covered:],
+            covered=covered,
+            summary_tokens=summary_tokens,
+            saved_tokens=saved,
+        )
+
+    def _schedule(
+        self,
+        agent: str,
+        messages: List[Dict[str, Any]],
+        start: int,
+        covered: int,
+        split: int,
+        prefix_hash: str,
+        previous: Optional[Dict[str, Any]],
+    ) -> None:
+        job = self._jobs.get(agent)
+        if job is not None and not job.done():
+            return  # 同一智能体同时只生成一份摘要，下次请求再接着滚动
+        system = "\n".join(str(m.get("content") or "") for m in messages[:start])
+        task = asyncio.ensure_future(self._run(
+            agent, system, previous["summary"] if previous else "", messages[covered:split], split, prefix_hash
+        ))
+        self._jobs[agent] = task
+
+    async def _run(
+        self, agent: str, system: str, previous: str, turns: List[Dict[str, Any]], covered: int, prefix_hash: str
+    ) -> None:
+        try:
+            summary = await self.summarize(system, previous, turns)
+            await self._save(agent, prefix_hash, covered, summary)
+            self.created += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failures += 1
+            print(f"⚠️  生成对话摘要失败（{agent}）: {type(e).__name__}: {e}", file=sys.stderr)
+
+    async def summarize(self, system: str, previous: str, turns: List[Dict[str, Any]]) -> str:
+        parts = []
+        if system:
+            parts.append(f"【角色设定】\n{system}")
+        if previous:
+            parts.append(f"【已有摘要】\n{previous}")
+        lines = [f"{ROLE_NAMES.get(m.get('role'), m.get('role'))}：{m.get('content') or ''}" for m in turns]
+        parts.append("【新的对话】\n" + "\n".join(lines))
+        parts.append("请输出合并了已有摘要与新对话的完整摘要。" if previous else "请输出摘要。")
+        body = json.dumps({
+            "model": self.model,
+            "stream": False,
+            "messages": [
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": "\n\n".join(parts)},
+            ],
+            "options": {"temperature": 0.2, "num_predict": self.num_predict},
+        }, ensure_ascii=False).encode("utf-8")
+
+        # 经过调度器：摘要任务与用户请求一起排队，不抢占并发额度
+        scheduler = self.proxy.scheduler
+        ticket = None
+        try:
+            if scheduler is not None:
+                ticket = scheduler.submit(self.model, SCHEDULER_USER)
+                await ticket.wait()
+            up = await self.proxy.pool.request("POST", "/api/chat", body, {"content-type": "application/json"})
+            try:
+                data = await up.read()
+            finally:
+                up.release()
+        except QueueFull as e:
+            raise UpstreamError(str(e)) from e
+        finally:
+            if ticket is not None:
+                scheduler.release(ticket)
+        if up.status != 200:
+            raise UpstreamError(f"HTTP {up.status}: {data[:200].decode('utf-8', 'replace')}")
+        summary = str((json.loads(data).get("message") or {}).get("content") or "").strip()
+        if not summary:
+            raise UpstreamError("摘要为空")
+        return summary
+
+    async def close(self) -> None:
+        for task in self._jobs.values():
+            task.cancel()
+        await asyncio.gather(*self._jobs.values(), return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "applied": self.applied,
+            "summaries_created": self.created,
+            "failures": self.failures,
+            "saved_tokens": self.saved_tokens,
+            "running": sum(1 for t in self._jobs.values() if not t.done()),
+        }
@@ -0,0 +1,32 @@
+"""
+测试共用的辅助函数：在随机端口启动 / 停止 AsyncHTTPServer
+- pytest 自动加载本文件；测试脚本单独运行（python test_xxx.py）时也能直接 from conftest import
+- 等 serve() 通知就绪后才返回，不靠 sleep 猜测启动耗时
+"""
+
+import asyncio
+from typing import Tuple
+
+from async_server import AsyncHTTPServer, create_listen_socket
+
+
+async def serve_app(app: AsyncHTTPServer) -> Tuple["asyncio.Task[None]", int]:
+    """后台启动 app，返回 (任务, 端口)；on_startup 或监听失败时直接抛出"""
+    sock = create_listen_socket("127.0.0.1", 0)
+    ready = asyncio.get_running_loop().create_future()
+    task = asyncio.ensure_future(app.serve(sock, ready))
+    await asyncio.wait({ready, task}, return_when=asyncio.FIRST_COMPLETED)
+    if task.done():
+        sock.close()
+        task.result()
+    return task, sock.getsockname()[1]
+
+
+async def stop_tasks(*tasks: "asyncio.Task[None]") -> None:
+    """取消 serve_app 启动的任务并等待 on_shutdown 执行完"""
+    for t in tasks:
+        t.cancel()
+        try:
+            await t
+        except asyncio.CancelledError:
+            pass
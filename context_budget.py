@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+/api/chat 的历史裁剪：把 messages 控制在智能体 num_ctx 的一定比例内
+- 始终保留 system 消息和最后一条消息；其余从最近往前保留，放不下的旧轮次整体丢弃
+- 计数优先用模型的 tokenizer.json（需安装 tokenizers，--tokenizer 模型=路径），
+  否则用按字符估算的计数器，并根据 Ollama 返回的 prompt_eval_count 按模型校准
+- 被裁掉的 token 数通过响应头 X-Panel-Trimmed-Tokens / X-Panel-Trimmed-Messages 告知前端
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+DEFAULT_NUM_CTX = 2048
+MESSAGE_OVERHEAD = 4  # 每条消息的模板开销（角色标记、换行等）
+CJK = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+# 校准系数的指数滑动平均权重与允许范围
+CALIBRATION_ALPHA = 0.2
+SCALE_RANGE = (0.3, 3.0)
+
+
+def _try_import(name: str):
+    try:
+        return __import__(name)
+    except Exception:
+        return None
+
+
+tokenizers = _try_import("tokenizers")
+
+
+def estimate_tokens(text: str) -> float:
+    """粗估：中日韩字符约 1 token/字，其余约 4 字符/token"""
+    cjk = len(CJK.findall(text))
+    return cjk + (len(text) - cjk) / 4.0
+
+
+@dataclass
+class TrimResult:
+    model: str
+    messages: List[Dict[str, Any]]
+    budget: int
+    kept_tokens: int
+    dropped_tokens: int
+    dropped_messages: int
+    estimated: bool  # True 表示用的是估算器（需要校准）
+    raw_estimate: float = 0.0  # 未乘校准系数的估算值，用于校准
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-Panel-Trimmed-Tokens": str(self.dropped_tokens),
+            "X-Panel-Trimmed-Messages": str(self.dropped_messages),
+            "X-Panel-Context-Budget": str(self.budget),
+        }
+
+
+class ContextBudget:
+    def __init__(self, fraction: float = 0.75, tokenizer_paths: Optional[Dict[str, str]] = None):
+        self.fraction = fraction
+        self.tokenizer_paths = dict(tokenizer_paths or {})  # 模型名 -> tokenizer.json
+        self._tokenizers: Dict[str, Any] = {}
+        self._scale: Dict[str, float] = {}  # 估算器的按模型校准系数
+        self.trimmed_requests = 0
+        self.dropped_tokens_total = 0
+
+    # ------------------------------------------------------------------ 计数
+    def _tokenizer(self, model: str):
+        if tokenizers is None or model not in self.tokenizer_paths:
+            return None
+        tok = self._tokenizers.get(model)
+        if tok is None:
+            try:
+                tok = tokenizers.Tokenizer.from_file(self.tokenizer_paths[model])
+            except Exception:
+                self.tokenizer_paths.pop(model, None)
+                return None
+            self._tokenizers[model] = tok
+        return tok
+
+    def _count_raw(self, model: str, msg: Dict[str, Any]) -> float:
+        text = str(msg.get("content") or "")
+        tok = self._tokenizer(model)
+        if tok is not None:
+            return len(tok.encode(text).ids) + MESSAGE_OVERHEAD
+        return estimate_tokens(text) + MESSAGE_OVERHEAD
+
+    def count(self, model: str, msg: Dict[str, Any]) -> float:
+        """单条消息的 token 数（估算器已乘校准系数）"""
+        return self._count_raw(model, msg) * self.scale(model)
+
+    def scale(self, model: str) -> float:
+        return 1.0 if self._tokenizer(model) is not None else self._scale.get(model, 1.0)
+
+    # ------------------------------------------------------------------ 裁剪
+    def num_ctx(self, payload: Dict[str, Any], show: Optional[Dict[str, Any]]) -> int:
+        options = payload.get("options") if isinstance(payload.get("options"), dict) else {}
+        if isinstance(options.get("num_ctx"), int) and options["num_ctx"] > 0:
+            return options["num_ctx"]
+        for line in ((show or {}).get("parameters") or "").splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[0] == "num_ctx" and parts[1].isdigit():
+                return int(parts[1])
+        return DEFAULT_NUM_CTX
+
+    def trim(self, payload: Dict[str, Any], show: Optional[Dict[str, Any]] = None) -> Optional[TrimResult]:
+        messages = payload.get("messages")
+        model = payload.get("model")
+        if not isinstance(model, str) or not isinstance(messages, list) or not messages:
+            return None
+        if not all(isinstance(m, dict) for m in messages):
+            return None
+
+        budget = int(self.num_ctx(payload, show) * self.fraction)
+        scale = self.scale(model)
+        raw = [self._count_raw(model, m) for m in messages]
+        cost = [r * scale for r in raw]
+
+        # system 消息与最后一条消息必留
+        keep = [m.get("role") == "system" for m in messages]
+        keep[-1] = True
+        used = sum(c for c, k in zip(cost, keep) if k)
+        for i in range(len(messages) - 2, -1, -1):
+            if keep[i]:
+                continue
+            if used + cost[i] > budget:
+                break
+            keep[i] = True
+            used += cost[i]
+        # 不以孤立的 assistant 回复开头：它对应的 user 提问已被丢弃
+        first = next((i for i, m in enumerate(messages) if keep[i] and m.get("role") != "system"), None)
+        if first is not None and first < len(messages) - 1 and messages[first].get("role") == "assistant":
+            keep[first] = False
+            used -= cost[first]
+
+        dropped = [c for c, k in zip(cost, keep) if not k]
+        result = TrimResult(
+            model=model,
+            messages=[m for m, k in zip(messages, keep) if k],
+            budget=budget,
+            kept_tokens=int(round(used)),
+            dropped_tokens=int(round(sum(dropped))),
+            dropped_messages=len(dropped),
+            estimated=self._tokenizer(model) is None,
+            raw_estimate=sum(r for r, k in zip(raw, keep) if k),
+        )
+        if dropped:
+            self.trimmed_requests += 1
+            self.dropped_tokens_total += result.dropped_tokens
+        return result
+
+    def calibrate(self, result: TrimResult, final: Optional[Dict[str, Any]]) -> None:
+        """用 Ollama 最终记录里的 prompt_eval_count 校准估算器"""
+        if not result.estimated or not final or result.raw_estimate <= 0:
+            return
+        actual = final.get("prompt_eval_count")
+        if not isinstance(actual, int) or actual <= 0:
+            return
+        observed = actual / result.raw_estimate
+        current = self._scale.get(result.model, 1.0)
+        # Ollama 复用了 KV 缓存前缀时 prompt_eval_count 只算新增部分，偏小的样本不可信
+        if observed < current * 0.5:
+            return
+        observed = min(max(observed, SCALE_RANGE[0]), SCALE_RANGE[1])
+        self._scale[result.model] = current + CALIBRATION_ALPHA * (observed - current)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "trimmed_requests": self.trimmed_requests,
+            "dropped_tokens": self.dropped_tokens_total,
+            "scale": {m: round(s, 3) for m, s in self._scale.items()},
+            "tokenizers": sorted(self.tokenizer_paths),
+        }
+
+
+def rewrite_messages(payload: Dict[str, Any], messages: List[Dict[str, Any]]) -> bytes:
+    body = dict(payload)
+    body["messages"] = messages
+    return json.dumps(body, ensure_ascii=False).encode("utf-8")
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+自动调参：用真实的前向 + 反向实测，代替 env_detect 按内存档位给出的 batch / 梯度累积 / 序列长度
+- 序列长度按候选从小到大测到第一个不小于所需长度（--max_seq_length 或档位默认值）的为止；
+  所需长度连 batch=1 都放不下时退回能放下的最长候选
+- 每个序列长度：batch 从 1 开始倍增探测，出现 OOM 或峰值内存超出预算后在最后一次成功与失败之间二分，
+  得到放得下的最大 batch；再对 1、2、4 … 最大 batch 逐个测 tokens/sec，取最快的（相差 3% 以内取更小的）
+- 梯度累积 = 档位默认的有效 batch（batch × 累积）÷ 选中的 batch，保持优化行为与原来一致
+- 结果按环境指纹（设备型号、总内存、dtype、库版本、模型与 LoRA 配置）写入缓存，
+  之后 plan_environment(tune_key=...) 直接返回实测配置；环境变化后自动失效
+- 用法：python autotune.py --model_name_or_path Qwen/Qwen2.5-0.5B-Instruct，或 train_lora.py --autotune
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import math
+import time
+from dataclasses import asdict, dataclass, field, replace
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from env_detect import (
+    DEFAULT_TUNE_CACHE,
+    EnvPlan,
+    _defaults_from_memory,
+    lora_target_modules_for_qwen,
+    merge_tuned_overrides,
+    plan_environment,
+    pretty_env_summary,
+    save_tuned_defaults,
+)
+
+SEQ_CANDIDATES = (256, 512, 768, 1024, 1536, 2048)
+MEMORY_FRACTION = 0.85
+SPEED_TOLERANCE = 0.03
+
+
+@dataclass
+class Trial:
+    seq_len: int
+    batch: int
+    fits: bool
+    tokens_per_sec: float = 0.0
+    steps_per_sec: float = 0.0
+    peak_memory_bytes: Optional[int] = None
+    error: str = ""
+
+
+@dataclass
+class TuneResult:
+    defaults: Dict[str, int]
+    chosen: Optional[Trial]
+    max_batch: Dict[int, int]  # 序列长度 -> 放得下的最大 batch
+    trials: List[Trial] = field(default_factory=list)
+    seconds: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "defaults": self.defaults,
+            "chosen": asdict(self.chosen) if self.chosen else None,
+            "max_batch": {str(k): v for k, v in self.max_batch.items()},
+            "trials": [asdict(t) for t in self.trials],
+            "seconds": round(self.seconds, 1),
+        }
+
+
+def max_fitting_batch(fits: Callable[[int], bool], limit: int) -> int:
+    """放得下的最大 batch（0 表示 batch=1 也放不下）：先倍增探测，再在成功与失败之间二分"""
+    if limit < 1 or not fits(1):
+        return 0
+    ok, bad = 1, None
+    while bad is None and ok < limit:
+        nxt = min(ok * 2, limit)
+        if fits(nxt):
+            ok = nxt
+        else:
+            bad = nxt
+    if bad is None:
+        return ok
+    while bad - ok > 1:
+        mid = (ok + bad) // 2
+        if fits(mid):
+            ok = mid
+        else:
+            bad = mid
+    return ok
+
+
+def batch_grid(max_batch: int) -> List[int]:
+    grid = []
+    b = 1
+    while b < max_batch:
+        grid.append(b)
+        b *= 2
+    if max_batch >= 1:
+        grid.append(max_batch)
+    return grid
+
+
+def pick_fastest(trials: Sequence[Trial]) -> Optional[Trial]:
+    """tokens/sec 最高者；与最高值相差 SPEED_TOLERANCE 以内时取 batch 更小的（省内存）"""
+    ok = [t for t in trials if t.fits and t.tokens_per_sec > 0]
+    if not ok:
+        return None
+    best = max(t.tokens_per_sec for t in ok)
+    return min((t for t in ok if t.tokens_per_sec >= best * (1 - SPEED_TOLERANCE)), key=lambda t: t.batch)
+
+
+def memory_budget(plan: EnvPlan, fraction: float = MEMORY_FRACTION) -> Optional[int]:
+    """CUDA 以显存总量为准；CPU/MPS 以规划时（加载模型之前）的可用内存为准，与进程峰值 RSS 比较"""
+    mem = plan.memory
+    if plan.device == "cuda" and mem.total_bytes:
+        return int(mem.total_bytes * fraction)
+    if mem.free_bytes:
+        return int(mem.free_bytes * fraction)
+    return None
+
+
+def _is_oom(e: BaseException) -> bool:
+    return "out of memory" in str(e).lower()
+
+
+class AutoTuner:
+    def __init__(
+        self,
+        model: Any,
+        device: str,
+        vocab_size: int,
+        budget: Optional[int],
+        steps: int = 3,
+        seed: int = 0,
+    ):
+        self.model = model
+        self.device = device
+        self.vocab_size = vocab_size
+        self.budget = budget
+        self.steps = steps
+        self.seed = seed
+        self._trials: Dict[tuple, Trial] = {}
+
+    def _batches(self, seq_len: int, batch: int):
+        import torch
+
+        gen = torch.Generator().manual_seed(self.seed)
+        for _ in range(self.steps + 1):  # 第一步预热
+            ids = torch.randint(0, self.vocab_size, (batch, seq_len), generator=gen)
+            yield {"input_ids": ids, "attention_mask": torch.ones_like(ids), "labels": ids.clone()}
+
+    def _free(self) -> None:
+        gc.collect()
+        try:
+            import torch
+
+            if self.device == "cuda":
+                torch.cuda.empty_cache()
+            elif self.device == "mps":
+                torch.mps.empty_cache()
+        except Exception:
+            pass
+
+    def trial(self, seq_len: int, batch: int) -> Trial:
+        key = (seq_len, batch)
+        if key in self._trials:
+            return self._trials[key]
+        from step_bench import run_steps
+
+        try:
+            stats = run_steps(self.model, self._batches(seq_len, batch), self.device)
+            over = self.budget is not None and stats.peak_memory_bytes is not None and stats.peak_memory_bytes > self.budget
+            result = Trial(
+                seq_len, batch, fits=not over,
+                tokens_per_sec=stats.tokens_per_sec, steps_per_sec=stats.steps_per_sec,
+                peak_memory_bytes=stats.peak_memory_bytes, error="超出内存预算" if over else "",
+            )
+        except RuntimeError as e:
+            if not _is_oom(e):
+                raise
+            result = Trial(seq_len, batch, fits=False, error="OOM")
+        self._free()
+        self._trials[key] = result
+        mark = "✅" if result.fits else "❌"
+        peak = f"{result.peak_memory_bytes / 1024**2:.0f} MB" if result.peak_memory_bytes else "-"
+        print(f"   {mark} seq={seq_len:<5} batch={batch:<3} {result.tokens_per_sec:8.0f} tokens/s  峰值 {peak} {result.error}")
+        return result
+
+    def tune(
+        self,
+        seq_lengths: Sequence[int],
+        required_seq: int,
+        effective_batch: int,
+        max_batch: Optional[int] = None,
+    ) -> TuneResult:
+        started = time.perf_counter()
+        limit = max(1, max_batch or effective_batch)
+        candidates = sorted(set(seq_lengths) | {required_seq})
+        fitted: Dict[int, int] = {}
+        for seq_len in candidates:
+            fitted[seq_len] = max_fitting_batch(lambda b: self.trial(seq_len, b).fits, limit)
+            if fitted[seq_len] == 0 or seq_len >= required_seq:
+                break  # 更长的放不下，或者已经够用
+
+        usable = [s for s, b in fitted.items() if b > 0]
+        seq_len = min((s for s in usable if s >= required_seq), default=max(usable, default=0))
+        chosen = None
+        if seq_len:
+            chosen = pick_fastest([self.trial(seq_len, b) for b in batch_grid(fitted[seq_len])])
+        if chosen is None:
+            defaults = {}
+        else:
+            defaults = {
+                "max_seq_length": chosen.seq_len,
+                "per_device_train_batch_size": chosen.batch,
+                "gradient_accumulation_steps": max(1, int(math.ceil(effective_batch / chosen.batch))),
+            }
+        return TuneResult(defaults, chosen, fitted, list(self._trials.values()), time.perf_counter() - started)
+
+
+def tune_plan(
+    model: Any,
+    plan: EnvPlan,
+    vocab_size: int,
+    overrides: Optional[Dict[str, Any]] = None,
+    cache_path: str = DEFAULT_TUNE_CACHE,
+    steps: int = 3,
+    memory_fraction: float = MEMORY_FRACTION,
+    seq_lengths: Sequence[int] = SEQ_CANDIDATES,
+) -> EnvPlan:
+    """实测并缓存最优配置，返回更新后的 EnvPlan（显式 overrides 仍然优先）"""
+    overrides = overrides or {}
+    tier = _defaults_from_memory(plan.device, plan.memory)
+    required_seq = int(overrides.get("max_seq_length") or tier["max_seq_length"])
+    effective = int(tier["per_device_train_batch_size"]) * int(tier["gradient_accumulation_steps"])
+    budget = memory_budget(plan, memory_fraction)
+    print(f"🔧 自动调参: 所需序列长度 {required_seq}，有效 batch {effective}，"
+          f"内存预算 {f'{budget / 1024**3:.1f} GB' if budget else 'unknown（只以 OOM 为准）'}")
+    tuner = AutoTuner(model, plan.device, vocab_size, budget, steps=steps)
+    result = tuner.tune([s for s in seq_lengths if s <= max(required_seq, min(seq_lengths))], required_seq, effective)
+    if not result.defaults:
+        print("⚠️  自动调参失败：batch=1 也放不下，保留档位默认值")
+        return plan
+    print(f"✅ 自动调参完成（{result.seconds:.0f}s）: {result.defaults}")
+    if plan.fingerprint:
+        save_tuned_defaults(plan.fingerprint, dict(result.to_dict(), created_at=time.time()), cache_path)
+    defaults = {**plan.defaults, **merge_tuned_overrides(result.defaults, overrides, effective)}
+    return replace(plan, defaults=defaults, source="autotune")
+
+
+def parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="实测最优 batch / 梯度累积 / 序列长度并缓存")
+    ap.add_argument("--model_name_or_path", type=str, default="Qwen/Qwen2.5-0.5B-Instruct")
+    ap.add_argument("--max_seq_length", type=int, default=0, help="所需序列长度，0 表示档位默认值")
+    ap.add_argument("--lora_r", type=int, default=8)
+    ap.add_argument("--lora_alpha", type=int, default=16)
+    ap.add_argument("--target_modules", type=str, default="")
+    ap.add_argument("--gradient_checkpointing", action="store_true")
+    ap.add_argument("--steps", type=int, default=3, help="每个候选计时的步数（另加 1 步预热）")
+    ap.add_argument("--memory_fraction", type=float, default=MEMORY_FRACTION)
+    ap.add_argument("--cache", type=str, default=DEFAULT_TUNE_CACHE)
+    return ap.parse_args()
+
+
+def tune_key_for(
+    model_name: str,
+    lora_r: int,
+    target_modules: Sequence[str],
+    gradient_checkpointing: bool,
+    max_seq_length: int = 0,
+) -> Dict[str, Any]:
+    """max_seq_length 为显式指定（或按数据选出）的所需长度，0 表示档位默认；所需长度不同，最优 batch 也不同"""
+    return {
+        "model": model_name,
+        "lora_r": lora_r,
+        "target_modules": sorted(target_modules),
+        "gradient_checkpointing": bool(gradient_checkpointing),
+        "max_seq_length": int(max_seq_length or 0),
+    }
+
+
+def main() -> None:
+    args = parse_args()
+    import torch
+    from peft import LoraConfig, get_peft_model
+    from transformers import AutoModelForCausalLM
+
+    targets = [x.strip() for x in args.target_modules.split(",") if x.strip()] or list(lora_target_modules_for_qwen())
+    overrides = {"max_seq_length": args.max_seq_length} if args.max_seq_length else {}
+    key = tune_key_for(args.model_name_or_path, args.lora_r, targets, args.gradient_checkpointing, args.max_seq_length)
+    plan = plan_environment(tune_key=key, tune_cache=args.cache)
+    print("[env]", pretty_env_summary(plan))
+
+    dtype = {"bf16": torch.bfloat16, "fp16": torch.float16, "fp32": torch.float32}[plan.dtype]
+    kwargs: Dict[str, Any] = {"device_map": "auto" if plan.device == "cuda" else None}
+    if plan.device != "cpu":
+        kwargs["dtype"] = dtype
+    model = AutoModelForCausalLM.from_pretrained(args.model_name_or_path, **kwargs)
+    if plan.device in ("mps", "cpu"):
+        model.to(plan.device)
+    if args.gradient_checkpointing:
+        model.gradient_checkpointing_enable()
+        model.config.use_cache = False
+        model.enable_input_require_grads()
+    model = get_peft_model(model, LoraConfig(
+        r=args.lora_r, lora_alpha=args.lora_alpha, bias="none", task_type="CAUSAL_LM", target_modules=targets,
+    ))
+    plan = tune_plan(model, plan, model.config.vocab_size, overrides, args.cache, args.steps, args.memory_fraction)
+    print(json.dumps(plan.defaults, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
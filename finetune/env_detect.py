@@ -1,8 +1,17 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import math
+import os
+import platform
 from dataclasses import dataclass
 from typing import Any, Dict, Optional, Tuple
 
+# 自动调参（autotune.py）实测出的最优配置，按环境指纹缓存
+DEFAULT_TUNE_CACHE = "out/autotune_cache.json"
+TUNED_KEYS = ("per_device_train_batch_size", "gradient_accumulation_steps", "max_seq_length")
+
 
 @dataclass(frozen=True)
 class MemoryInfo:
@@ -28,6 +37,8 @@ class EnvPlan:
     dtype: str  # "bf16" | "fp16" | "fp32"
     memory: MemoryInfo
     defaults: Dict[str, Any]
+    source: str = "tier"  # "tier"：按内存档位估计；"autotune"：实测缓存
+    fingerprint: str = ""
 
 
 def _try_import(name: str):
@@ -176,7 +187,85 @@ def _defaults_from_memory(device: str, mem: MemoryInfo) -> Dict[str, Any]:
     return {"max_seq_length": 256, "per_device_train_batch_size": 1, "gradient_accumulation_steps": 16}
 
 
-def plan_environment(overrides: Optional[Dict[str, Any]] = None) -> EnvPlan:
+def _device_name(device: str) -> str:
+    torch = _try_import("torch")
+    if device == "cuda" and torch is not None:
+        try:
+            return str(torch.cuda.get_device_name(0))
+        except Exception:
+            pass
+    return f"{platform.machine()} {platform.processor()} x{os.cpu_count()}"
+
+
+def environment_fingerprint(device: str, dtype: str, mem: MemoryInfo, tune_key: Optional[Dict[str, Any]] = None) -> str:
+    """设备型号、总内存、dtype、torch/transformers 版本与调参对象（模型、LoRA 配置等）的哈希
+
+    其中任一变化，之前实测的最优配置都不再可信，需要重新调参。
+    """
+    versions = {}
+    for name in ("torch", "transformers", "peft"):
+        module = _try_import(name)
+        versions[name] = getattr(module, "__version__", None) if module is not None else None
+    total_gb = mem.total_gb()
+    payload = {
+        "device": device,
+        "device_name": _device_name(device),
+        "dtype": dtype,
+        "total_gb": round(total_gb) if total_gb is not None else None,
+        "versions": versions,
+        "tune_key": tune_key or {},
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def merge_tuned_overrides(tuned: Dict[str, Any], overrides: Dict[str, Any], effective_batch: int) -> Dict[str, Any]:
+    """在实测配置上合并显式参数
+
+    梯度累积是按实测的每卡 batch 算出来的：只显式指定了 per_device_train_batch_size 时，
+    按最终的每卡 batch 重算梯度累积，保持有效 batch（effective_batch）不变。
+    """
+    merged = {**tuned, **overrides}
+    if "per_device_train_batch_size" in overrides and "gradient_accumulation_steps" not in overrides:
+        final_bs = max(1, int(merged["per_device_train_batch_size"]))
+        merged["gradient_accumulation_steps"] = max(1, int(math.ceil(effective_batch / final_bs)))
+    return merged
+
+
+def load_tuned_defaults(fingerprint: str, cache_path: str = DEFAULT_TUNE_CACHE) -> Optional[Dict[str, Any]]:
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            entry = (json.load(f) or {}).get(fingerprint)
+    except (OSError, ValueError, AttributeError):
+        return None
+    if not isinstance(entry, dict) or not isinstance(entry.get("defaults"), dict):
+        return None
+    defaults = entry["defaults"]
+    return defaults if all(isinstance(defaults.get(k), int) for k in TUNED_KEYS) else None
+
+
+def save_tuned_defaults(fingerprint: str, entry: Dict[str, Any], cache_path: str = DEFAULT_TUNE_CACHE) -> None:
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    data[fingerprint] = entry
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    tmp = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, cache_path)
+
+
+def plan_environment(
+    overrides: Optional[Dict[str, Any]] = None,
+    tune_key: Optional[Dict[str, Any]] = None,
+    tune_cache: str = DEFAULT_TUNE_CACHE,
+) -> EnvPlan:
+    """tune_key 不为空时优先使用该环境下 autotune 实测缓存的配置（没有缓存时退回内存档位）"""
     device = detect_device()
     dtype = choose_dtype(device)
 
@@ -188,14 +277,25 @@ def plan_environment(overrides: Optional[Dict[str, Any]] = None) -> EnvPlan:
         mem = _cpu_memory_info()
 
     defaults = _defaults_from_memory(device, mem)
-    if overrides:
+    source = "tier"
+    fingerprint = ""
+    tuned = None
+    if tune_key is not None:
+        fingerprint = environment_fingerprint(device, dtype, mem, tune_key)
+        tuned = load_tuned_defaults(fingerprint, tune_cache)
+    if tuned is not None:
+        # 调参时保持的是档位默认的有效 batch
+        effective = int(defaults["per_device_train_batch_size"]) * int(defaults["gradient_accumulation_steps"])
+        defaults = merge_tuned_overrides({k: tuned[k] for k in TUNED_KEYS}, overrides or {}, effective)
+        source = "autotune"
+    elif overrides:
         defaults = {**defaults, **overrides}
 
     # 兼容可能出现的历史 typo key，避免日志/配置污染后续逻辑
     if "per_deatch_size" in defaults and "per_device_train_batch_size" not in defaults:
         defaults["per_device_train_batch_size"] = defaults.pop("per_deatch_size")
 
-    return EnvPlan(device=device, dtype=dtype, memory=mem, defaults=defaults)
+    return EnvPlan(device=device, dtype=dtype, memory=mem, defaults=defaults, source=source, fingerprint=fingerprint)
 
 
 def pretty_env_summary(plan: EnvPlan) -> str:
@@ -205,7 +305,7 @@ def pretty_env_summary(plan: EnvPlan) -> str:
     return (
         f"device={plan.device}, dtype={plan.dtype}, "
         f"mem.total={total}, mem.free={free}, note={mem.note}, "
-        f"defaults={plan.defaults}"
+        f"defaults={plan.defaults} ({plan.source})"
     )
 
 
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+训练样本 -> 模型输入文本（chat template），训练、长度统计、分词缓存共用同一份实现
+- train_lora.py 的 formatting_func / 预分词、seq_length.py 的长度统计都从这里导入，保证统计的就是训练时的文本
+- FORMAT_VERSION 随 format_example 的输出一起维护，参与 token_cache.cache_key，格式一变旧缓存自动失效
+- 警告每个进程只打印一次；长度统计的进程池 worker 不打印（同一份数据主进程训练时还会格式化一遍）
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, Set
+
+# format_example 的输出一旦变化就递增，使分词缓存与长度缓存失效
+FORMAT_VERSION = "1"
+
+_warned: Set[str] = set()
+
+
+def _warn_once(kind: str, message: str, warn: bool) -> None:
+    if warn and kind not in _warned:
+        _warned.add(kind)
+        print(message)
+
+
+def format_example(example: Dict[str, Any], tokenizer: Any, warn: bool = True) -> str:
+    """一条训练样本 -> 训练时实际输入模型的文本（chat template）；warn=False 时不打印警告"""
+    messages: List[Dict[str, str]] = example.get("messages") or []
+    if not messages:
+        # 兼容 instruction/input/output 的简易格式（如果用户未来换数据）
+        inst = (example.get("instruction") or "").strip()
+        inp = (example.get("input") or "").strip()
+        out = (example.get("output") or "").strip()
+        user = inst + ("\n\n" + inp if inp else "")
+        messages = [{"role": "user", "content": user}, {"role": "assistant", "content": out}]
+
+    # 对于Qwen模型，确保system消息被正确处理
+    # 检查是否包含system消息
+    has_system = any(msg.get("role") == "system" for msg in messages)
+
+    try:
+        # 尝试使用chat template
+        formatted = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=False)
+
+        # 验证system消息是否被包含（简单检查）
+        if has_system:
+            system_content = next(msg["content"] for msg in messages if msg.get("role") == "system")
+            if system_content[:50] not in formatted:
+                _warn_once("system", "⚠️  警告：system消息可能未被正确处理", warn)
+
+        return formatted
+    except Exception as e:
+        _warn_once("template", f"⚠️  Chat template处理失败，回退到简单格式: {e}", warn)
+        # 回退：手动构建对话格式
+        result = ""
+        for msg in messages:
+            role = msg.get("role", "")
+            content = msg.get("content", "")
+            if role == "system":
+                result += f"<|system|>\n{content}\n"
+            elif role == "user":
+                result += f"<|user|>\n{content}\n"
+            elif role == "assistant":
+                result += f"<|assistant|>\n{content}\n"
+        return result
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+按长度分桶、按 token 预算组 batch 的采样器（train_lora.py --token_budget_batching）
+- 固定条数的 batch 里只要有一条长样本，整批都要补齐到它的长度；这里改为每批“补齐后的 token 数”不超过预算：
+  短样本一批多放几条，长样本一批少放几条，计算量与显存占用都更平稳
+- 样本按长度分桶（桶宽 bucket_width 个 token），桶内按长度排序后贪心组批，桶内 padding 不超过一个桶宽
+- 打乱是确定性的：同一 seed、同一 epoch 得到完全相同的 batch 序列（续训可复现）；
+  等长样本之间的先后与 batch 的顺序每个 epoch 重新打乱，batch 数量与 epoch 无关（Trainer 依此计算总步数）
+- 纯 Python，可直接作为 torch DataLoader 的 batch_sampler
+"""
+
+from __future__ import annotations
+
+import random
+from typing import Dict, Iterator, List, Optional, Sequence
+
+
+class TokenBudgetBatchSampler:
+    def __init__(
+        self,
+        lengths: Sequence[int],
+        max_tokens: int,
+        seed: int = 42,
+        bucket_width: int = 32,
+        max_batch_size: Optional[int] = None,
+        shuffle: bool = True,
+    ):
+        if max_tokens <= 0:
+            raise ValueError("max_tokens 必须为正数")
+        self.lengths = [max(1, int(n)) for n in lengths]
+        self.max_tokens = max_tokens
+        self.seed = seed
+        self.bucket_width = max(1, bucket_width)
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.epoch = 0
+        self._explicit_epoch = False
+        self._len: Optional[int] = None
+
+    def set_epoch(self, epoch: int) -> None:
+        """由训练循环显式指定 epoch；否则每次迭代自动前进一个 epoch"""
+        self.epoch = epoch
+        self._explicit_epoch = True
+
+    def batches(self, epoch: int) -> List[List[int]]:
+        rng = random.Random(f"{self.seed}:{epoch}")
+        tie = [rng.random() for _ in self.lengths] if self.shuffle else list(range(len(self.lengths)))
+        buckets: Dict[int, List[int]] = {}
+        for i, n in enumerate(self.lengths):
+            buckets.setdefault(n // self.bucket_width, []).append(i)
+
+        out: List[List[int]] = []
+        for key in sorted(buckets):
+            members = sorted(buckets[key], key=lambda i: (self.lengths[i], tie[i]))
+            batch: List[int] = []
+            longest = 0
+            for i in members:
+                n = self.lengths[i]
+                full = self.max_batch_size is not None and len(batch) >= self.max_batch_size
+                if batch and (full or max(longest, n) * (len(batch) + 1) > self.max_tokens):
+                    out.append(batch)
+                    batch, longest = [], 0
+                batch.append(i)  # 单条超过预算时独占一批
+                longest = max(longest, n)
+            if batch:
+                out.append(batch)
+        if self.shuffle:
+            rng.shuffle(out)
+        return out
+
+    def __iter__(self) -> Iterator[List[int]]:
+        epoch = self.epoch
+        if not self._explicit_epoch:
+            self.epoch += 1
+        return iter(self.batches(epoch))
+
+    def __len__(self) -> int:
+        if self._len is None:
+            self._len = len(self.batches(0))
+        return self._len
+
+    def report(self, epoch: int = 0) -> Dict[str, float]:
+        """一个 epoch 的批次统计：batch 数、平均条数、padding 比例（补齐到批内最长）"""
+        batches = self.batches(epoch)
+        real = sum(self.lengths)
+        padded = sum(max(self.lengths[i] for i in b) * len(b) for b in batches)
+        return {
+            "batches": len(batches),
+            "mean_batch_size": round(len(self.lengths) / len(batches), 2) if batches else 0.0,
+            "max_tokens": self.max_tokens,
+            "padding_ratio": round(1 - real / padded, 4) if padded else 0.0,
+        }
+
+
+def fixed_size_padding_ratio(lengths: Sequence[int], batch_size: int, seed: int = 42) -> float:
+    """对照组：现有的随机采样、固定 batch_size 条一批、补齐到批内最长时的 padding 比例"""
+    order = list(range(len(lengths)))
+    random.Random(seed).shuffle(order)
+    real = sum(lengths)
+    padded = 0
+    for s in range(0, len(order), batch_size):
+        batch = order[s:s + batch_size]
+        padded += max(lengths[i] for i in batch) * len(batch)
+    return round(1 - real / padded, 4) if padded else 0.0
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+按数据实际的 token 长度选择 max_seq_length（train_lora.py --auto_max_seq_length，或单独运行本脚本查看报告）
+- 训练集 / 验证集用与训练完全相同的格式化（formatting.format_example）分词，只统计长度；数据分块后多进程并行
+- 报告：长度直方图、分位数、每个候选长度下被截断的样本比例与被截掉的 token 比例
+  （截掉的是对话末尾，也就是 assistant 的回复）
+- 选择：覆盖训练集 percentile 分位的最小长度（向上取整到 multiple_of，不超过模型上限）
+- 长度按 token_cache.cache_key 缓存成 JSON，同一份数据 + tokenizer 只分词一次
+- 用法：python seq_length.py --train_jsonl data/train.jsonl --val_jsonl data/val.jsonl --percentile 99
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from formatting import FORMAT_VERSION, format_example
+from token_cache import cache_key
+
+DEFAULT_PERCENTILE = 99.0
+MULTIPLE_OF = 64
+CANDIDATES = (128, 256, 384, 512, 768, 1024, 1536, 2048, 3072, 4096)
+HISTOGRAM_WIDTHS = (16, 32, 64, 128, 256, 512, 1024, 2048)
+HISTOGRAM_MAX_BINS = 24
+
+
+def percentile(sorted_lengths: Sequence[int], q: float) -> int:
+    """最近秩分位数：至少 q% 的样本长度不超过返回值"""
+    if not sorted_lengths:
+        return 0
+    rank = max(1, int(math.ceil(q / 100 * len(sorted_lengths))))
+    return int(sorted_lengths[min(rank, len(sorted_lengths)) - 1])
+
+
+def histogram(lengths: Sequence[int], width: Optional[int] = None) -> List[Tuple[int, int]]:
+    """[(区间起点, 样本数)]，区间宽度默认取让区间数不超过 HISTOGRAM_MAX_BINS 的最小档位"""
+    if not lengths:
+        return []
+    longest = max(lengths)
+    if width is None:
+        width = next((w for w in HISTOGRAM_WIDTHS if longest // w < HISTOGRAM_MAX_BINS), HISTOGRAM_WIDTHS[-1])
+    counts = [0] * (longest // width + 1)
+    for n in lengths:
+        counts[n // width] += 1
+    return [(i * width, c) for i, c in enumerate(counts)]
+
+
+def truncation_stats(lengths: Sequence[int], max_len: int) -> Dict[str, Any]:
+    """以 max_len 截断时：被截断的样本比例、被截掉的 token 比例、补齐到 max_len 时的 padding 比例"""
+    total = sum(lengths)
+    truncated = sum(1 for n in lengths if n > max_len)
+    lost = sum(n - max_len for n in lengths if n > max_len)
+    kept = total - lost
+    return {
+        "max_seq_length": max_len,
+        "truncated_samples": truncated,
+        "truncated_ratio": round(truncated / len(lengths), 4) if lengths else 0.0,
+        "truncated_tokens_ratio": round(lost / total, 4) if total else 0.0,
+        "padding_ratio_max_len": round(1 - kept / (max_len * len(lengths)), 4) if lengths else 0.0,
+    }
+
+
+def choose_max_seq_length(
+    lengths: Sequence[int],
+    pct: float = DEFAULT_PERCENTILE,
+    multiple_of: int = MULTIPLE_OF,
+    limit: Optional[int] = None,
+) -> int:
+    """覆盖 pct 分位样本的最小长度，向上取整到 multiple_of（对齐对 GPU kernel 更友好），不超过 limit"""
+    need = percentile(sorted(lengths), pct)
+    chosen = max(multiple_of, int(math.ceil(need / multiple_of)) * multiple_of)
+    return min(chosen, limit) if limit else chosen
+
+
+def split_summary(lengths: Sequence[int], candidates: Sequence[int]) -> Dict[str, Any]:
+    ordered = sorted(lengths)
+    return {
+        "samples": len(ordered),
+        "tokens": sum(ordered),
+        "mean": round(sum(ordered) / len(ordered), 1) if ordered else 0.0,
+        "percentiles": {f"p{q:g}": percentile(ordered, q) for q in (50, 90, 95, 99)},
+        "max": ordered[-1] if ordered else 0,
+        "histogram": histogram(ordered),
+        "candidates": [truncation_stats(ordered, c) for c in candidates],
+    }
+
+
+@dataclass
+class LengthReport:
+    percentile: float
+    chosen: int
+    splits: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def lines(self) -> List[str]:
+        out: List[str] = []
+        for name, s in self.splits.items():
+            p = s["percentiles"]
+            out.append(
+                f"📏 {name}: {s['samples']} 条，平均 {s['mean']} tokens，"
+                f"p50={p['p50']} p90={p['p90']} p95={p['p95']} p99={p['p99']} max={s['max']}"
+            )
+            peak = max((c for _, c in s["histogram"]), default=0)
+            for start, count in s["histogram"]:
+                bar = "█" * (round(30 * count / peak) if peak else 0)
+                out.append(f"   {start:>6}+ {bar} {count}")
+            out.append("   长度      截断样本   截断 token")
+            for c in s["candidates"]:
+                mark = " ←" if c["max_seq_length"] == self.chosen else ""
+                out.append(
+                    f"   {c['max_seq_length']:<8} {c['truncated_ratio']:>8.1%} {c['truncated_tokens_ratio']:>11.1%}{mark}"
+                )
+        out.append(f"✅ 覆盖训练集 {self.percentile:g}% 样本的最小长度: {self.chosen}")
+        return out
+
+
+def analyze(
+    splits: Dict[str, Sequence[int]],
+    pct: float = DEFAULT_PERCENTILE,
+    multiple_of: int = MULTIPLE_OF,
+    limit: Optional[int] = None,
+    extra_candidates: Sequence[int] = (),
+) -> LengthReport:
+    """按 "train" 选择长度（没有 train 时用全部数据），所有 split 都给出各候选长度的截断情况"""
+    basis = splits.get("train") or [n for lengths in splits.values() for n in lengths]
+    chosen = choose_max_seq_length(basis, pct, multiple_of, limit)
+    candidates = sorted({c for c in CANDIDATES if not limit or c <= limit} | {chosen} | {c for c in extra_candidates if c})
+    return LengthReport(pct, chosen, {name: split_summary(lengths, candidates) for name, lengths in splits.items()})
+
+
+def model_length_limit(tokenizer: Any, model_config: Any = None) -> Optional[int]:
+    """模型支持的最大长度；tokenizer 未设置时 model_max_length 是一个极大的占位值，忽略"""
+    limit = getattr(model_config, "max_position_embeddings", None)
+    tok_limit = getattr(tokenizer, "model_max_length", None)
+    if isinstance(tok_limit, int) and tok_limit < 1_000_000:
+        limit = min(limit, tok_limit) if limit else tok_limit
+    return int(limit) if limit else None
+
+
+def read_jsonl(path: Path) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+_worker_tokenizer: Any = None
+
+
+def _init_worker(tokenizer: Any) -> None:
+    global _worker_tokenizer
+    # 已经按进程并行，关掉 tokenizers 自己的线程池，避免 fork 后死锁告警与超额订阅
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    _worker_tokenizer = tokenizer
+
+
+def _chunk_lengths(records: List[Dict[str, Any]], tokenizer: Any = None) -> List[int]:
+    # 进程池 worker 里不打印格式化警告：每个 worker 各打一遍只会刷屏，训练时主进程格式化同样的数据会提示
+    in_worker = tokenizer is None
+    tokenizer = tokenizer or _worker_tokenizer
+    texts = [format_example(r, tokenizer, warn=not in_worker) for r in records]
+    return [len(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+
+def tokenize_lengths(
+    records: Dict[str, List[Dict[str, Any]]],
+    tokenizer: Any,
+    workers: int = 0,
+    chunk_size: int = 256,
+) -> Dict[str, List[int]]:
+    """各 split 分块后一起提交给进程池；workers=0 表示 CPU 核数，1 表示在当前进程内完成"""
+    jobs = [(name, rows[s:s + chunk_size]) for name, rows in records.items() for s in range(0, len(rows), chunk_size)]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    out: Dict[str, List[int]] = {name: [] for name in records}
+    if workers <= 1:
+        for name, chunk in jobs:
+            out[name].extend(_chunk_lengths(chunk, tokenizer))
+        return out
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(tokenizer,)) as pool:
+        for (name, _), lengths in zip(jobs, pool.map(_chunk_lengths, [chunk for _, chunk in jobs])):
+            out[name].extend(lengths)
+    return out
+
+
+def dataset_lengths(
+    paths: Dict[str, Path],
+    tokenizer: Any,
+    cache_dir: Optional[Path] = None,
+    format_version: str = FORMAT_VERSION,
+    workers: int = 0,
+) -> Dict[str, List[int]]:
+    """各 split 未截断的 token 长度；cache_dir 不为空时按 (文件内容, tokenizer, 格式化版本) 缓存"""
+    cached: Dict[str, List[int]] = {}
+    files: Dict[str, Path] = {}
+    for name, path in paths.items():
+        if cache_dir is not None:
+            files[name] = Path(cache_dir) / f"lengths-{cache_key(Path(path), tokenizer, 0, format_version)}.json"
+            try:
+                cached[name] = json.loads(files[name].read_text(encoding="utf-8"))
+                continue
+            except (OSError, ValueError):
+                pass
+    missing = {name: read_jsonl(Path(p)) for name, p in paths.items() if name not in cached}
+    if missing:
+        for name, lengths in tokenize_lengths(missing, tokenizer, workers).items():
+            cached[name] = lengths
+            if name in files:
+                files[name].parent.mkdir(parents=True, exist_ok=True)
+                tmp = files[name].with_suffix(f".{os.getpid()}.tmp")
+                tmp.write_text(json.dumps(lengths), encoding="utf-8")
+                os.replace(tmp, files[name])
+    return {name: cached[name] for name in paths}
+
+
+def parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="统计训练数据的 token 长度分布并给出 max_seq_length 建议")
+    ap.add_argument("--model_name_or_path", type=str, default="Qwen/Qwen2.5-0.5B-Instruct")
+    ap.add_argument("--train_jsonl", type=str, default="data/train.jsonl")
+    ap.add_argument("--val_jsonl", type=str, default="data/val.jsonl")
+    ap.add_argument("--percentile", type=float, default=DEFAULT_PERCENTILE, help="选出的长度需覆盖的训练样本分位")
+    ap.add_argument("--multiple_of", type=int, default=MULTIPLE_OF)
+    ap.add_argument("--workers", type=int, default=0, help="分词进程数，0 表示 CPU 核数")
+    ap.add_argument("--cache_dir", type=str, default="out/token_cache", help="长度缓存目录（与 train_lora.py 的分词缓存共用）")
+    ap.add_argument("--output", type=str, default="", help="把完整报告写成 JSON")
+    return ap.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model_name_or_path, use_fast=True)
+    paths = {"train": Path(args.train_jsonl)}
+    if Path(args.val_jsonl).exists():
+        paths["validation"] = Path(args.val_jsonl)
+    lengths = dataset_lengths(paths, tokenizer, Path(args.cache_dir), workers=args.workers)
+    report = analyze(lengths, args.percentile, args.multiple_of, model_length_limit(tokenizer))
+    print("\n".join(report.lines()))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report.to_dict(), ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
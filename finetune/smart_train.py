@@ -1345,6 +1345,16 @@ class SmartTrainer:
             cmd.extend(["--lora_alpha", str(training_params['lora_alpha'])])
         if 'lora_dropout' in training_params:
             cmd.extend(["--lora_dropout", str(training_params['lora_dropout'])])
+        if training_params.get('packing'):
+            cmd.append("--packing")
+        if training_params.get('token_budget_batching'):
+            cmd.append("--token_budget_batching")
+        if training_params.get('autotune'):
+            cmd.append("--autotune")
+        if training_params.get('auto_max_seq_length'):
+            cmd.append("--auto_max_seq_length")
+            if 'seq_len_percentile' in training_params:
+                cmd.extend(["--seq_len_percentile", str(training_params['seq_len_percentile'])])
 
         # 断点续训参数
         if resume_from_checkpoint:
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+训练步吞吐测量：用真实的前向 + 反向跑若干步，给出 steps/sec、tokens/sec 与峰值内存
+- 只累积梯度不更新参数，测完清空梯度，不影响随后的正式训练
+- tokens 统计 labels 中参与 loss 的位置（即真正被训练的 token），padding 不计
+- 峰值内存：CUDA 用 max_memory_allocated；MPS 取 driver_allocated_memory 的最大采样；CPU 取进程 RSS 的最大采样
+"""
+
+from __future__ import annotations
+
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterable, Optional
+
+
+@dataclass
+class StepStats:
+    steps: int
+    seconds: float
+    tokens: int
+    padded_tokens: int
+    peak_memory_bytes: Optional[int]
+
+    @property
+    def steps_per_sec(self) -> float:
+        return self.steps / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def tokens_per_sec(self) -> float:
+        return self.tokens / self.seconds if self.seconds > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        out = asdict(self)
+        out["steps_per_sec"] = round(self.steps_per_sec, 4)
+        out["tokens_per_sec"] = round(self.tokens_per_sec, 1)
+        out["peak_memory_mb"] = round(self.peak_memory_bytes / 1024**2, 1) if self.peak_memory_bytes else None
+        return out
+
+
+def _sync(torch, device: str) -> None:
+    if device == "cuda":
+        torch.cuda.synchronize()
+    elif device == "mps" and hasattr(torch, "mps"):
+        torch.mps.synchronize()
+
+
+class _MemoryProbe:
+    def __init__(self, torch, device: str):
+        self.torch = torch
+        self.device = device
+        self.peak: Optional[int] = None
+        self._process = None
+        if device == "cuda":
+            torch.cuda.reset_peak_memory_stats()
+        elif device == "cpu":
+            try:
+                import psutil
+
+                self._process = psutil.Process()
+            except Exception:
+                self._process = None
+
+    def sample(self) -> None:
+        value: Optional[int] = None
+        if self.device == "cuda":
+            value = int(self.torch.cuda.max_memory_allocated())
+        elif self.device == "mps":
+            try:
+                value = int(self.torch.mps.driver_allocated_memory())
+            except Exception:
+                value = None
+        elif self._process is not None:
+            value = int(self._process.memory_info().rss)
+        if value is not None:
+            self.peak = value if self.peak is None else max(self.peak, value)
+
+
+def run_steps(model: Any, batches: Iterable[Dict[str, Any]], device: str, warmup: int = 1) -> StepStats:
+    """对每个 batch 做一次前向 + 反向；前 warmup 个 batch 不计时（CUDA kernel 选择、内存池预热）
+
+    显存不足时异常原样抛出（自动调参据此判断某个配置放不下）。
+    """
+    import torch
+
+    model.train()
+    probe: Optional[_MemoryProbe] = None
+    steps = tokens = padded = 0
+    started = 0.0
+    try:
+        for i, batch in enumerate(batches):
+            if i == warmup:
+                _sync(torch, device)
+                probe = _MemoryProbe(torch, device)
+                started = time.perf_counter()
+            batch = {k: v.to(device) if hasattr(v, "to") else v for k, v in batch.items()}
+            loss = model(**batch).loss
+            loss.backward()
+            if i >= warmup:
+                steps += 1
+                tokens += int((batch["labels"] != -100).sum())
+                padded += int(batch["input_ids"].numel())
+                probe.sample()
+        _sync(torch, device)
+        seconds = time.perf_counter() - started if steps else 0.0
+    finally:
+        model.zero_grad(set_to_none=True)
+    return StepStats(steps, seconds, tokens, padded, probe.peak if probe else None)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+测试自动调参 - 最大 batch 的倍增 + 二分搜索、序列长度与 batch 的选择、按环境指纹缓存
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+import autotune
+from autotune import AutoTuner, Trial, max_fitting_batch, tune_plan
+from env_detect import MemoryInfo, environment_fingerprint, load_tuned_defaults, plan_environment, save_tuned_defaults
+
+
+def test_max_fitting_batch():
+    for capacity in (0, 1, 5, 12, 37, 64, 100):
+        probed = []
+
+        def fits(b):
+            probed.append(b)
+            return b <= capacity
+
+        assert max_fitting_batch(fits, 64) == min(capacity, 64)
+        assert len(probed) <= 14  # 倍增 + 二分，而不是逐个尝试
+
+
+class _FakeTuner(AutoTuner):
+    """显存按 seq × batch 线性增长；吞吐在 batch=8 之后不再提升"""
+
+    def __init__(self, capacity):
+        super().__init__(model=None, device="cpu", vocab_size=100, budget=None)
+        self.capacity = capacity
+
+    def trial(self, seq_len, batch):
+        key = (seq_len, batch)
+        if key not in self._trials:
+            fits = seq_len * batch <= self.capacity
+            speed = seq_len * min(batch, 8) * 100.0 if fits else 0.0
+            self._trials[key] = Trial(seq_len, batch, fits, tokens_per_sec=speed)
+        return self._trials[key]
+
+
+def test_tune_choice():
+    result = _FakeTuner(capacity=512 * 20).tune([256, 512, 1024], required_seq=512, effective_batch=32)
+    assert result.max_batch == {256: 32, 512: 20}  # 达到所需长度后不再测更长的
+    # batch 16 与 20 吞吐相同，取更小的；梯度累积保持有效 batch
+    assert result.defaults == {"max_seq_length": 512, "per_device_train_batch_size": 8, "gradient_accumulation_steps": 4}
+
+    # 所需长度放不下时退回能放下的最长候选
+    result = _FakeTuner(capacity=700).tune([256, 512, 1024], required_seq=1024, effective_batch=16)
+    assert result.defaults["max_seq_length"] == 512
+    assert result.defaults["per_device_train_batch_size"] == 1
+    assert not _FakeTuner(capacity=10).tune([256], required_seq=256, effective_batch=4).defaults
+
+
+def test_batch_override_keeps_effective_batch():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = str(Path(tmp) / "autotune.json")
+        plan = plan_environment(tune_key={"model": "m"}, tune_cache=cache)
+        effective = plan.defaults["per_device_train_batch_size"] * plan.defaults["gradient_accumulation_steps"]
+        original, autotune.AutoTuner = autotune.AutoTuner, lambda *a, **k: _FakeTuner(capacity=4096 * 64)
+        try:
+            tuned = tune_plan(None, plan, 100, overrides={"per_device_train_batch_size": 4}, cache_path=cache,
+                              seq_lengths=[256])
+        finally:
+            autotune.AutoTuner = original
+        # 显式的每卡 batch 优先，梯度累积按它重算，有效 batch 不变
+        assert tuned.defaults["per_device_train_batch_size"] == 4
+        assert tuned.defaults["gradient_accumulation_steps"] == max(1, -(-effective // 4))
+
+        # 命中缓存时同样重算；显式指定了梯度累积则原样使用
+        cached = plan_environment(overrides={"per_device_train_batch_size": 2}, tune_key={"model": "m"}, tune_cache=cache)
+        assert cached.source == "autotune" and cached.defaults["gradient_accumulation_steps"] == max(1, -(-effective // 2))
+        both = {"per_device_train_batch_size": 2, "gradient_accumulation_steps": 3}
+        cached = plan_environment(overrides=both, tune_key={"model": "m"}, tune_cache=cache)
+        assert cached.defaults["gradient_accumulation_steps"] == 3
+
+
+def test_tuned_defaults_cache():
+    mem = MemoryInfo(backend="cpu", total_bytes=16 * 1024**3)
+    key = {"model": "m", "lora_r": 8}
+    fp = environment_fingerprint("cpu", "fp32", mem, key)
+    assert fp == environment_fingerprint("cpu", "fp32", mem, dict(key))
+    assert fp != environment_fingerprint("cpu", "fp32", mem, {"model": "m", "lora_r": 16})
+    assert fp != environment_fingerprint("cpu", "fp32", MemoryInfo(backend="cpu", total_bytes=32 * 1024**3), key)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = str(Path(tmp) / "sub" / "autotune.json")
+        assert load_tuned_defaults(fp, cache) is None
+        tuned = {"max_seq_length": 512, "per_device_train_batch_size": 4, "gradient_accumulation_steps": 4}
+        save_tuned_defaults(fp, {"defaults": tuned}, cache)
+        assert load_tuned_defaults(fp, cache) == tuned
+
+        plan = plan_environment(tune_key=key, tune_cache=cache)
+        save_tuned_defaults(plan.fingerprint, {"defaults": tuned}, cache)
+        plan = plan_environment(overrides={"max_seq_length": 128}, tune_key=key, tune_cache=cache)
+        assert plan.source == "autotune"
+        assert plan.defaults == dict(tuned, max_seq_length=128)  # 显式参数仍然优先
+        assert plan_environment(tune_key={"model": "other"}, tune_cache=cache).source == "tier"
+
+
+if __name__ == "__main__":
+    test_max_fitting_batch()
+    test_tune_choice()
+    test_batch_override_keeps_effective_batch()
+    test_tuned_defaults_cache()
+    print("✅ 全部通过")
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+测试序列打包 - FFD 装箱、打包行、padding 比例统计（纯 Python），以及 PackedCollator 的样本隔离（需要 torch）
+"""
+
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent))
+
+from packing import IGNORE_INDEX, PackedCollator, PackedRows, PaddedCollator, TokenRows, first_fit_decreasing, padding_report
+
+
+def test_first_fit_decreasing():
+    """每个样本恰好出现一次、行不超容量，结果与逐行扫描的 first-fit 一致"""
+    rng = random.Random(0)
+    lengths = [rng.randint(1, 300) for _ in range(2000)]
+    bins = first_fit_decreasing(lengths, 512)
+    assert sorted(i for b in bins for i in b) == list(range(len(lengths)))
+    assert all(sum(lengths[i] for i in b) <= 512 for b in bins)
+
+    remaining, expected = [], []
+    for i in sorted(range(len(lengths)), key=lambda i: (-lengths[i], i)):
+        for k, r in enumerate(remaining):
+            if r >= lengths[i]:
+                remaining[k] -= lengths[i]
+                expected[k].append(i)
+                break
+        else:
+            remaining.append(512 - lengths[i])
+            expected.append([i])
+    assert bins == expected
+    assert first_fit_decreasing([5, 5, 5], 10) == [[0, 1], [2]]
+
+
+def _packed_rows():
+    tokens = [[1, 2, 3], [4, 5], [6, 7, 8, 9]]
+    return PackedRows(tokens, first_fit_decreasing([len(t) for t in tokens], 6), 6)
+
+
+def test_packed_rows():
+    rows = _packed_rows()
+    assert [rows[i] for i in range(len(rows))] == [
+        {"input_ids": [6, 7, 8, 9, 4, 5], "seq_lens": [4, 2]},
+        {"input_ids": [1, 2, 3], "seq_lens": [3]},
+    ]
+
+
+def test_packed_collator_isolates_samples():
+    torch = pytest.importorskip("torch")
+    rows = _packed_rows()
+    batch = PackedCollator(pad_token_id=0, attn_implementation="sdpa", dtype=torch.float32)([rows[0], rows[1]])
+
+    assert batch["input_ids"].tolist() == [[6, 7, 8, 9, 4, 5], [1, 2, 3, 0, 0, 0]]
+    assert batch["position_ids"].tolist() == [[0, 1, 2, 3, 0, 1], [0, 1, 2, 0, 1, 2]]
+    # 每个样本的第一个 token 与 padding 不计 loss
+    assert batch["labels"].tolist() == [
+        [IGNORE_INDEX, 7, 8, 9, IGNORE_INDEX, 5],
+        [IGNORE_INDEX, 2, 3, IGNORE_INDEX, IGNORE_INDEX, IGNORE_INDEX],
+    ]
+
+    # 加性掩码：可见为 0，不可见为 dtype 最小值
+    visible = (batch["attention_mask"] == 0)[:, 0].tolist()
+    expected = [[[k <= q and (q < 4) == (k < 4) for k in range(6)] for q in range(6)]]
+    expected.append([[k <= q if q < 3 else k == q for k in range(6)] for q in range(6)])  # padding 只看得到自己
+    assert visible == expected
+    assert batch["attention_mask"].min().item() == torch.finfo(torch.float32).min
+
+    flash = PackedCollator(pad_token_id=0, attn_implementation="flash_attention_2")([rows[0], rows[1]])
+    assert "attention_mask" not in flash
+    assert flash["position_ids"].tolist() == batch["position_ids"].tolist()
+
+
+def test_padded_collator_matches_trl_default_collator():
+    """--token_cache 的不打包路径与 TRL 0.15 默认的 DataCollatorForLanguageModeling 产生相同的 batch"""
+    pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+    tokenizers = pytest.importorskip("tokenizers")
+
+    vocab = {"<pad>": 0, "<unk>": 1, **{f"w{i}": i + 2 for i in range(20)}}
+    backend = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=backend, pad_token="<pad>", padding_side="right")
+    rows = TokenRows([[2, 3, 4, 5, 0], [6, 7], [8, 9, 10]])  # 第一条包含一个与 pad 相同的 token
+    features = [rows[i] for i in range(len(rows))]
+
+    ours = PaddedCollator(tokenizer.pad_token_id)(features)
+    trl = transformers.DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)(features)
+    for key in ("input_ids", "attention_mask", "labels"):
+        assert ours[key].tolist() == trl[key].tolist(), key
+
+
+def test_padding_report():
+    # 4 条长度 1 的样本 + 1 条长度 8：不打包时第一批补齐到 8
+    report = padding_report([8, 1, 1, 1, 1], capacity=8, batch_size=2)
+    assert report["rows_packed"] == 2 and report["tokens"] == 12
+    assert report["padding_ratio_unpacked"] == round(1 - 12 / (16 + 2 + 1), 4)
+    assert report["padding_ratio_packed"] == round(1 - 12 / 16, 4)
+    assert report["estimated_speedup"] == round(19 / 16, 3)
+
+
+if __name__ == "__main__":
+    test_first_fit_decreasing()
+    test_packed_rows()
+    test_packed_collator_isolates_samples()
+    test_padded_collator_matches_trl_default_collator()
+    test_padding_report()
+    print("✅ 全部通过")
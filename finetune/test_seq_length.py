@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+测试按数据长度选择 max_seq_length - 分位数与截断统计、选出的长度、并行分词与长度缓存、格式化警告只打印一次
+"""
+
+import contextlib
+import io
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+import formatting
+import seq_length
+from seq_length import analyze, choose_max_seq_length, dataset_lengths, percentile, tokenize_lengths, truncation_stats
+
+
+class _CharTokenizer:
+    """每个字符一个 token；chat template 只拼接内容"""
+
+    name_or_path = ""
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=False):
+        return "".join(m["content"] for m in messages)
+
+    def __call__(self, texts, add_special_tokens=False):
+        return {"input_ids": [[ord(c) for c in t] for t in texts]}
+
+    def get_vocab(self):
+        return {"a": 0}
+
+
+def _record(n):
+    return {"messages": [{"role": "user", "content": "q"}, {"role": "assistant", "content": "a" * (n - 1)}]}
+
+
+def test_percentile_and_choice():
+    lengths = list(range(1, 101))
+    assert percentile(lengths, 50) == 50
+    assert percentile(lengths, 99) == 99
+    assert percentile(lengths, 100) == 100
+    assert choose_max_seq_length([100] * 95 + [1000] * 5, 95) == 128
+    assert choose_max_seq_length([100] * 95 + [1000] * 5, 99) == 1024
+    assert choose_max_seq_length([100] * 95 + [1000] * 5, 99, limit=512) == 512
+
+    stats = truncation_stats([100, 200, 300, 400], 250)
+    assert stats["truncated_samples"] == 2
+    assert stats["truncated_ratio"] == 0.5
+    assert stats["truncated_tokens_ratio"] == round(200 / 1000, 4)
+
+    report = analyze({"train": [100] * 99 + [700], "validation": [100, 700]}, 99)
+    assert report.chosen == 128
+    by_len = {c["max_seq_length"]: c for c in report.splits["validation"]["candidates"]}
+    assert by_len[128]["truncated_ratio"] == 0.5 and by_len[768]["truncated_ratio"] == 0.0
+    assert sum(c for _, c in report.splits["train"]["histogram"]) == 100
+    assert "128" in report.lines()[-1]
+
+
+def test_parallel_lengths_and_cache():
+    tokenizer = _CharTokenizer()
+    records = {"train": [_record(n) for n in range(1, 600)], "validation": [_record(n) for n in (5, 50)]}
+    serial = tokenize_lengths(records, tokenizer, workers=1, chunk_size=64)
+    assert serial["train"] == list(range(1, 600)) and serial["validation"] == [5, 50]
+    assert tokenize_lengths(records, tokenizer, workers=2, chunk_size=64) == serial
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "train.jsonl"
+        path.write_text("\n".join(json.dumps(r) for r in records["train"]) + "\n", encoding="utf-8")
+        cache = Path(tmp) / "cache"
+        assert dataset_lengths({"train": path}, tokenizer, cache, workers=1)["train"] == serial["train"]
+        assert len(list(cache.glob("lengths-*.json"))) == 1
+        # 命中缓存时不再读取、分词数据
+        original, seq_length.read_jsonl = seq_length.read_jsonl, None
+        try:
+            assert dataset_lengths({"train": path}, tokenizer, cache)["train"] == serial["train"]
+        finally:
+            seq_length.read_jsonl = original
+
+
+def test_format_warning_printed_once():
+    class _DropSystem(_CharTokenizer):
+        def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=False):
+            return "".join(m["content"] for m in messages if m["role"] != "system")
+
+    record = {"messages": [{"role": "system", "content": "你是助手"}] + _record(3)["messages"]}
+    formatting._warned.clear()
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        assert formatting.format_example(record, _DropSystem(), warn=False) == "qaa"
+        assert out.getvalue() == ""
+        for _ in range(3):
+            formatting.format_example(record, _DropSystem())
+    assert out.getvalue().count("system消息可能未被正确处理") == 1
+
+
+if __name__ == "__main__":
+    test_percentile_and_choice()
+    test_parallel_lengths_and_cache()
+    test_format_warning_printed_once()
+    print("✅ 全部通过")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+测试分词缓存 - mmap 读回的 token 与写入一致，数据 / tokenizer / chat template / max_seq_length 任一变化都会重新分词
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from token_cache import TokenCache, cache_key
+
+
+class _Backend:
+    def __init__(self, vocab: str):
+        self.vocab = vocab
+
+    def to_str(self) -> str:
+        return self.vocab
+
+
+class FakeTokenizer:
+    def __init__(self, vocab: str = "v1", chat_template: str = "{{ messages }}"):
+        self.backend_tokenizer = _Backend(vocab)
+        self.chat_template = chat_template
+        self.special_tokens_map = {"eos_token": "<|im_end|>"}
+
+
+def test_roundtrip_and_invalidation():
+    with tempfile.TemporaryDirectory() as tmp:
+        data = Path(tmp) / "train.jsonl"
+        data.write_text('{"messages": []}\n', encoding="utf-8")
+        cache = TokenCache(Path(tmp) / "cache")
+        tok = FakeTokenizer()
+        samples = [[1, 2, 3], [], [151643, 7] * 100]
+        calls = []
+
+        def tokenize():
+            calls.append(1)
+            return iter(samples)
+
+        split, hit = cache.get_or_build(data, tok, 256, tokenize)
+        assert not hit and len(calls) == 1
+        assert [split[i] for i in range(len(split))] == samples and split[-1] == samples[-1]
+        assert split.lengths == [3, 0, 200] and split.num_tokens == 203
+        split.close()
+
+        # 同样的输入：直接命中，不再分词
+        again, hit = cache.get_or_build(data, tok, 256, tokenize)
+        assert hit and len(calls) == 1 and again[2] == samples[2]
+        again.close()
+
+        base = cache_key(data, tok, 256)
+        assert cache_key(data, tok, 512) != base
+        assert cache_key(data, FakeTokenizer(chat_template="other"), 256) != base
+        assert cache_key(data, FakeTokenizer(vocab="v2"), 256) != base
+        assert cache_key(data, tok, 256, format_version="2") != base
+        data.write_text('{"messages": [1]}\n', encoding="utf-8")
+        assert cache_key(data, tok, 256) != base
+
+
+def test_empty_split():
+    with tempfile.TemporaryDirectory() as tmp:
+        data = Path(tmp) / "val.jsonl"
+        data.write_text("", encoding="utf-8")
+        split, _ = TokenCache(Path(tmp)).get_or_build(data, FakeTokenizer(), 128, lambda: iter([]))
+        assert len(split) == 0 and split.lengths == [] and split.num_tokens == 0
+        split.close()
+
+
+if __name__ == "__main__":
+    test_roundtrip_and_invalidation()
+    test_empty_split()
+    print("✅ 全部通过")
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+分词结果的持久缓存：同样的数据 + tokenizer + chat template + max_seq_length 只分词一次
+- 缓存 key = sha256(JSONL 文件内容, tokenizer 内容, chat template, max_seq_length, 格式化版本)：
+  tokenizer 内容取 fast tokenizer 序列化后的 tokenizer.json（与磁盘文件等价，不依赖文件在哪个缓存目录），
+  慢速 tokenizer 退回哈希其目录下的词表文件
+- 每份缓存是一个目录：tokens.bin（int32 拼接的全部 token）+ offsets.bin（int64，第 i 条样本的起止）+ meta.json
+- 读取时用 mmap 映射，不把整份数据读进内存；续训、参数搜索的每次试验都直接复用
+- 写入先落到临时目录再 os.replace，多个进程同时构建同一份缓存也不会读到半成品
+- 只用标准库（array + mmap），不需要 numpy
+"""
+
+from __future__ import annotations
+
+import array
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import sys
+import time
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+CACHE_VERSION = 1
+TOKEN_TYPE = "i"  # int32：Qwen 等词表超过 int16 范围
+OFFSET_TYPE = "q"  # int64
+
+
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer: Any) -> str:
+    """tokenizer 的内容哈希（词表、合并规则、normalizer、特殊 token、chat template）"""
+    h = hashlib.sha256()
+    h.update(type(tokenizer).__name__.encode("utf-8"))
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None and hasattr(backend, "to_str"):
+        h.update(backend.to_str().encode("utf-8"))
+    else:
+        root = Path(str(getattr(tokenizer, "name_or_path", "") or ""))
+        files = getattr(tokenizer, "vocab_files_names", {}) or {}
+        hashed = False
+        for name in sorted(files.values()):
+            if (root / name).is_file():
+                h.update(file_sha256(root / name).encode("ascii"))
+                hashed = True
+        if not hashed:
+            h.update(json.dumps(tokenizer.get_vocab(), sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    special = getattr(tokenizer, "special_tokens_map", {}) or {}
+    h.update(json.dumps(special, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    h.update(str(getattr(tokenizer, "chat_template", "") or "").encode("utf-8"))
+    return h.hexdigest()
+
+
+def cache_key(jsonl_path: Path, tokenizer: Any, max_seq_length: int, format_version: str = "") -> str:
+    h = hashlib.sha256()
+    for part in (
+        f"v{CACHE_VERSION}",
+        file_sha256(jsonl_path),
+        tokenizer_fingerprint(tokenizer),
+        str(int(max_seq_length)),
+        format_version,
+        sys.byteorder,
+    ):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()[:32]
+
+
+class TokenizedSplit(Sequence):
+    """mmap 映射的分词结果：split[i] 返回第 i 条样本的 token 列表"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.meta: Dict[str, Any] = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        self._files = []
+        self.tokens = self._map(path / "tokens.bin", TOKEN_TYPE)
+        self.offsets = self._map(path / "offsets.bin", OFFSET_TYPE)
+
+    def _map(self, file: Path, typecode: str) -> memoryview:
+        f = open(file, "rb")
+        self._files.append(f)
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(array.array(typecode))
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._files.append(mm)
+        return memoryview(mm).cast(typecode)
+
+    def __len__(self) -> int:
+        return max(0, len(self.offsets) - 1)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.tokens[self.offsets[index]:self.offsets[index + 1]].tolist()
+
+    @property
+    def lengths(self) -> List[int]:
+        offsets = self.offsets
+        return [offsets[i + 1] - offsets[i] for i in range(len(self))]
+
+    @property
+    def num_tokens(self) -> int:
+        return self.offsets[len(self)] if len(self) else 0
+
+    def close(self) -> None:
+        # memoryview 需先释放才能关闭 mmap
+        self.tokens.release()
+        self.offsets.release()
+        for f in reversed(self._files):
+            f.close()
+        self._files = []
+
+
+class TokenCache:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    def load(self, key: str) -> Optional[TokenizedSplit]:
+        path = self.path(key)
+        if not (path / "meta.json").is_file():
+            return None
+        try:
+            return TokenizedSplit(path)
+        except (OSError, ValueError):
+            return None
+
+    def build(self, key: str, token_lists: Iterable[List[int]], meta: Optional[Dict[str, Any]] = None) -> TokenizedSplit:
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f".{key}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir()
+        offsets = array.array(OFFSET_TYPE, [0])
+        with open(tmp / "tokens.bin", "wb") as f:
+            for tokens in token_lists:
+                f.write(array.array(TOKEN_TYPE, tokens).tobytes())
+                offsets.append(offsets[-1] + len(tokens))
+        with open(tmp / "offsets.bin", "wb") as f:
+            f.write(offsets.tobytes())
+        info = dict(meta or {}, samples=len(offsets) - 1, tokens=offsets[-1], created_at=time.time(), version=CACHE_VERSION)
+        (tmp / "meta.json").write_text(json.dumps(info, ensure_ascii=False, indent=2), encoding="utf-8")
+        try:
+            os.replace(tmp, self.path(key))
+        except OSError:
+            # 另一个进程已经写好了同一份缓存
+            shutil.rmtree(tmp, ignore_errors=True)
+        return TokenizedSplit(self.path(key))
+
+    def get_or_build(
+        self,
+        jsonl_path: Path,
+        tokenizer: Any,
+        max_seq_length: int,
+        tokenize: Callable[[], Iterable[List[int]]],
+        format_version: str = "",
+    ) -> Tuple[TokenizedSplit, bool]:
+        """返回 (分词结果, 是否命中缓存)；未命中时调用 tokenize() 生成并写入"""
+        key = cache_key(jsonl_path, tokenizer, max_seq_length, format_version)
+        cached = self.load(key)
+        if cached is not None:
+            return cached, True
+        meta = {"source": str(jsonl_path), "max_seq_length": int(max_seq_length), "format_version": format_version}
+        return self.build(key, tokenize(), meta), False
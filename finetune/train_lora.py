@@ -4,10 +4,23 @@ import argparse
 import os
 from dataclasses import asdict
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
 
-from env_detect import lora_target_modules_for_qwen, plan_environment, pretty_env_summary
+from env_detect import DEFAULT_TUNE_CACHE, lora_target_modules_for_qwen, plan_environment, pretty_env_summary
 from download_progress import progress_indicator
+from packing import (
+    PackedCollator,
+    PackedRows,
+    PaddedCollator,
+    TokenRows,
+    first_fit_decreasing,
+    padding_report,
+    token_lengths,
+)
+from length_sampler import TokenBudgetBatchSampler, fixed_size_padding_ratio
+from formatting import FORMAT_VERSION, format_example
+from seq_length import DEFAULT_PERCENTILE, analyze, dataset_lengths, model_length_limit
+from token_cache import TokenCache
 
 
 def _require(pkg: str):
@@ -50,10 +63,96 @@ def parse_args() -> argparse.Namespace:
     ap.add_argument("--gradient_checkpointing", action="store_true")
     ap.add_argument("--report_to", type=str, default="none", help="none|tensorboard|wandb 等")
     ap.add_argument("--resume_from_checkpoint", type=str, help="从指定检查点继续训练")
+    ap.add_argument("--packing", action="store_true", help="把多条短对话装箱拼成接近 max_seq_length 的行（样本间注意力隔离）")
+    ap.add_argument("--token_cache_dir", type=str, default="out/token_cache", help="分词缓存目录（续训与多次试验共享）")
+    ap.add_argument("--token_cache", action="store_true", help="自行分词并缓存（PaddedCollator 代替 TRL 的数据准备）；默认仍交给 TRL 每次格式化并分词")
+    ap.add_argument("--packing_benchmark_steps", type=int, default=0, help="训练前分别用打包/不打包跑几步，实测 tokens/sec 提升")
+    ap.add_argument("--token_budget_batching", action="store_true", help="按长度分桶、每批补齐后的 token 数不超过预算（代替固定条数）")
+    ap.add_argument("--max_tokens_per_batch", type=int, default=0, help="每批 token 预算，0 表示 batch_size × max_seq_length")
+    ap.add_argument("--sampler_benchmark_steps", type=int, default=0, help="训练前分别用现有采样器/按 token 预算组批跑几步，对比吞吐与峰值内存")
+    ap.add_argument("--auto_max_seq_length", action="store_true", help="按数据的 token 长度分布选择 max_seq_length（显式指定时只报告截断情况）")
+    ap.add_argument("--seq_len_percentile", type=float, default=DEFAULT_PERCENTILE, help="自动选择的长度需覆盖的训练样本分位")
+    ap.add_argument("--length_workers", type=int, default=0, help="统计长度时的分词进程数，0 表示 CPU 核数")
+    ap.add_argument("--autotune", action="store_true", help="实测最优 batch/梯度累积/序列长度（同一环境只测一次，结果缓存）")
+    ap.add_argument("--autotune_cache", type=str, default=DEFAULT_TUNE_CACHE, help="自动调参结果缓存文件")
+    ap.add_argument("--autotune_steps", type=int, default=3, help="自动调参时每个候选计时的步数")
 
     return ap.parse_args()
 
 
+def _compare_throughput(model: Any, device: str, candidates: Dict[str, Iterable[Dict[str, Any]]]) -> Dict[str, Any]:
+    """依次对每组 batch 跑前向 + 反向（第一批为预热），返回各自的 steps/sec、tokens/sec 与峰值内存"""
+    from step_bench import run_steps
+
+    results = {}
+    for name, batches in candidates.items():
+        stats = run_steps(model, batches, device)
+        results[name] = stats.to_dict()
+        peak = results[name]["peak_memory_mb"]
+        print(
+            f"   {name}: {stats.steps_per_sec:.2f} steps/s，{stats.tokens_per_sec:.0f} tokens/s，"
+            f"峰值内存 {peak if peak is not None else 'unknown'} MB"
+        )
+    return results
+
+
+def benchmark_packing(
+    model: Any,
+    token_lists: Sequence[List[int]],
+    max_seq_len: int,
+    batch_size: int,
+    steps: int,
+    device: str,
+    pad_token_id: int,
+    packed_collator: Any,
+    seed: int,
+) -> Dict[str, Any]:
+    """训练前各跑 steps 步（另加 1 步预热）：不打包（动态补齐）对比打包，返回实测吞吐"""
+    import random
+
+    rng = random.Random(seed)
+    n = (steps + 1) * batch_size
+    samples = [{"input_ids": token_lists[i]} for i in rng.sample(range(len(token_lists)), min(n, len(token_lists)))]
+    packed_rows = PackedRows(token_lists, first_fit_decreasing(token_lengths(token_lists), max_seq_len), max_seq_len)
+    rows = [packed_rows[i] for i in rng.sample(range(len(packed_rows)), min(n, len(packed_rows)))]
+    padded = PaddedCollator(pad_token_id)
+    print(f"📦 实测吞吐（{steps} 步）:")
+    results = _compare_throughput(model, device, {
+        "unpacked": (padded(samples[i:i + batch_size]) for i in range(0, len(samples), batch_size)),
+        "packed": (packed_collator(rows[i:i + batch_size]) for i in range(0, len(rows), batch_size)),
+    })
+    base, packed = results["unpacked"]["tokens_per_sec"], results["packed"]["tokens_per_sec"]
+    results["tokens_per_sec_gain"] = round(packed / base, 3) if base else None
+    return results
+
+
+def benchmark_sampler(
+    model: Any,
+    dataset: Sequence[Dict[str, Any]],
+    sampler: TokenBudgetBatchSampler,
+    batch_size: int,
+    steps: int,
+    device: str,
+    collator: Any,
+    seed: int,
+) -> Dict[str, Any]:
+    """训练前各跑 steps 步：现有的随机采样（固定 batch_size 条）对比按 token 预算组批"""
+    import random
+
+    order = list(range(len(dataset)))
+    random.Random(seed).shuffle(order)
+    fixed = [order[i:i + batch_size] for i in range(0, min(len(order), (steps + 1) * batch_size), batch_size)]
+    budget = sampler.batches(0)[:steps + 1]
+    print(f"🪣 采样器对比（{steps} 步）:")
+    results = _compare_throughput(model, device, {
+        "fixed_batch_size": (collator([dataset[i] for i in b]) for b in fixed),
+        "token_budget": (collator([dataset[i] for i in b]) for b in budget),
+    })
+    base, new = results["fixed_batch_size"]["tokens_per_sec"], results["token_budget"]["tokens_per_sec"]
+    results["tokens_per_sec_gain"] = round(new / base, 3) if base else None
+    return results
+
+
 def main() -> None:
     args = parse_args()
 
@@ -66,7 +165,7 @@ def main() -> None:
 
     import torch
     from datasets import load_dataset
-    from peft import LoraConfig
+    from peft import LoraConfig, get_peft_model
     from transformers import AutoModelForCausalLM, AutoTokenizer
 
     try:
@@ -86,21 +185,6 @@ def main() -> None:
     if args.gradient_accumulation_steps:
         overrides["gradient_accumulation_steps"] = args.gradient_accumulation_steps
 
-    plan = plan_environment(overrides=overrides)
-    print("[env]", pretty_env_summary(plan))
-
-    # CUDA 一些常见加速开关（安全）
-    if plan.device == "cuda":
-        try:
-            torch.backends.cuda.matmul.allow_tf32 = True
-        except Exception:
-            pass
-
-    # dtype
-    # 注意：某些 accelerate/transformers 版本在 MPS 上不允许 fp16 mixed precision（会报错），
-    # 所以 env_detect 已默认把 MPS 设为 fp32；这里再做一次兜底。
-    torch_dtype = {"bf16": torch.bfloat16, "fp16": torch.float16, "fp32": torch.float32}[plan.dtype]
-
     # tokenizer & model - 智能缓存检测
     try:
         from model_cache import smart_model_load_message
@@ -116,6 +200,58 @@ def main() -> None:
     if tokenizer.pad_token is None:
         tokenizer.pad_token = tokenizer.eos_token
 
+    # dataset
+    train_path = str(Path(args.train_jsonl))
+    val_path = str(Path(args.val_jsonl))
+    data_files = {"train": train_path}
+    if not args.no_eval and Path(val_path).exists():
+        data_files["validation"] = val_path
+
+    # 按数据长度分布选择 max_seq_length（在规划 batch 与自动调参之前）
+    seq_report = None
+    if args.auto_max_seq_length:
+        print("⏳ 统计数据 token 长度...")
+        lengths = dataset_lengths(
+            {name: Path(p) for name, p in data_files.items()}, tokenizer,
+            Path(args.token_cache_dir) if args.token_cache else None, FORMAT_VERSION, args.length_workers,
+        )
+        seq_report = analyze(
+            lengths, args.seq_len_percentile, limit=model_length_limit(tokenizer),
+            extra_candidates=[args.max_seq_length],
+        )
+        print("\n".join(seq_report.lines()))
+        if not args.max_seq_length:
+            overrides["max_seq_length"] = seq_report.chosen
+
+    # LoRA
+    if args.target_modules.strip():
+        target_modules = tuple(x.strip() for x in args.target_modules.split(",") if x.strip())
+    else:
+        target_modules = lora_target_modules_for_qwen()
+
+    tune_key = None
+    if args.autotune:
+        from autotune import tune_key_for
+
+        tune_key = tune_key_for(
+            args.model_name_or_path, args.lora_r, target_modules, args.gradient_checkpointing,
+            overrides.get("max_seq_length", 0),
+        )
+    plan = plan_environment(overrides=overrides, tune_key=tune_key, tune_cache=args.autotune_cache)
+    print("[env]", pretty_env_summary(plan))
+
+    # CUDA 一些常见加速开关（安全）
+    if plan.device == "cuda":
+        try:
+            torch.backends.cuda.matmul.allow_tf32 = True
+        except Exception:
+            pass
+
+    # dtype
+    # 注意：某些 accelerate/transformers 版本在 MPS 上不允许 fp16 mixed precision（会报错），
+    # 所以 env_detect 已默认把 MPS 设为 fp32；这里再做一次兜底。
+    torch_dtype = {"bf16": torch.bfloat16, "fp16": torch.float16, "fp32": torch.float32}[plan.dtype]
+
     # device_map 策略：cuda 用 auto；mps/cpu 直接本地加载后 .to(device)
     device_map = "auto" if plan.device == "cuda" else None
 
@@ -135,12 +271,6 @@ def main() -> None:
         model.gradient_checkpointing_enable()
         model.config.use_cache = False
 
-    # LoRA
-    if args.target_modules.strip():
-        target_modules = tuple(x.strip() for x in args.target_modules.split(",") if x.strip())
-    else:
-        target_modules = lora_target_modules_for_qwen()
-
     lora_cfg = LoraConfig(
         r=args.lora_r,
         lora_alpha=args.lora_alpha,
@@ -149,55 +279,22 @@ def main() -> None:
         task_type="CAUSAL_LM",
         target_modules=list(target_modules),
     )
-
-    # dataset
-    train_path = str(Path(args.train_jsonl))
-    val_path = str(Path(args.val_jsonl))
-    data_files = {"train": train_path}
-    if not args.no_eval and Path(val_path).exists():
-        data_files["validation"] = val_path
+    peft_config: Optional[LoraConfig] = lora_cfg
+    if args.autotune and plan.source != "autotune":
+        # 没有该环境的缓存：在真正要训练的 LoRA 模型上实测，之后交给 SFTTrainer 时不再重复包装
+        from autotune import tune_plan
+
+        if args.gradient_checkpointing:
+            model.enable_input_require_grads()
+        model = get_peft_model(model, lora_cfg)
+        peft_config = None
+        plan = tune_plan(model, plan, model.config.vocab_size, overrides, args.autotune_cache, args.autotune_steps)
+        print("[env]", pretty_env_summary(plan))
 
     ds = load_dataset("json", data_files=data_files)
 
     def formatting_func(example: Dict[str, Any]) -> str:
-        messages: List[Dict[str, str]] = example.get("messages") or []
-        if not messages:
-            # 兼容 instruction/input/output 的简易格式（如果用户未来换数据）
-            inst = (example.get("instruction") or "").strip()
-            inp = (example.get("input") or "").strip()
-            out = (example.get("output") or "").strip()
-            user = inst + ("\n\n" + inp if inp else "")
-            messages = [{"role": "user", "content": user}, {"role": "assistant", "content": out}]
-
-        # 对于Qwen模型，确保system消息被正确处理
-        # 检查是否包含system消息
-        has_system = any(msg.get("role") == "system" for msg in messages)
-
-        try:
-            # 尝试使用chat template
-            formatted = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=False)
-
-            # 验证system消息是否被包含（简单检查）
-            if has_system:
-                system_content = next(msg["content"] for msg in messages if msg.get("role") == "system")
-                if system_content[:50] not in formatted:
-                    print(f"⚠️  警告：system消息可能未被正确处理")
-
-            return formatted
-        except Exception as e:
-            print(f"⚠️  Chat template处理失败，回退到简单格式: {e}")
-            # 回退：手动构建对话格式
-            result = ""
-            for msg in messages:
-                role = msg.get("role", "")
-                content = msg.get("content", "")
-                if role == "system":
-                    result += f"<|system|>\n{content}\n"
-                elif role == "user":
-                    result += f"<|user|>\n{content}\n"
-                elif role == "assistant":
-                    result += f"<|assistant|>\n{content}\n"
-            return result
+        return format_example(example, tokenizer)
 
     # training args
     per_device_bs = int(plan.defaults["per_device_train_batch_size"])
@@ -210,6 +307,71 @@ def main() -> None:
     eval_strategy = "no" if args.no_eval else "steps"
     report_to = None if args.report_to == "none" else [args.report_to]
 
+    train_dataset = ds["train"]
+    eval_dataset = None if args.no_eval or "validation" not in ds else ds["validation"]
+    data_collator = None
+    pretokenized_kwargs: Dict[str, Any] = {}
+    batching_meta: Dict[str, Any] = {}
+    sampler: Optional[TokenBudgetBatchSampler] = None
+    # 打包与按 token 预算组批需要先拿到分词结果；其余情况只有显式 --token_cache 才绕过 TRL 的数据准备
+    pretokenized = args.packing or args.token_budget_batching or args.token_cache
+    if pretokenized:
+        cache = TokenCache(Path(args.token_cache_dir)) if args.token_cache else None
+
+        def tokenize(split, chunk: int = 256) -> Iterator[List[int]]:
+            # 批量调用 fast tokenizer（Rust 侧并行），逐块产出，写缓存时不必整份留在内存
+            for start in range(0, len(split), chunk):
+                texts = [formatting_func(ex) for ex in split.select(range(start, min(start + chunk, len(split))))]
+                yield from tokenizer(texts, add_special_tokens=False, truncation=True, max_length=max_seq_len)["input_ids"]
+
+        def load_tokens(split, path: str) -> Sequence[List[int]]:
+            if cache is None:
+                return list(tokenize(split))
+            tokens, hit = cache.get_or_build(Path(path), tokenizer, max_seq_len, lambda: tokenize(split), FORMAT_VERSION)
+            state = "命中" if hit else "已写入"
+            print(f"🗂️  分词缓存{state}: {path} -> {tokens.path}（{len(tokens)} 条，{tokens.num_tokens} tokens）")
+            return tokens
+
+        print("⏳ 准备分词数据...")
+        train_tokens = load_tokens(train_dataset, train_path)
+        eval_tokens = load_tokens(eval_dataset, val_path) if eval_dataset is not None else None
+        train_lengths = token_lengths(train_tokens)
+        row_lengths = [min(n, max_seq_len) for n in train_lengths]
+        if args.packing:
+            batching_meta["packing"] = padding_report(train_lengths, max_seq_len, per_device_bs)
+            rep = batching_meta["packing"]
+            print(
+                f"📦 打包: {rep['samples']} 条样本 -> {rep['rows_packed']} 行；padding 比例 "
+                f"{rep['padding_ratio_unpacked']:.1%}（不打包，动态补齐）/ {rep['padding_ratio_max_len']:.1%}（补齐到 max_seq_length）"
+                f" -> {rep['padding_ratio_packed']:.1%}（打包），计算量估算减少到 1/{rep['estimated_speedup']}"
+            )
+            train_bins = first_fit_decreasing(train_lengths, max_seq_len)
+            train_dataset = PackedRows(train_tokens, train_bins, max_seq_len)
+            row_lengths = [sum(row_lengths[i] for i in b) for b in train_bins]
+            if eval_tokens is not None:
+                eval_bins = first_fit_decreasing(token_lengths(eval_tokens), max_seq_len)
+                eval_dataset = PackedRows(eval_tokens, eval_bins, max_seq_len)
+            attn = getattr(model.config, "_attn_implementation", None) or "sdpa"
+            data_collator = PackedCollator(tokenizer.pad_token_id, attn_implementation=attn, dtype=model.dtype)
+        else:
+            train_dataset = TokenRows(train_tokens)
+            eval_dataset = TokenRows(eval_tokens) if eval_tokens is not None else None
+            data_collator = PaddedCollator(tokenizer.pad_token_id)
+        if args.token_budget_batching:
+            budget = args.max_tokens_per_batch or per_device_bs * max_seq_len
+            sampler = TokenBudgetBatchSampler(row_lengths, budget, seed=args.seed)
+            batching_meta["token_budget"] = dict(
+                sampler.report(),
+                fixed_padding_ratio=fixed_size_padding_ratio(row_lengths, per_device_bs, args.seed),
+            )
+            rep = batching_meta["token_budget"]
+            print(
+                f"🪣 按 token 预算组批: 每批 ≤ {budget} tokens，{rep['batches']} 批（平均 {rep['mean_batch_size']} 条）；"
+                f"padding 比例 {rep['fixed_padding_ratio']:.1%}（固定 {per_device_bs} 条）-> {rep['padding_ratio']:.1%}"
+            )
+        # 数据已分好词：跳过 TRL 的格式化与分词，保留 seq_lens 等列给 collator
+        pretokenized_kwargs = {"dataset_kwargs": {"skip_prepare_dataset": True}, "remove_unused_columns": False}
+
     # TRL 0.15.x：通过 SFTConfig 传递 max_seq_length/packing 等参数
     use_mps_device = plan.device == "mps"
     sft_args = SFTConfig(
@@ -235,8 +397,9 @@ def main() -> None:
         seed=args.seed,
         dataloader_pin_memory=(plan.device == "cuda"),
         max_seq_length=max_seq_len,
-        packing=False,
+        packing=False,  # 打包由 packing.py 完成（TRL 自带的打包不隔离样本间注意力）
         resume_from_checkpoint=args.resume_from_checkpoint,
+        **pretokenized_kwargs,
     )
 
     # 如果要从checkpoint恢复，需要先加载LoRA权重
@@ -252,20 +415,53 @@ def main() -> None:
                 print(f"⚠️  警告：checkpoint中未找到LoRA权重文件")
                 print(f"   可能无法正确恢复训练状态")
     
-    trainer = SFTTrainer(
+    trainer_cls = SFTTrainer
+    if sampler is not None:
+        budget_sampler = sampler
+
+        class TokenBudgetSFTTrainer(SFTTrainer):
+            """训练集按 token 预算组批：per_device_train_batch_size 不再生效，每批条数由采样器决定"""
+
+            def get_train_dataloader(self):
+                from torch.utils.data import DataLoader
+
+                loader = DataLoader(
+                    self.train_dataset,
+                    batch_sampler=budget_sampler,
+                    collate_fn=self.data_collator,
+                    num_workers=self.args.dataloader_num_workers,
+                    pin_memory=self.args.dataloader_pin_memory,
+                )
+                return self.accelerator.prepare(loader)
+
+        trainer_cls = TokenBudgetSFTTrainer
+
+    trainer = trainer_cls(
         model=model,
         args=sft_args,
-        train_dataset=ds["train"],
-        eval_dataset=None if args.no_eval or "validation" not in ds else ds["validation"],
+        train_dataset=train_dataset,
+        eval_dataset=eval_dataset,
         processing_class=tokenizer,
-        formatting_func=formatting_func,
-        peft_config=lora_cfg,
+        formatting_func=None if pretokenized else formatting_func,
+        data_collator=data_collator,
+        peft_config=peft_config,
     )
     try:
         trainer.model.print_trainable_parameters()
     except Exception:
         pass
 
+    if args.packing and args.packing_benchmark_steps > 0:
+        batching_meta["packing_benchmark"] = benchmark_packing(
+            trainer.model, train_tokens, max_seq_len, per_device_bs, args.packing_benchmark_steps,
+            plan.device, tokenizer.pad_token_id, data_collator, args.seed,
+        )
+    if sampler is not None and args.sampler_benchmark_steps > 0:
+        batching_meta["sampler_benchmark"] = benchmark_sampler(
+            trainer.model, train_dataset, sampler, per_device_bs, args.sampler_benchmark_steps,
+            plan.device, data_collator, args.seed,
+        )
+
     # 训练（会自动处理resume_from_checkpoint）
     if args.resume_from_checkpoint:
         print(f"🔄 开始从checkpoint恢复训练...")
@@ -273,7 +469,24 @@ def main() -> None:
     
     # 显式传入 resume_from_checkpoint，确保 optimizer/scheduler/global_step 等状态被正确恢复
     # （仅在 TrainingArguments/SFTConfig 里设置有时不会触发完整恢复，取决于 transformers/trl 版本）
-    trainer.train(resume_from_checkpoint=args.resume_from_checkpoint)
+    start_step = 0
+    if args.resume_from_checkpoint:
+        try:
+            state_file = Path(args.resume_from_checkpoint) / "trainer_state.json"
+            start_step = int(__import__("json").loads(state_file.read_text(encoding="utf-8"))["global_step"])
+        except (OSError, ValueError, KeyError, TypeError):
+            start_step = -1  # 不知道从哪一步开始，无法算出本次训练了多少 token
+    train_result = trainer.train(resume_from_checkpoint=args.resume_from_checkpoint)
+
+    if pretokenized and start_step >= 0:
+        runtime = (getattr(train_result, "metrics", None) or {}).get("train_runtime")
+        total_steps = trainer.state.max_steps
+        steps_run = trainer.state.global_step - start_step
+        if runtime and total_steps and steps_run > 0:
+            # 本次实际跑过的优化步数占全程的比例 × 全程 token 数 / 本次训练耗时（续训时不计之前跑过的步）
+            trained = sum(row_lengths) * args.num_train_epochs * steps_run / total_steps
+            batching_meta["train_tokens_per_sec"] = round(trained / runtime, 1)
+            print(f"⚡ 训练吞吐: {batching_meta['train_tokens_per_sec']} tokens/s")
 
     # 保存 LoRA adapter
     trainer.model.save_pretrained(str(out_dir))
@@ -285,6 +498,10 @@ def main() -> None:
         "args": vars(args),
         "resolved": {"per_device_train_batch_size": per_device_bs, "gradient_accumulation_steps": grad_accum, "max_seq_length": max_seq_len},
     }
+    if batching_meta:
+        meta["batching"] = batching_meta
+    if seq_report is not None:
+        meta["seq_length"] = seq_report.to_dict()
     (out_dir / "run_meta.json").write_text(__import__("json").dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
 
     if args.merge_and_save:
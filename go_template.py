@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Ollama 模型 TEMPLATE（Go text/template）的最小实现，用于在代理端把对话历史渲染成模型实际看到的 prompt
+- 支持 Ollama 模板用到的语法：{{- -}} 去空白、注释、if / else if / else、range（含 $i, $v :=）、with、
+  变量声明与赋值、括号与管道、.Field / $.Field / $v.Field 取值
+- 函数：and or not eq ne lt le gt ge len index slice print json
+- 渲染出错（语法不支持、取值类型不对）时抛出 TemplateError，调用方据此放弃并回退
+- 只求与 Go 的输出一致，不做 HTML 转义（text/template 本来也不转义）
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+ACTION_RE = re.compile(r"\{\{(-[ \t\r\n])?(.*?)([ \t\r\n]-)?\}\}", re.S)
+TOKEN_RE = re.compile(
+    r"""\s*(?:
+    (?P<str>"(?:[^"\\]|\\.)*"|`[^`]*`)
+  | (?P<num>-?\d+(?:\.\d+)?)
+  | (?P<decl>:=)
+  | (?P<punct>[()|,=])
+  | (?P<var>\$[A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*)
+  | (?P<field>(?:\.[A-Za-z_][A-Za-z0-9_]*)+|\.)
+  | (?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+    )""",
+    re.X,
+)
+
+
+class TemplateError(Exception):
+    pass
+
+
+class _StopRender(Exception):
+    """渲染到 .Response 时提前结束（stop_at 选项）"""
+
+
+# ---------------------------------------------------------------------- 解析
+
+def _tokenize(src: str) -> List[Tuple[str, str]]:
+    tokens: List[Tuple[str, str]] = []
+    pos = 0
+    src = src.strip()
+    while pos < len(src):
+        m = TOKEN_RE.match(src, pos)
+        if not m or m.end() == pos:
+            raise TemplateError(f"无法解析: {src[pos:]!r}")
+        kind = m.lastgroup
+        tokens.append((kind, m.group(kind)))
+        pos = m.end()
+        while pos < len(src) and src[pos].isspace():
+            pos += 1
+    return tokens
+
+
+def _split_actions(text: str) -> List[Tuple[str, str]]:
+    """[("text", 文本) | ("action", 动作内容)]，已处理 {{- 与 -}} 的去空白"""
+    parts: List[Tuple[str, str]] = []
+    pos = 0
+    trim_next = False
+    for m in ACTION_RE.finditer(text):
+        chunk = text[pos:m.start()]
+        if trim_next:
+            chunk = chunk.lstrip()
+        if m.group(1):
+            chunk = chunk.rstrip()
+        if chunk:
+            parts.append(("text", chunk))
+        body = m.group(2).strip()
+        if not (body.startswith("/*") and body.endswith("*/")):
+            parts.append(("action", body))
+        trim_next = bool(m.group(3))
+        pos = m.end()
+    chunk = text[pos:]
+    if trim_next:
+        chunk = chunk.lstrip()
+    if chunk:
+        parts.append(("text", chunk))
+    return parts
+
+
+class _Parser:
+    def __init__(self, text: str):
+        self.parts = _split_actions(text)
+        self.pos = 0
+
+    def parse(self) -> List[Any]:
+        nodes, end = self._list()
+        if end is not None:
+            raise TemplateError(f"多余的 {{{{{end}}}}}")
+        return nodes
+
+    def _list(self) -> Tuple[List[Any], Optional[str]]:
+        """读到 end / else 为止，返回 (节点, 结束动作)"""
+        nodes: List[Any] = []
+        while self.pos < len(self.parts):
+            kind, value = self.parts[self.pos]
+            self.pos += 1
+            if kind == "text":
+                nodes.append(("text", value))
+                continue
+            word = value.split(None, 1)[0] if value else ""
+            rest = value[len(word):].strip()
+            if word in ("end", "else"):
+                return nodes, value
+            if word in ("if", "with"):
+                nodes.append(self._branches(word, rest))
+            elif word == "range":
+                names: List[str] = []
+                tokens = _tokenize(rest)
+                if any(k == "decl" for k, _ in tokens):
+                    i = next(i for i, (k, _) in enumerate(tokens) if k == "decl")
+                    names = [v for k, v in tokens[:i] if k == "var"]
+                    tokens = tokens[i + 1:]
+                body, end = self._list()
+                other: List[Any] = []
+                if end == "else":
+                    other, end = self._list()
+                if end != "end":
+                    raise TemplateError("range 缺少 end")
+                nodes.append(("range", names, tokens, body, other))
+            elif word in ("define", "template", "block", "break", "continue"):
+                raise TemplateError(f"不支持 {word}")
+            else:
+                nodes.append(("action", _tokenize(value)))
+        return nodes, None
+
+    def _branches(self, word: str, cond: str) -> Any:
+        branches = []
+        other: List[Any] = []
+        current = _tokenize(cond)
+        while True:
+            body, end = self._list()
+            branches.append((current, body))
+            if end == "end":
+                break
+            if end is None:
+                raise TemplateError(f"{word} 缺少 end")
+            rest = end[len("else"):].strip()
+            if rest.startswith(word + " "):
+                current = _tokenize(rest[len(word):])  # else if / else with
+                continue
+            other, end = self._list()
+            if end != "end":
+                raise TemplateError(f"{word} 缺少 end")
+            break
+        return (word, branches, other)
+
+
+# ---------------------------------------------------------------------- 求值
+
+def truth(value: Any) -> bool:
+    if value is None or value is False:
+        return False
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value != 0
+    if isinstance(value, (str, list, tuple, dict)):
+        return len(value) > 0
+    return True
+
+
+def _text(value: Any) -> str:
+    if value is None:
+        return ""
+    if value is True or value is False:
+        return "true" if value else "false"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def _field(value: Any, name: str) -> Any:
+    if isinstance(value, dict):
+        return value.get(name)
+    return getattr(value, name, None)
+
+
+def _eq(a: Any, *others: Any) -> bool:
+    return any(a == b for b in others)
+
+
+def _slice(value: Any, *idx: Any) -> Any:
+    if value is None:
+        return None
+    start = int(idx[0]) if idx else 0
+    end = int(idx[1]) if len(idx) > 1 else len(value)
+    if not 0 <= start <= end <= len(value):
+        raise TemplateError("slice 越界")
+    return value[start:end]
+
+
+def _index(value: Any, *keys: Any) -> Any:
+    for k in keys:
+        try:
+            value = value[k]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return value
+
+
+FUNCS = {
+    "not": lambda v: not truth(v),
+    "eq": _eq,
+    "ne": lambda a, b: a != b,
+    "lt": lambda a, b: a < b,
+    "le": lambda a, b: a <= b,
+    "gt": lambda a, b: a > b,
+    "ge": lambda a, b: a >= b,
+    "len": lambda v: len(v) if v is not None else 0,
+    "index": _index,
+    "slice": _slice,
+    "print": lambda *a: "".join(_text(x) for x in a),
+    "json": lambda v: json.dumps(v, ensure_ascii=False),
+}
+
+
+class _Renderer:
+    def __init__(self, data: Dict[str, Any], stop_at: Optional[str]):
+        self.root = data
+        self.stop_at = stop_at
+        self.out: List[str] = []
+
+    def run(self, nodes: List[Any], dot: Any, scopes: List[Dict[str, Any]]) -> None:
+        for node in nodes:
+            kind = node[0]
+            if kind == "text":
+                self.out.append(node[1])
+            elif kind == "action":
+                tokens = node[1]
+                if len(tokens) > 2 and tokens[0][0] == "var" and tokens[1][0] in ("decl", "punct") and tokens[1][1] in (":=", "="):
+                    value = self.pipeline(tokens[2:], dot, scopes)
+                    if tokens[1][1] == ":=":
+                        scopes[-1][tokens[0][1]] = value
+                    else:
+                        next((s for s in reversed(scopes) if tokens[0][1] in s), scopes[-1])[tokens[0][1]] = value
+                else:
+                    self.out.append(_text(self.pipeline(tokens, dot, scopes)))
+            elif kind in ("if", "with"):
+                for cond, body in node[1]:
+                    value = self.pipeline(cond, dot, scopes)
+                    if truth(value):
+                        self.run(body, value if kind == "with" else dot, scopes + [{}])
+                        break
+                else:
+                    self.run(node[2], dot, scopes + [{}])
+            elif kind == "range":
+                _, names, tokens, body, other = node
+                items = self.pipeline(tokens, dot, scopes)
+                pairs = list(items.items()) if isinstance(items, dict) else list(enumerate(items or []))
+                if not pairs:
+                    self.run(other, dot, scopes + [{}])
+                for key, item in pairs:
+                    scope: Dict[str, Any] = {}
+                    if len(names) == 1:
+                        scope[names[0]] = item
+                    elif len(names) == 2:
+                        scope[names[0]], scope[names[1]] = key, item
+                    self.run(body, item, scopes + [scope])
+
+    def pipeline(self, tokens: List[Tuple[str, str]], dot: Any, scopes: List[Dict[str, Any]]) -> Any:
+        commands: List[List[Tuple[str, str]]] = [[]]
+        depth = 0
+        for tok in tokens:
+            if tok == ("punct", "("):
+                depth += 1
+            elif tok == ("punct", ")"):
+                depth -= 1
+            if tok == ("punct", "|") and depth == 0:
+                commands.append([])
+            else:
+                commands[-1].append(tok)
+        value: Any = None
+        for i, cmd in enumerate(commands):
+            value = self.command(cmd, dot, scopes, [value] if i else [])
+        return value
+
+    def command(self, tokens: List[Tuple[str, str]], dot: Any, scopes: List[Dict[str, Any]], piped: List[Any]) -> Any:
+        operands: List[Any] = []
+        i = 0
+        while i < len(tokens):
+            kind, value = tokens[i]
+            if value == "(" and kind == "punct":
+                depth, j = 1, i + 1
+                while j < len(tokens) and depth:
+                    depth += {"(": 1, ")": -1}.get(tokens[j][1], 0) if tokens[j][0] == "punct" else 0
+                    j += 1
+                operands.append(("value", self.pipeline(tokens[i + 1:j - 1], dot, scopes)))
+                i = j
+                # (expr).Field
+                if i < len(tokens) and tokens[i][0] == "field" and tokens[i][1] != ".":
+                    operands[-1] = ("value", self.fields(operands[-1][1], tokens[i][1]))
+                    i += 1
+                continue
+            operands.append((kind, value))
+            i += 1
+        if not operands:
+            raise TemplateError("空的动作")
+        head_kind, head = operands[0]
+        if head_kind == "ident" and head not in ("true", "false", "nil"):
+            args = [self.operand(o, dot, scopes) for o in operands[1:]] + piped
+            if head in ("and", "or"):
+                result = args[0] if args else None
+                for a in args:
+                    result = a
+                    if truth(a) != (head == "and"):
+                        break
+                return result
+            fn = FUNCS.get(head)
+            if fn is None:
+                raise TemplateError(f"不支持的函数 {head}")
+            try:
+                return fn(*args)
+            except TypeError as e:
+                raise TemplateError(f"{head}: {e}") from e
+        if len(operands) > 1 or piped:
+            raise TemplateError("非函数不能带参数")
+        return self.operand(operands[0], dot, scopes)
+
+    def operand(self, operand: Tuple[str, Any], dot: Any, scopes: List[Dict[str, Any]]) -> Any:
+        kind, value = operand
+        if kind == "value":
+            return value
+        if kind == "str":
+            return value[1:-1] if value.startswith("`") else json.loads(value)
+        if kind == "num":
+            return float(value) if "." in value else int(value)
+        if kind == "ident":
+            return {"true": True, "false": False, "nil": None}.get(value)
+        if kind == "field":
+            return self.fields(dot, value)
+        if kind == "var":
+            name, _, path = value.partition(".")
+            if name == "$":
+                base = self.root
+            else:
+                scope = next((s for s in reversed(scopes) if name in s), None)
+                if scope is None:
+                    raise TemplateError(f"未定义的变量 {name}")
+                base = scope[name]
+            return self.fields(base, "." + path) if path else base
+        raise TemplateError(f"无法求值 {value!r}")
+
+    def fields(self, base: Any, path: str) -> Any:
+        for name in path.split(".")[1:]:
+            if not name:
+                continue
+            if name == self.stop_at:
+                raise _StopRender()
+            base = _field(base, name)
+        return base
+
+
+def render(template: str, data: Dict[str, Any], stop_at: Optional[str] = None) -> str:
+    """stop_at：渲染到该字段（如 "Response"）时停止，返回之前的输出"""
+    nodes = _Parser(template).parse()
+    renderer = _Renderer(data, stop_at)
+    try:
+        renderer.run(nodes, data, [{"$": data}])
+    except _StopRender:
+        pass
+    except (ValueError, IndexError, KeyError) as e:
+        raise TemplateError(f"{type(e).__name__}: {e}") from e
+    return "".join(renderer.out)
+
+
+def uses_field(template: str, name: str) -> bool:
+    return re.search(r"\{\{[^}]*\." + re.escape(name) + r"\b", template) is not None
@@ -16,9 +16,11 @@ window.sendMessage = async function() {
     const messages = keepHistory ? chatHistory : [chatHistory[chatHistory.length - 1]];
 
     try {
+        const headers = { 'Content-Type': 'application/json' };
+        if (SESSION_CONTEXT) headers['X-Panel-Session'] = getChatSessionId(currentAgent.modelName);
         const response = await fetch(`${API_BASE}/api/chat`, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: headers,
             body: JSON.stringify({
                 model: currentAgent.modelName,
                 messages: messages,
@@ -26,30 +28,64 @@ window.sendMessage = async function() {
             })
         });
 
+        if (response.status === 503) {
+            const err = await response.json().catch(() => ({}));
+            throw new Error(err.error || '服务繁忙，请稍后重试');
+        }
+
+        // 代理按上下文预算裁掉了较早的历史
+        const trimmedTokens = parseInt(response.headers.get('X-Panel-Trimmed-Tokens') || '0', 10);
+        if (trimmedTokens > 0) {
+            const trimmedMessages = response.headers.get('X-Panel-Trimmed-Messages') || '?';
+            assistantMsg.title = `已省略较早的 ${trimmedMessages} 条消息（约 ${trimmedTokens} tokens）以适应上下文窗口`;
+        }
+
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
         let fullText = '';
+        let pending = '';
         contentDiv.textContent = '';
 
         while (true) {
             const { done, value } = await reader.read();
             if (done) break;
 
-            const chunk = decoder.decode(value, { stream: true });
-            const lines = chunk.split('\n');
+            // 一行 NDJSON 可能被拆在两个 chunk 里：最后一段不完整的留到下次拼接
+            pending += decoder.decode(value, { stream: true });
+            const lines = pending.split('\n');
+            pending = lines.pop();
 
             for (const line of lines) {
                 if (!line.trim()) continue;
+                let json;
                 try {
-                    const json = JSON.parse(line);
-                    if (json.message && json.message.content) {
-                        const content = json.message.content;
-                        fullText += content;
-                        contentDiv.textContent = fullText;
-                        const chatArea = document.getElementById('chatArea');
-                        chatArea.scrollTop = chatArea.scrollHeight;
+                    json = JSON.parse(line);
+                } catch (e) {
+                    console.warn('无法解析的流数据行:', line);
+                    continue;
+                }
+                if (json.error) throw new Error(json.error);
+                if (json.panel_queue) {
+                    // 代理排队事件：position > 0 表示前面还有请求
+                    if (!fullText) {
+                        contentDiv.textContent = json.panel_queue.position > 0
+                            ? `排队中（第 ${json.panel_queue.position} 位）...`
+                            : '...';
                     }
-                } catch (e) {}
+                    continue;
+                }
+                if (json.done && json.panel_session && json.panel_session.saved_prompt_tokens > 0) {
+                    const saved = json.panel_session;
+                    const ms = saved.saved_prompt_ms != null ? `，约 ${Math.round(saved.saved_prompt_ms)} ms` : '';
+                    assistantMsg.title = `复用会话上下文，省去 ${saved.saved_prompt_tokens} tokens 的 prompt 处理${ms}`;
+                }
+                if (json.message && json.message.content) {
+                    const content = json.message.content;
+                    fullText += content;
+                    contentDiv.textContent = fullText;
+                    const chatArea = document.getElementById('chatArea');
+                    chatArea.scrollTop = chatArea.scrollHeight;
+                }
             }
         }
 
@@ -62,15 +98,21 @@ window.sendMessage = async function() {
     }
 };
 
-function addMessage(role, content) {
-    const container = document.getElementById('chatContainerInner');
+function createMessageElement(role, content, timestamp) {
     const msgDiv = document.createElement('div');
     msgDiv.className = `message ${role}`;
+    const time = timestamp ? new Date(timestamp) : new Date();
 
     msgDiv.innerHTML = `
         <div class="message-content">${content}</div>
-        <div class="message-time">${new Date().toLocaleTimeString([], {hour: '2-digit', minute:'2-digit'})}</div>
+        <div class="message-time">${time.toLocaleTimeString([], {hour: '2-digit', minute:'2-digit'})}</div>
     `;
+    return msgDiv;
+}
+
+function addMessage(role, content, timestamp) {
+    const container = document.getElementById('chatContainerInner');
+    const msgDiv = createMessageElement(role, content, timestamp);
 
     container.appendChild(msgDiv);
     const chatArea = document.getElementById('chatArea');
@@ -83,13 +125,29 @@ function addMessage(role, content) {
     return msgDiv;
 }
 
+function getChatSessionId(modelName) {
+    if (!chatSessionIds[modelName]) {
+        // 与对话记录一起保存：页面重新加载后继续使用同一个 id，服务端据此重新播种 context
+        const key = `chat_session_${modelName}`;
+        chatSessionIds[modelName] = localStorage.getItem(key)
+            || `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+        localStorage.setItem(key, chatSessionIds[modelName]);
+    }
+    return chatSessionIds[modelName];
+}
+
 window.clearChat = function() {
     chatHistory = [];
+    if (currentAgent) delete chatSessionIds[currentAgent.modelName];
+    chatPersistedCount = 0;
+    chatOlderCursor = null;
     const container = document.getElementById('chatContainerInner');
     if (container) container.innerHTML = '';
 
     if (currentAgent) {
         localStorage.removeItem(`chat_${currentAgent.modelName}`);
+        localStorage.removeItem(`chat_session_${currentAgent.modelName}`);
+        if (CHAT_STORE_API) deleteServerChatHistory(currentAgent.modelName);
     }
     showToast('对话已清空');
 };
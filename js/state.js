@@ -1,7 +1,9 @@
 // 全局状态与常量
 // 注意：本项目采用传统多脚本加载（非 ESM），此文件需最先加载。
 
-const API_BASE = 'http://localhost:11434';
+// 由 server.py（asyncio 模式）托管时经同源 /api 代理访问 Ollama（连接池复用）；
+// 其他静态服务器（npx http-server、server.py --legacy）仍直连 11434
+const API_BASE = window.__PANEL_PROXY__ ? window.location.origin : 'http://localhost:11434';
 
 let chatHistory = [];
 let currentAgent = null;
@@ -10,5 +12,24 @@ let baseModels = [];
 let editingAgent = null;
 let isPulling = false;
 
+// 聊天记录：由 server.py 托管时追加写入服务端（SQLite，分页读取）；否则沿用 localStorage
+const CHAT_STORE_API = window.__PANEL_CHAT_STORE__ ? `${window.location.origin}/panel/chats` : null;
+const CHAT_PAGE_SIZE = 50;
+let chatPersistedCount = 0; // chatHistory 中已写入服务端的条数
+let chatOlderCursor = null; // 继续向前翻页的游标（null 表示没有更早的消息）
+
+// 模型预热：选中智能体时提示服务端提前加载模型（server.py --warm-top）
+const WARM_POOL_API = window.__PANEL_WARM__ ? `${window.location.origin}/panel/warm` : null;
+
+// 模型拉取：由服务端后台执行并去重，进度经 SSE 推送（关闭页面不影响拉取）
+const PULLS_API = window.__PANEL_PULLS__ ? `${window.location.origin}/panel/pulls` : null;
+
+// 智能体索引：服务端并发获取 /api/show 并解析 Modelfile，一次返回全部智能体的配置
+const AGENTS_API = window.__PANEL_AGENTS__ ? `${window.location.origin}/panel/agents` : null;
+
+// 会话上下文复用：每段对话带一个 id，服务端据此复用 Ollama 的 context，不再每轮重新处理整段历史
+const SESSION_CONTEXT = !!window.__PANEL_SESSIONS__;
+let chatSessionIds = {}; // 模型名 -> 当前对话 id（与对话记录一起存在 localStorage，清空聊天时重新生成）
+
 // 兼容：用于旧入口（app.js）检测是否已加载过拆分脚本
 window.__OLLAMA_WEB_BOOTSTRAPPED__ = true;
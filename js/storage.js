@@ -20,6 +20,7 @@ function clearAgentLocalData(modelName) {
         localStorage.removeItem(`chat_${keyName}`);
         localStorage.removeItem(`agent_config_${keyName}`);
     }
+    if (CHAT_STORE_API) deleteServerChatHistory(modelName);
     // 兼容历史上可能保存的 lastAgent / recentAgents 指向已删除模型
     try {
         const last = JSON.parse(localStorage.getItem('lastAgent') || 'null');
@@ -38,23 +39,141 @@ function clearAgentLocalData(modelName) {
 }
 
 function saveChatHistory() {
-    if (currentAgent) {
-        localStorage.setItem(`chat_${currentAgent.modelName}`, JSON.stringify(chatHistory));
+    if (!currentAgent) return;
+    if (CHAT_STORE_API) {
+        // 只追加尚未写入的消息，避免每轮都序列化整段历史
+        const start = chatPersistedCount;
+        const pending = chatHistory.slice(start);
+        if (pending.length === 0) return;
+        chatPersistedCount = chatHistory.length;
+        const agentName = currentAgent.modelName;
+        postChatMessages(agentName, pending).catch(e => {
+            console.error('保存聊天记录失败:', e);
+            if (currentAgent && currentAgent.modelName === agentName) {
+                chatPersistedCount = Math.min(chatPersistedCount, start);
+            }
+        });
+        return;
     }
+    localStorage.setItem(`chat_${currentAgent.modelName}`, JSON.stringify(chatHistory));
 }
 
 function loadChatHistory() {
     chatHistory = [];
+    chatPersistedCount = 0;
+    chatOlderCursor = null;
     const container = document.getElementById('chatContainerInner');
     if (container) container.innerHTML = '';
 
-    if (currentAgent) {
+    if (!currentAgent) return;
+    if (CHAT_STORE_API) {
+        loadServerChatHistory(currentAgent.modelName);
+        return;
+    }
+    try {
+        const saved = JSON.parse(localStorage.getItem(`chat_${currentAgent.modelName}`) || '[]');
+        saved.forEach(msg => {
+            addMessage(msg.role, msg.content);
+        });
+        chatHistory = saved;
+    } catch (e) {}
+}
+
+// ==========================================
+// 服务端聊天记录（/panel/chats）
+// ==========================================
+async function postChatMessages(agentName, messages, onlyIfEmpty = false) {
+    const response = await fetch(`${CHAT_STORE_API}/messages`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            agent: agentName,
+            messages: messages.map(m => ({ role: m.role, content: m.content })),
+            only_if_empty: onlyIfEmpty
+        })
+    });
+    if (!response.ok) throw new Error(`HTTP ${response.status}`);
+    return response.json();
+}
+
+async function fetchChatPage(agentName, before) {
+    const params = new URLSearchParams({ agent: agentName, limit: String(CHAT_PAGE_SIZE) });
+    if (before != null) params.set('before', String(before));
+    const response = await fetch(`${CHAT_STORE_API}/messages?${params}`);
+    if (!response.ok) throw new Error(`HTTP ${response.status}`);
+    return response.json();
+}
+
+function deleteServerChatHistory(modelName) {
+    fetch(`${CHAT_STORE_API}?agent=${encodeURIComponent(modelName)}`, { method: 'DELETE' })
+        .catch(e => console.error('清空服务端聊天记录失败:', e));
+}
+
+// 旧版本保存在 localStorage 的记录：首次打开时迁移到服务端（服务端已有记录则不覆盖）
+async function migrateLocalChatHistory(agentName) {
+    for (const keyName of getModelNameAliases(agentName)) {
+        const raw = localStorage.getItem(`chat_${keyName}`);
+        if (!raw) continue;
         try {
-            const saved = JSON.parse(localStorage.getItem(`chat_${currentAgent.modelName}`) || '[]');
-            saved.forEach(msg => {
-                addMessage(msg.role, msg.content);
-            });
-            chatHistory = saved;
-        } catch (e) {}
+            const saved = JSON.parse(raw);
+            if (Array.isArray(saved) && saved.length > 0) {
+                await postChatMessages(agentName, saved, true);
+            }
+        } catch (_) {}
+        localStorage.removeItem(`chat_${keyName}`);
+    }
+}
+
+async function loadServerChatHistory(agentName) {
+    try {
+        await migrateLocalChatHistory(agentName);
+        const page = await fetchChatPage(agentName, null);
+        if (!currentAgent || currentAgent.modelName !== agentName) return; // 期间已切换智能体
+
+        page.messages.forEach(msg => addMessage(msg.role, msg.content, msg.created_at * 1000));
+        chatHistory = page.messages.map(m => ({ role: m.role, content: m.content }));
+        chatPersistedCount = chatHistory.length;
+        chatOlderCursor = page.has_more ? page.next_before : null;
+        renderLoadOlderButton();
+    } catch (e) {
+        console.error('加载聊天记录失败:', e);
+    }
+}
+
+function renderLoadOlderButton() {
+    const container = document.getElementById('chatContainerInner');
+    if (!container) return;
+    const existing = document.getElementById('loadOlderBtn');
+    if (existing) existing.remove();
+    if (chatOlderCursor == null) return;
+
+    const btn = document.createElement('button');
+    btn.id = 'loadOlderBtn';
+    btn.textContent = '加载更早的消息';
+    btn.style.cssText = 'display: block; margin: 0 auto 16px; font-size: 12px; background: var(--bg-card); color: var(--text-secondary);';
+    btn.onclick = loadOlderChatHistory;
+    container.insertBefore(btn, container.firstChild);
+}
+
+async function loadOlderChatHistory() {
+    if (!currentAgent || chatOlderCursor == null) return;
+    const agentName = currentAgent.modelName;
+    try {
+        const page = await fetchChatPage(agentName, chatOlderCursor);
+        if (!currentAgent || currentAgent.modelName !== agentName) return;
+
+        const container = document.getElementById('chatContainerInner');
+        const anchor = document.getElementById('loadOlderBtn');
+        const ref = anchor ? anchor.nextSibling : container.firstChild;
+        page.messages.forEach(msg => {
+            container.insertBefore(createMessageElement(msg.role, msg.content, msg.created_at * 1000), ref);
+        });
+        const older = page.messages.map(m => ({ role: m.role, content: m.content }));
+        chatHistory = older.concat(chatHistory);
+        chatPersistedCount += older.length;
+        chatOlderCursor = page.has_more ? page.next_before : null;
+        renderLoadOlderButton();
+    } catch (e) {
+        showToast('加载更早的消息失败', 'error');
     }
 }
@@ -243,6 +243,7 @@ function selectAgent(agent) {
 
     localStorage.setItem('lastAgent', JSON.stringify(agent));
     updateRecentAgents(agent);
+    hintWarmPool(agent.modelName);
 
     loadChatHistory();
 
@@ -384,14 +385,26 @@ async function editAgent(agent) {
     let inferredSystem = '';
     let inferredParams = {};
     try {
-        const showResp = await fetch(`${API_BASE}/api/show`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ name: agent.modelName })
-        });
-        if (showResp.ok) {
-            const showData = await showResp.json();
-            const parsed = parseModelfile(showData?.modelfile || '');
+        let parsed = null;
+        if (AGENTS_API) {
+            const indexResp = await fetch(AGENTS_API);
+            if (indexResp.ok) {
+                const index = await indexResp.json();
+                const info = (index.agents || []).find(a => a.name === agent.modelName);
+                if (info && !info.error) parsed = { from: info.base_model || info.from, system: info.system, parameters: info.parameters };
+            }
+        } else {
+            const showResp = await fetch(`${API_BASE}/api/show`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ name: agent.modelName })
+            });
+            if (showResp.ok) {
+                const showData = await showResp.json();
+                parsed = parseModelfile(showData?.modelfile || '');
+            }
+        }
+        if (parsed) {
             inferredFrom = parsed.from || '';
             inferredSystem = parsed.system || '';
             inferredParams = parsed.parameters || {};
@@ -621,6 +634,15 @@ function updateRecentAgents(agent) {
     renderRecentAgents();
 }
 
+function hintWarmPool(modelName) {
+    if (!WARM_POOL_API) return;
+    fetch(WARM_POOL_API, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ model: modelName })
+    }).catch(() => {});
+}
+
 function renderRecentAgents() {
     const container = document.getElementById('recentAgents');
     if (!container) return;
@@ -706,6 +728,11 @@ window.pullModel = async function() {
     const progressBar = document.getElementById('pullProgressBar');
     const percentText = document.getElementById('pullProgressPercent');
 
+    if (PULLS_API) {
+        pullModelViaServer(name, progress, progressText, progressBar, percentText);
+        return;
+    }
+
     try {
         const response = await fetch(`${API_BASE}/api/pull`, {
             method: 'POST',
@@ -750,6 +777,48 @@ window.pullModel = async function() {
     }
 };
 
+async function pullModelViaServer(name, progress, progressText, progressBar, percentText) {
+    try {
+        const resp = await fetch(PULLS_API, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ model: name })
+        });
+        const job = await resp.json();
+        if (!resp.ok) throw new Error(job.error || `HTTP ${resp.status}`);
+        if (!job.created) showToast('该模型正在拉取中，已接入进度', 'info');
+
+        const events = new EventSource(`${PULLS_API}/events?model=${encodeURIComponent(job.model)}`);
+        events.onmessage = (e) => {
+            const json = JSON.parse(e.data);
+            if (json.done) {
+                events.close();
+                if (json.status === 'success') {
+                    showToast('拉取完成', 'success');
+                    setTimeout(() => {
+                        if (progress) progress.style.display = 'none';
+                        loadModels();
+                    }, 1000);
+                } else {
+                    showToast('拉取失败: ' + (json.error || '未知错误'), 'error');
+                    if (progress) progress.style.display = 'none';
+                }
+                return;
+            }
+            if (json.total) {
+                const percent = Math.round(((json.completed || 0) / json.total) * 100);
+                if (progressBar) progressBar.style.width = `${percent}%`;
+                if (percentText) percentText.textContent = `${percent}%`;
+            }
+            if (json.status && progressText) progressText.textContent = json.status;
+        };
+        // 连接断开时 EventSource 会自动重连；拉取本身在服务端继续进行
+    } catch (e) {
+        showToast('拉取失败: ' + e.message, 'error');
+        if (progress) progress.style.display = 'none';
+    }
+}
+
 window.updatePullMethod = function() {
     const methodEl = document.querySelector('input[name=\"pullMethod\"]:checked');
     const method = methodEl ? methodEl.value : 'api';
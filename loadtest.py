@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+面板 + Ollama 的端到端压测：N 个并发聊天会话经 server.py 的 /api/chat 代理对话
+- 默认在本机启动 ollama_stub.py 与 server.py（--ollama 指向桩服务），不需要真实 Ollama / GPU
+- 每个会话保留自己的历史，多轮追问；轮与轮之间可设置思考时间
+- 统计每轮的首 token 延迟（TTFT，不含调度排队事件）、总耗时、生成 token 数，
+  输出请求吞吐、token 吞吐与 p50/p90/p99，以及失败数（HTTP 错误、503 排队已满、连接中断）
+- --url 指向已运行的面板时不启动任何进程（例如对接真实 Ollama）
+
+用法:
+    python loadtest.py --sessions 16 --turns 4
+    python loadtest.py --sessions 32 --stub-tokens-per-sec 30 --server-args "--max-concurrent 8"
+    python loadtest.py --url http://127.0.0.1:8080 --model qwen2.5:7b --sessions 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+import urllib.parse
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from bench_server import free_port, percentile, wait_port
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+QUESTIONS = ("介绍一下你自己", "能再详细一点吗？", "举个例子", "总结成三点", "还有别的建议吗？")
+
+
+@dataclass
+class TurnResult:
+    ok: bool
+    error: str = ""
+    ttft: Optional[float] = None
+    latency: float = 0.0
+    tokens: int = 0
+    queue_wait_ms: Optional[float] = None
+    done: bool = False  # 收到了 done=true 的最终记录
+
+
+@dataclass
+class LoadReport:
+    sessions: int
+    elapsed: float
+    turns: List[TurnResult] = field(default_factory=list)
+
+    def summary(self) -> Dict[str, Any]:
+        ok = [t for t in self.turns if t.ok]
+        errors: Dict[str, int] = {}
+        for t in self.turns:
+            if not t.ok:
+                errors[t.error] = errors.get(t.error, 0) + 1
+        ttft = [t.ttft for t in ok if t.ttft is not None]
+        latency = [t.latency for t in ok]
+        waits = [t.queue_wait_ms for t in ok if t.queue_wait_ms is not None]
+        tokens = sum(t.tokens for t in ok)
+        out: Dict[str, Any] = {
+            "sessions": self.sessions,
+            "requests": len(self.turns),
+            "ok": len(ok),
+            "errors": errors,
+            "elapsed_s": round(self.elapsed, 3),
+            "requests_per_sec": round(len(ok) / self.elapsed, 3) if self.elapsed else 0.0,
+            "tokens_per_sec": round(tokens / self.elapsed, 2) if self.elapsed else 0.0,
+        }
+        for name, values in (("ttft_ms", ttft), ("latency_ms", latency)):
+            for q in (50, 90, 99):
+                out[f"{name}_p{q}"] = round(percentile(values, q) * 1000, 1) if values else None
+        out["queue_wait_ms_p90"] = round(percentile(waits, 90), 1) if waits else None
+        return out
+
+
+async def _read_head(reader: asyncio.StreamReader) -> Tuple[int, Dict[str, str]]:
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    headers: Dict[str, str] = {}
+    for line in lines[1:]:
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+    return int(lines[0].split()[1]), headers
+
+
+async def _iter_body(reader: asyncio.StreamReader, headers: Dict[str, str]) -> AsyncIterator[bytes]:
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            data = await reader.readexactly(size + 2)
+            if size == 0:
+                return
+            yield data[:-2]
+    elif "content-length" in headers:
+        yield await reader.readexactly(int(headers["content-length"]))
+    else:
+        yield await reader.read()
+
+
+class ChatSession:
+    """一个会话 = 一条 keep-alive 连接 + 自己的对话历史"""
+
+    def __init__(self, host: str, port: int, model: str, timeout: float, user: str):
+        self.host = host
+        self.port = port
+        self.model = model
+        self.timeout = timeout
+        self.user = user
+        self.messages: List[Dict[str, str]] = []
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def turn(self, question: str, num_predict: Optional[int]) -> TurnResult:
+        self.messages.append({"role": "user", "content": question})
+        payload: Dict[str, Any] = {"model": self.model, "messages": self.messages, "stream": True}
+        if num_predict:
+            payload["options"] = {"num_predict": num_predict}
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        t0 = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(self._send(body, t0), self.timeout)
+        except asyncio.TimeoutError:
+            self.close()
+            result = TurnResult(ok=False, error="timeout")
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            self.close()
+            result = TurnResult(ok=False, error=type(e).__name__)
+        result.latency = time.perf_counter() - t0
+        if not result.ok:
+            self.messages.pop()  # 失败的提问不计入历史，下一轮重新问
+        return result
+
+    async def _send(self, body: bytes, t0: float) -> TurnResult:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        assert self.reader is not None
+        self.writer.write(
+            b"POST /api/chat HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\n"
+            b"X-Panel-User: %s\r\nContent-Length: %d\r\n\r\n%s"
+            % (self.host.encode(), self.user.encode(), len(body), body)
+        )
+        status, headers = await _read_head(self.reader)
+        keep = headers.get("connection", "").lower() != "close"
+        result = TurnResult(ok=status == 200, error="" if status == 200 else f"HTTP {status}")
+        reply: List[str] = []
+        tail = b""
+        async for chunk in _iter_body(self.reader, headers):
+            lines = (tail + chunk).split(b"\n")
+            tail = lines.pop()
+            for line in lines:
+                self._handle_line(line, result, reply, t0)
+        self._handle_line(tail, result, reply, t0)
+        if not keep:
+            self.close()
+        if result.ok and not result.done:
+            result.ok, result.error = False, "truncated"
+        if result.ok:
+            self.messages.append({"role": "assistant", "content": "".join(reply)})
+        return result
+
+    @staticmethod
+    def _handle_line(line: bytes, result: TurnResult, reply: List[str], t0: float) -> None:
+        if not line.strip() or not result.ok:
+            return
+        record = json.loads(line)
+        if "panel_queue" in record:
+            if "wait_ms" in record["panel_queue"]:
+                result.queue_wait_ms = record["panel_queue"]["wait_ms"]
+            return
+        if record.get("error"):
+            result.ok = False
+            result.error = "stream error"
+            return
+        if result.ttft is None:
+            result.ttft = time.perf_counter() - t0
+        content = (record.get("message") or {}).get("content") or ""
+        if content:
+            reply.append(content)
+        if record.get("done"):
+            result.done = True
+            result.tokens = record.get("eval_count") or len(reply)
+
+
+async def run_load(
+    url: str,
+    model: str,
+    sessions: int,
+    turns: int,
+    think_time: float = 0.0,
+    num_predict: Optional[int] = None,
+    timeout: float = 120.0,
+    ramp: float = 0.0,
+) -> LoadReport:
+    parsed = urllib.parse.urlsplit(url)
+    host, port = parsed.hostname or "127.0.0.1", parsed.port or 80
+    report = LoadReport(sessions=sessions, elapsed=0.0)
+
+    async def one(i: int) -> None:
+        if ramp > 0:
+            await asyncio.sleep(ramp * i / max(1, sessions))
+        session = ChatSession(host, port, model, timeout, user=f"loadtest-{i}")
+        try:
+            for n in range(turns):
+                report.turns.append(await session.turn(QUESTIONS[n % len(QUESTIONS)], num_predict))
+                if think_time > 0 and n + 1 < turns:
+                    await asyncio.sleep(think_time)
+        finally:
+            session.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(sessions)))
+    report.elapsed = time.perf_counter() - t0
+    return report
+
+
+def _start(cmd: List[str], port: int) -> subprocess.Popen:
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_port(port)
+    except RuntimeError:
+        proc.terminate()
+        raise
+    return proc
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="面板 /api/chat 并发会话压测（默认使用离线 Ollama 桩）")
+    ap.add_argument("--sessions", type=int, default=8, help="并发会话数")
+    ap.add_argument("--turns", type=int, default=3, help="每个会话的对话轮数")
+    ap.add_argument("--think-time", type=float, default=0.0, help="两轮之间的停顿（秒）")
+    ap.add_argument("--ramp", type=float, default=0.0, help="在这段时间内逐个启动会话（秒）")
+    ap.add_argument("--model", type=str, default="qwen2.5:0.5b")
+    ap.add_argument("--num-predict", type=int, default=None, help="每轮回复的最大 token 数")
+    ap.add_argument("--timeout", type=float, default=120.0, help="单轮超时（秒）")
+    ap.add_argument("--url", type=str, default=None, help="已运行的面板地址；不填则自动启动桩服务和 server.py")
+    ap.add_argument("--server-args", type=str, default="", help="传给 server.py 的额外参数")
+    ap.add_argument("--stub-load-delay", type=float, default=1.0)
+    ap.add_argument("--stub-ttft", type=float, default=0.1)
+    ap.add_argument("--stub-tokens-per-sec", type=float, default=50.0)
+    ap.add_argument("--stub-parallel", type=int, default=1)
+    ap.add_argument("--stub-error-rate", type=float, default=0.0)
+    ap.add_argument("--stub-drop-rate", type=float, default=0.0)
+    ap.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = ap.parse_args()
+
+    procs: List[subprocess.Popen] = []
+    url = args.url
+    try:
+        if url is None:
+            stub_port, panel_port = free_port(), free_port()
+            procs.append(_start([
+                sys.executable, os.path.join(ROOT, "ollama_stub.py"), "--port", str(stub_port),
+                "--load-delay", str(args.stub_load_delay), "--ttft", str(args.stub_ttft),
+                "--tokens-per-sec", str(args.stub_tokens_per_sec), "--parallel", str(args.stub_parallel),
+                "--error-rate", str(args.stub_error_rate), "--drop-rate", str(args.stub_drop_rate), "--seed", "0",
+            ], stub_port))
+            procs.append(_start([
+                sys.executable, os.path.join(ROOT, "server.py"), "--host", "127.0.0.1", "--port", str(panel_port),
+                "--quiet", "--ollama", f"http://127.0.0.1:{stub_port}", "--no-chat-store",
+            ] + shlex.split(args.server_args), panel_port))
+            url = f"http://127.0.0.1:{panel_port}"
+        if not args.json:
+            print(f"⏳ {args.sessions} 个会话 × {args.turns} 轮 -> {url}（模型 {args.model}）...")
+        report = asyncio.run(run_load(url, args.model, args.sessions, args.turns, think_time=args.think_time,
+                                      num_predict=args.num_predict, timeout=args.timeout, ramp=args.ramp))
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+
+    summary = report.summary()
+    if args.json:
+        print(json.dumps(summary, indent=2, ensure_ascii=False))
+        return
+    print(f"\n请求 {summary['requests']}（成功 {summary['ok']}），耗时 {summary['elapsed_s']}s")
+    print(f"吞吐: {summary['requests_per_sec']} req/s, {summary['tokens_per_sec']} tokens/s")
+    print(f"{'':<12}{'p50':>10}{'p90':>10}{'p99':>10}")
+    for name in ("ttft_ms", "latency_ms"):
+        row = [summary[f"{name}_p{q}"] for q in (50, 90, 99)]
+        print(f"{name:<12}" + "".join(f"{'-' if v is None else v:>10}" for v in row))
+    if summary["queue_wait_ms_p90"] is not None:
+        print(f"调度排队等待 p90: {summary['queue_wait_ms_p90']} ms")
+    if summary["errors"]:
+        print("失败: " + ", ".join(f"{k} × {v}" for k, v in summary["errors"].items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Prometheus 文本格式的 /metrics（不依赖 prometheus_client）
+- 生成请求（/api/chat、/api/generate）：首 token 延迟、总耗时、prompt-eval / eval tokens/s 直方图，按模型区分
+  tokens/s 取自 Ollama 最后一条记录里的 prompt_eval_count/prompt_eval_duration、eval_count/eval_duration
+- 按模型 + 状态计数的请求数、当前进行中的流、调度排队等待时间
+- 浏览器中途断开而中止的生成数，以及估算回收的生成时间（剩余 token 数 ÷ 生成速度）
+- 连接池、缓存等组件的 stats() 在抓取时读取，导出为 gauge
+- 多 worker 时每个进程各自统计，抓取到的是处理该次请求的 worker 的数据
+"""
+
+from __future__ import annotations
+
+import json
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from async_server import Request, Response
+
+GENERATION_PATHS = ("/api/chat", "/api/generate")
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _fmt_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float]):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.values: Dict[Labels, Tuple[List[int], List[float]]] = {}  # labels -> (各桶计数, [sum, count])
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        counts, totals = self.values.setdefault(key, ([0] * len(self.buckets), [0.0, 0.0]))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        totals[0] += value
+        totals[1] += 1
+
+    def samples(self) -> List[str]:
+        out = []
+        for key, (counts, totals) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                out.append(f"{self.name}_bucket{_fmt_labels(key, ('le', _fmt_value(bound)))} {cumulative}")
+            out.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_value(totals[0])}")
+            out.append(f"{self.name}_count{_fmt_labels(key)} {_fmt_value(totals[1])}")
+        return out
+
+
+class StreamTracker:
+    """跟踪一次生成请求：首个 chunk 的时间、最后一条 NDJSON 记录"""
+
+    def __init__(self, metrics: "Metrics", model: str, started_at: float):
+        self.metrics = metrics
+        self.model = model
+        self.started_at = started_at
+        self.first_at: Optional[float] = None
+        self._tail = b""
+        self.final: Optional[dict] = None
+        self.done = False
+        metrics.inflight.inc(model=model)
+
+    def feed(self, chunk: bytes) -> None:
+        if self.first_at is None and chunk.strip():
+            self.first_at = time.monotonic()
+        data = self._tail + chunk
+        lines = data.split(b"\n")
+        self._tail = lines.pop()
+        for line in reversed(lines):
+            if line.strip():
+                self._parse(line)
+                break
+
+    def _parse(self, line: bytes) -> None:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return
+        if isinstance(record, dict) and record.get("done") is True:
+            self.final = record
+
+    def finish(self, status: str) -> None:
+        if self.done:
+            return
+        self.done = True
+        m = self.metrics
+        m.inflight.dec(model=self.model)
+        if self._tail.strip():
+            self._parse(self._tail)
+        now = time.monotonic()
+        m.requests.inc(model=self.model, status=status)
+        if status != "200":
+            return
+        m.latency.observe(now - self.started_at, model=self.model)
+        if self.first_at is not None:
+            m.ttft.observe(self.first_at - self.started_at, model=self.model)
+        final = self.final or {}
+        for count_key, duration_key, hist in (
+            ("prompt_eval_count", "prompt_eval_duration", m.prompt_eval_rate),
+            ("eval_count", "eval_duration", m.eval_rate),
+        ):
+            count, duration = final.get(count_key), final.get(duration_key)
+            if isinstance(count, (int, float)) and isinstance(duration, (int, float)) and duration > 0:
+                hist.observe(count / (duration / 1e9), model=self.model)
+        if isinstance(final.get("eval_count"), int):
+            totals = m.eval_counts.setdefault(self.model, [0, 0])
+            totals[0] += final["eval_count"]
+            totals[1] += 1
+
+
+class Metrics:
+    def __init__(self):
+        self.requests = Counter("panel_generation_requests_total", "生成请求数（按模型与 HTTP 状态）")
+        self.inflight = Gauge("panel_generation_inflight", "正在转发中的生成流")
+        self.ttft = Histogram("panel_time_to_first_token_seconds", "收到请求到首个上游 chunk 的时间", LATENCY_BUCKETS)
+        self.latency = Histogram("panel_generation_duration_seconds", "生成请求总耗时", LATENCY_BUCKETS)
+        self.prompt_eval_rate = Histogram("panel_prompt_eval_tokens_per_second", "prompt 处理速度（Ollama 最终记录）", RATE_BUCKETS)
+        self.eval_rate = Histogram("panel_eval_tokens_per_second", "生成速度（Ollama 最终记录）", RATE_BUCKETS)
+        self.queue_wait = Histogram("panel_queue_wait_seconds", "调度排队等待时间", LATENCY_BUCKETS)
+        self.trimmed_tokens = Counter("panel_context_trimmed_tokens_total", "历史裁剪丢弃的 token 数（估算）")
+        self.aborted = Counter("panel_generation_aborted_total", "浏览器断开后中止的生成请求")
+        self.reclaimed = Counter("panel_generation_reclaimed_seconds_total", "中止生成回收的生成时间（估算）")
+        self.eval_counts: Dict[str, List[int]] = {}  # 模型 -> [eval_count 之和, 请求数]
+        self._families = [
+            self.requests,
+            self.inflight,
+            self.ttft,
+            self.latency,
+            self.prompt_eval_rate,
+            self.eval_rate,
+            self.queue_wait,
+            self.trimmed_tokens,
+            self.aborted,
+            self.reclaimed,
+        ]
+        self._stats: List[Tuple[str, Callable[[], Dict[str, object]]]] = []
+
+    def add_stats(self, prefix: str, fn: Callable[[], Dict[str, object]]) -> None:
+        """抓取时调用 fn()，其中的数值字段导出为 panel_<prefix>_<字段> gauge"""
+        self._stats.append((prefix, fn))
+
+    def track(self, req: Request) -> Optional[StreamTracker]:
+        if req.method != "POST" or req.path not in GENERATION_PATHS:
+            return None
+        try:
+            payload = req.json() or {}
+        except ValueError:
+            payload = {}
+        model = payload.get("model") if isinstance(payload, dict) else None
+        return StreamTracker(self, str(model or "unknown"), req.received_at)
+
+    def record_abort(self, model: str, generated: int, token_rate: Optional[float], num_predict: Optional[int]) -> float:
+        """记录一次中止的生成，返回估算回收的秒数
+
+        预计总长度取 num_predict（未设置时取该模型已完成请求的平均 eval_count），
+        生成速度优先用本次流实测的速度，还没有输出时用该模型的历史平均速度。
+        """
+        self.aborted.inc(model=model)
+        expected: Optional[float] = None
+        if num_predict is not None and num_predict > 0:
+            expected = float(num_predict)
+        elif model in self.eval_counts and self.eval_counts[model][1]:
+            total, n = self.eval_counts[model]
+            expected = total / n
+        rate = token_rate
+        if not rate:
+            _, totals = self.eval_rate.values.get((("model", model),), (None, [0.0, 0.0]))
+            rate = totals[0] / totals[1] if totals[1] else None
+        if expected is None or not rate or expected <= generated:
+            return 0.0
+        seconds = (expected - generated) / rate
+        self.reclaimed.inc(seconds, model=model)
+        return seconds
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for fam in self._families:
+            lines.append(f"# HELP {fam.name} {fam.help}")
+            lines.append(f"# TYPE {fam.name} {fam.kind}")
+            lines.extend(fam.samples())
+        for prefix, fn in self._stats:
+            for key, value in fn().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"panel_{prefix}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_fmt_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    async def handle(self, req: Request, resp: Response) -> None:
+        await resp.send(200, self.render().encode("utf-8"), content_type="text/plain; version=0.0.4; charset=utf-8")
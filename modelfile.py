@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Modelfile 解析（与 js/utils.js 的 parseModelfile 对应，服务端使用）
+- FROM / SYSTEM / TEMPLATE / ADAPTER / LICENSE / MESSAGE / PARAMETER，指令不区分大小写，# 开头为注释
+- 值可以是三引号包裹的多行文本、"带引号" 的字符串或到行尾的裸文本
+- PARAMETER 的值按数字解析（失败则保留字符串）；stop 等重复出现的参数合并为列表
+"""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+INSTRUCTIONS = ("FROM", "SYSTEM", "TEMPLATE", "ADAPTER", "LICENSE", "MESSAGE", "PARAMETER")
+
+
+@dataclass
+class Modelfile:
+    from_: str = ""
+    system: str = ""
+    template: str = ""
+    adapters: List[str] = field(default_factory=list)
+    license: List[str] = field(default_factory=list)
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    parameters: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "from": self.from_,
+            "system": self.system,
+            "template": self.template,
+            "adapters": self.adapters,
+            "license": self.license,
+            "messages": self.messages,
+            "parameters": self.parameters,
+        }
+
+
+def _number(raw: str) -> Any:
+    try:
+        return int(raw)
+    except ValueError:
+        pass
+    try:
+        value = float(raw)
+    except ValueError:
+        return raw
+    return value if value == value and value not in (float("inf"), float("-inf")) else raw
+
+
+def _read_value(text: str, pos: int) -> Tuple[str, int]:
+    """从 pos 读取一个值，返回 (值, 值结束后的位置)"""
+    while pos < len(text) and text[pos] in " \t":
+        pos += 1
+    if text.startswith('"""', pos):
+        end = text.find('"""', pos + 3)
+        if end < 0:
+            return text[pos + 3:], len(text)
+        return text[pos + 3:end], end + 3
+    if text.startswith('"', pos):
+        i = pos + 1
+        while i < len(text) and text[i] != "\n":
+            if text[i] == "\\":
+                i += 2
+                continue
+            if text[i] == '"':
+                try:
+                    return json.loads(text[pos:i + 1]), i + 1
+                except ValueError:
+                    return text[pos + 1:i], i + 1
+            i += 1
+        # 引号没闭合：按裸文本处理
+    end = text.find("\n", pos)
+    end = len(text) if end < 0 else end
+    return text[pos:end].strip(), end
+
+
+def _read_word(text: str, pos: int) -> Tuple[str, int]:
+    while pos < len(text) and text[pos] in " \t":
+        pos += 1
+    start = pos
+    while pos < len(text) and not text[pos].isspace():
+        pos += 1
+    return text[start:pos], pos
+
+
+def parse_modelfile(text: Optional[str]) -> Modelfile:
+    mf = Modelfile()
+    if not isinstance(text, str):
+        return mf
+    text = text.replace("\r\n", "\n")
+    pos = 0
+    while pos < len(text):
+        line_end = text.find("\n", pos)
+        line_end = len(text) if line_end < 0 else line_end
+        stripped = text[pos:line_end].strip()
+        if not stripped or stripped.startswith("#"):
+            pos = line_end + 1
+            continue
+        word, after = _read_word(text, pos)
+        instruction = word.upper()
+        if instruction not in INSTRUCTIONS:
+            pos = line_end + 1
+            continue
+
+        if instruction == "PARAMETER":
+            name, after = _read_word(text, after)
+            quoted = text[after:line_end].lstrip(" \t").startswith('"')
+            value, pos = _read_value(text, after)
+            if name:
+                value = value if quoted else _number(value)
+                if name in mf.parameters:
+                    prev = mf.parameters[name]
+                    mf.parameters[name] = (prev if isinstance(prev, list) else [prev]) + [value]
+                else:
+                    mf.parameters[name] = value
+        elif instruction == "MESSAGE":
+            role, after = _read_word(text, after)
+            content, pos = _read_value(text, after)
+            mf.messages.append({"role": role.lower(), "content": content})
+        else:
+            value, pos = _read_value(text, after)
+            if instruction == "FROM":
+                mf.from_ = value
+            elif instruction == "SYSTEM":
+                mf.system = value.strip()  # 与前端一致：去掉三引号内首尾的换行
+            elif instruction == "TEMPLATE":
+                mf.template = value
+            elif instruction == "ADAPTER":
+                mf.adapters.append(value)
+            else:
+                mf.license.append(value)
+        # 跳过值之后的剩余部分直到行尾
+        nl = text.find("\n", pos)
+        pos = len(text) if nl < 0 else nl + 1
+    return mf
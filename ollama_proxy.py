@@ -0,0 +1,779 @@
+#!/usr/bin/env python3
+"""
+Ollama 反向代理（/api/*）
+- UpstreamPool：到 Ollama 的 HTTP/1.1 持久连接池，/api/chat 不再每条消息都重新建 TCP 连接
+  （多个 Ollama 节点时由 upstream_router.UpstreamRouter 代替，接口相同）
+- OllamaProxy：把浏览器请求转发给上游，NDJSON 流按 chunk 逐块透传，不做缓冲
+- 生成类请求（/api/chat、/api/generate 等）先经 Scheduler 准入，排队时首个事件为 {"panel_queue": ...}
+- 可复现的生成请求（temperature 0 / 固定 seed）可由 ResponseCache 直接从磁盘回放
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+import urllib.parse
+from dataclasses import dataclass, field, replace
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from api_cache import ApiCache, etag_matches
+from async_server import Request, Response
+from chat_store import normalize_agent
+from context_budget import ContextBudget, rewrite_messages
+from metrics import Metrics
+from response_cache import ResponseCache, final_record_ok, is_deterministic, make_key, parse_parameters
+from scheduler import SCHEDULED_PATHS, QueueFull, Scheduler, user_key
+from singleflight import SingleFlight
+
+DEFAULT_OLLAMA = "http://127.0.0.1:11434"
+
+# 转发给上游 / 回传给浏览器的请求头白名单（其余如 Cookie、Origin 不外传）
+FORWARD_REQUEST_HEADERS = ("content-type", "accept", "authorization")
+FORWARD_RESPONSE_HEADERS = ("content-type", "x-panel-upstream")
+
+
+class UpstreamError(Exception):
+    """连接上游失败或上游返回了无法解析的响应"""
+
+
+class _Conn:
+    __slots__ = ("reader", "writer", "created_at", "last_used", "requests")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.requests = 0
+
+    def close(self) -> None:
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+    @property
+    def usable(self) -> bool:
+        return not self.reader.at_eof() and not self.writer.is_closing()
+
+
+class UpstreamResponse:
+    """上游响应。body 通过 iter_chunks() 按上游 chunk 逐块读取，读完后必须 release()"""
+
+    def __init__(self, pool: "UpstreamPool", conn: _Conn, status: int, headers: Dict[str, str], method: str):
+        self.pool = pool
+        self.conn: Optional[_Conn] = conn
+        self.status = status
+        self.headers = headers
+        self.method = method
+        self._complete = False
+        self._reusable = "close" not in headers.get("connection", "").lower()
+
+    @property
+    def chunked(self) -> bool:
+        return "chunked" in self.headers.get("transfer-encoding", "").lower()
+
+    @property
+    def has_body(self) -> bool:
+        return self.method != "HEAD" and self.status not in (204, 304) and not 100 <= self.status < 200
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        assert self.conn is not None
+        reader = self.conn.reader
+        if not self.has_body:
+            self._complete = True
+            return
+        if self.chunked:
+            while True:
+                size_line = await reader.readuntil(b"\r\n")
+                size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+                if size == 0:
+                    while (await reader.readuntil(b"\r\n")) != b"\r\n":
+                        pass
+                    break
+                data = await reader.readexactly(size)
+                await reader.readexactly(2)
+                yield data
+        elif "content-length" in self.headers:
+            remaining = int(self.headers["content-length"])
+            while remaining > 0:
+                data = await reader.read(min(remaining, 64 * 1024))
+                if not data:
+                    raise UpstreamError("上游提前关闭连接")
+                remaining -= len(data)
+                yield data
+        else:
+            self._reusable = False
+            while True:
+                data = await reader.read(64 * 1024)
+                if not data:
+                    break
+                yield data
+        self._complete = True
+
+    async def read(self) -> bytes:
+        return b"".join([c async for c in self.iter_chunks()])
+
+    def release(self) -> None:
+        """读完且上游允许 keep-alive 时归还连接，否则直接关闭（例如客户端中途断开）"""
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        self.pool._release(conn, reuse=self._complete and self._reusable)
+
+
+class UpstreamPool:
+    def __init__(
+        self,
+        base_url: str = DEFAULT_OLLAMA,
+        max_connections: int = 32,
+        max_idle: int = 8,
+        idle_timeout: float = 30.0,
+        connect_timeout: float = 5.0,
+    ):
+        u = urllib.parse.urlsplit(base_url if "://" in base_url else f"http://{base_url}")
+        if u.scheme != "http":
+            raise ValueError(f"仅支持 http 上游: {base_url}")
+        self.base_url = f"http://{u.hostname}:{u.port or 11434}"
+        self.host = u.hostname or "127.0.0.1"
+        self.port = u.port or 11434
+        self.max_connections = max_connections
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._idle: List[_Conn] = []
+        self._sem: Optional[asyncio.Semaphore] = None  # 延迟到事件循环内创建
+        self.in_use = 0
+        self.opened = 0
+        self.reused = 0
+        self.requests = 0
+        self.failures = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_connections)
+        return self._sem
+
+    def _take_idle(self) -> Optional[_Conn]:
+        now = time.monotonic()
+        while self._idle:
+            conn = self._idle.pop()  # LIFO：优先复用最热的连接
+            if conn.usable and now - conn.last_used < self.idle_timeout:
+                return conn
+            conn.close()
+        return None
+
+    async def _open(self) -> _Conn:
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.connect_timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            self.failures += 1
+            raise UpstreamError(f"无法连接到 Ollama {self.base_url}: {type(e).__name__}: {e}") from e
+        self.opened += 1
+        return _Conn(reader, writer)
+
+    def _release(self, conn: _Conn, reuse: bool) -> None:
+        self.in_use -= 1
+        self._semaphore().release()
+        conn.last_used = time.monotonic()
+        if reuse and conn.usable and len(self._idle) < self.max_idle:
+            self._idle.append(conn)
+        else:
+            conn.close()
+
+    async def request(
+        self,
+        method: str,
+        target: str,
+        body: bytes = b"",
+        headers: Optional[Dict[str, str]] = None,
+    ) -> UpstreamResponse:
+        await self._semaphore().acquire()
+        self.in_use += 1
+        self.requests += 1
+        try:
+            for attempt in range(2):
+                conn = self._take_idle()
+                reused = conn is not None
+                if conn is None:
+                    conn = await self._open()
+                try:
+                    status, resp_headers = await self._roundtrip(conn, method, target, body, headers or {})
+                except asyncio.CancelledError:
+                    conn.close()  # 等待响应头时被取消（浏览器断开）：关掉连接，Ollama 随之停止
+                    raise
+                except (OSError, asyncio.IncompleteReadError, UpstreamError) as e:
+                    conn.close()
+                    # 复用的空闲连接可能已被上游关闭：换一条新连接重试一次
+                    if reused and attempt == 0:
+                        continue
+                    self.failures += 1
+                    raise UpstreamError(f"上游请求失败: {type(e).__name__}: {e}") from e
+                if reused:
+                    self.reused += 1
+                conn.requests += 1
+                return UpstreamResponse(self, conn, status, resp_headers, method)
+            raise UpstreamError("上游请求失败")
+        except BaseException:
+            self.in_use -= 1
+            self._semaphore().release()
+            raise
+
+    async def _roundtrip(
+        self, conn: _Conn, method: str, target: str, body: bytes, headers: Dict[str, str]
+    ) -> Tuple[int, Dict[str, str]]:
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {self.host}:{self.port}", "Connection: keep-alive"]
+        lines.extend(f"{k}: {v}" for k, v in headers.items())
+        if body or method in ("POST", "PUT", "DELETE"):
+            lines.append(f"Content-Length: {len(body)}")
+        conn.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await conn.writer.drain()
+
+        head = await conn.reader.readuntil(b"\r\n\r\n")
+        text = head.decode("latin-1").split("\r\n")
+        parts = text[0].split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise UpstreamError(f"无效的上游响应: {text[0][:100]!r}")
+        resp_headers: Dict[str, str] = {}
+        for line in text[1:]:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                resp_headers[k.strip().lower()] = v.strip()
+        if parts[0] == "HTTP/1.0" and "keep-alive" not in resp_headers.get("connection", "").lower():
+            resp_headers["connection"] = "close"
+        return int(parts[1]), resp_headers
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_use": self.in_use,
+            "idle": len(self._idle),
+            "opened": self.opened,
+            "reused": self.reused,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+    async def close(self) -> None:
+        while self._idle:
+            self._idle.pop().close()
+
+
+@dataclass
+class Capture:
+    """_forward 转发时顺带记录下的上游响应（供 ResponseCache 落盘）"""
+
+    status: int = 0
+    content_type: Optional[str] = None
+    parts: List[bytes] = field(default_factory=list)
+
+    @property
+    def body(self) -> bytes:
+        return b"".join(self.parts)
+
+    def final_record(self) -> Optional[Dict[str, Any]]:
+        """最后一条 NDJSON 记录（Ollama 在其中给出 prompt_eval_count 等统计）"""
+        lines = self.body.rstrip().rsplit(b"\n", 1)
+        try:
+            record = json.loads(lines[-1]) if lines[-1] else None
+        except ValueError:
+            return None
+        return record if isinstance(record, dict) else None
+
+
+@dataclass
+class BufferedResponse:
+    """整体读完的上游响应（可在合并的请求之间共享）"""
+
+    status: int
+    body: bytes
+    content_type: Optional[str]
+    generation: int = 0  # 发起上游请求时的缓存代数
+
+
+class OllamaProxy:
+    """挂在 /api/ 前缀上的透明代理"""
+
+    def __init__(
+        self,
+        pool: UpstreamPool,
+        cache: Optional[ApiCache] = None,
+        singleflight: Optional[SingleFlight] = None,
+        scheduler: Optional[Scheduler] = None,
+        response_cache: Optional[ResponseCache] = None,
+        metrics: Optional[Metrics] = None,
+        context: Optional[ContextBudget] = None,
+        warm=None,
+        sessions=None,
+    ):
+        self.pool = pool
+        self.cache = cache
+        self.singleflight = singleflight
+        self.scheduler = scheduler
+        self.response_cache = response_cache
+        self.metrics = metrics
+        self.context = context
+        self.warm = warm  # WarmPool，需要反向引用 proxy，由 server.py 创建后赋值
+        self.compactor = None  # Compactor，同样需要反向引用 proxy
+        self.sessions = sessions  # SessionContexts（--session-context）
+
+    async def handle(self, req: Request, resp: Response) -> None:
+        cache_key = self.cache.key(req) if self.cache else None
+        if cache_key is not None:
+            await self._handle_cached(req, resp, cache_key)
+            return
+        if self.singleflight is not None and self.singleflight.key(req) is not None:
+            await self._handle_buffered(req, resp)
+            return
+        if req.method == "POST" and req.path in SCHEDULED_PATHS:
+            await self._handle_generation(req, resp)
+            return
+
+        invalidating = self.cache is not None and self.cache.is_invalidating(req)
+        if invalidating:
+            self.cache.invalidate()
+        try:
+            await self._forward(req, resp)
+        finally:
+            if invalidating:
+                # 模型列表在请求完成（pull 流结束）后才真正变化，完成时再失效一次
+                self.cache.invalidate()
+
+    @staticmethod
+    def _request_headers(req: Request) -> Dict[str, str]:
+        return {k: req.headers[k] for k in FORWARD_REQUEST_HEADERS if k in req.headers}
+
+    async def _fetch_buffered(self, req: Request) -> BufferedResponse:
+        generation = self.cache.generation if self.cache else 0
+        up = await self.pool.request(req.method, req.target, req.body, self._request_headers(req))
+        try:
+            body = await up.read()
+        except (OSError, asyncio.IncompleteReadError) as e:
+            raise UpstreamError(f"读取上游响应失败: {type(e).__name__}: {e}") from e
+        finally:
+            up.release()
+        return BufferedResponse(up.status, body, up.headers.get("content-type"), generation)
+
+    async def fetch_shared(self, req: Request) -> Tuple[BufferedResponse, bool]:
+        """幂等请求走 single-flight：同时到达的相同请求共享一次上游调用"""
+        key = self.singleflight.key(req) if self.singleflight else None
+        if key is None:
+            return await self._fetch_buffered(req), False
+        return await self.singleflight.do(key, lambda: self._fetch_buffered(req))
+
+    async def _handle_buffered(self, req: Request, resp: Response) -> None:
+        try:
+            shared, coalesced = await self.fetch_shared(req)
+        except UpstreamError as e:
+            await resp.send_error(502, str(e))
+            return
+        headers = {"X-Panel-Coalesced": "1"} if coalesced else None
+        await resp.send(shared.status, shared.body, content_type=shared.content_type, headers=headers)
+
+    async def _handle_cached(self, req: Request, resp: Response, key: str) -> None:
+        assert self.cache is not None
+        entry = self.cache.get(key)
+        if entry is None:
+            try:
+                shared, _ = await self.fetch_shared(req)
+            except UpstreamError as e:
+                await resp.send_error(502, str(e))
+                return
+            entry = self.cache.put(key, shared.generation, shared.status, shared.body, shared.content_type)
+            cache_state = "MISS"
+        else:
+            cache_state = "HIT"
+
+        validators = {"ETag": entry.etag, "Cache-Control": "no-cache", "X-Panel-Cache": cache_state}
+        if entry.status == 200 and etag_matches(req.headers.get("if-none-match"), entry.etag):
+            self.cache.not_modified += 1
+            await resp.send(304, content_type=None, headers=validators)
+            return
+        if entry.status != 200:
+            validators = {"X-Panel-Cache": cache_state}
+        await resp.send(entry.status, entry.body, content_type=entry.content_type, headers=validators)
+
+    async def fetch_json(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Optional[Any]:
+        """代理自己查询上游（/api/tags、/api/show），同样经过 ApiCache 与 single-flight；失败返回 None"""
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        headers = {"content-type": "application/json"} if body else {}
+        req = Request(method, path, "HTTP/1.1", headers, body)
+        key = self.cache.key(req) if self.cache else None
+        entry = self.cache.get(key) if key is not None else None
+        if entry is not None:
+            status, data = entry.status, entry.body
+        else:
+            try:
+                shared, _ = await self.fetch_shared(req)
+            except UpstreamError:
+                return None
+            if key is not None:
+                self.cache.put(key, shared.generation, shared.status, shared.body, shared.content_type)
+            status, data = shared.status, shared.body
+        if status != 200:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    async def _response_cache_key(self, path: str, payload: Dict[str, Any]) -> Optional[str]:
+        """可复现的请求返回缓存 key，否则返回 None"""
+        model = payload.get("model")
+        if not isinstance(model, str) or not model:
+            return None
+        show = await self.fetch_json("POST", "/api/show", {"name": model})
+        if not isinstance(show, dict):
+            return None
+        parameters = show.get("parameters") or ""
+        options = dict(parse_parameters(parameters))
+        if isinstance(payload.get("options"), dict):
+            options.update(payload["options"])
+        if not is_deterministic(options):
+            return None
+        tags = await self.fetch_json("GET", "/api/tags")
+        wanted = normalize_agent(model)
+        digest = next(
+            (m.get("digest") for m in (tags or {}).get("models", []) if normalize_agent(m.get("name", "")) == wanted),
+            None,
+        )
+        if not digest:
+            return None
+        return make_key(path, digest, show.get("template") or "", parameters, payload)
+
+    async def _handle_generation(self, req: Request, resp: Response) -> None:
+        """生成类请求：摘要压缩 -> 历史裁剪 -> 确定性结果缓存 -> 调度排队 -> 转发"""
+        try:
+            payload = req.json()
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            await self._generate(req, resp)
+            return
+
+        headers: Dict[str, str] = {}
+        trim = None
+        chat = req.path == "/api/chat" and isinstance(payload.get("model"), str)
+        turn = None
+        if chat and self.sessions is not None:
+            turn = self.sessions.plan(req, payload)
+            if turn is not None:
+                headers.update(turn.headers())
+                if turn.generate_body is not None:
+                    await self._handle_session_turn(req, resp, payload, turn, headers)
+                    return
+        reseed = turn is not None and turn.reseedable
+        show = None
+        if chat and (self.context is not None or self.compactor is not None or reseed):
+            show = await self.fetch_json("POST", "/api/show", {"name": payload["model"]})
+            show = show if isinstance(show, dict) else None
+        if chat and self.compactor is not None:
+            compaction = await self.compactor.apply(payload, show)
+            if compaction is not None:
+                headers.update(compaction.headers())
+                req = replace(req, body=rewrite_messages(payload, compaction.messages))
+                payload = dict(payload, messages=compaction.messages)
+        if chat and self.context is not None:
+            trim = self.context.trim(payload, show)
+            if trim is not None:
+                headers.update(trim.headers())
+                if trim.dropped_messages:
+                    req = replace(req, body=rewrite_messages(payload, trim.messages))
+                    payload = dict(payload, messages=trim.messages)
+                    if self.metrics is not None:
+                        self.metrics.trimmed_tokens.inc(trim.dropped_tokens, model=trim.model)
+        if reseed and self.sessions.reseed(turn, payload, show):
+            # 会话状态失效：用渲染好的完整历史走 /api/generate，拿回 context 供下一轮复用
+            headers.update(turn.headers())
+            final = await self._handle_session_turn(req, resp, payload, turn, headers)
+            if trim is not None:
+                self.context.calibrate(trim, final)
+            return
+
+        capture = Capture()
+        if self.response_cache is not None and self.response_cache.applies(req):
+            await self._handle_deterministic(req, resp, payload, capture, headers)
+        else:
+            await self._generate(req, resp, capture, headers)
+        final = capture.final_record() if capture.status == 200 else None
+        if trim is not None:
+            self.context.calibrate(trim, final)
+        if self.warm is not None and isinstance(payload.get("model"), str):
+            self.warm.record(payload["model"], final)
+
+    async def _handle_session_turn(
+        self, req: Request, resp: Response, payload: Dict[str, Any], turn: Any, headers: Dict[str, str]
+    ) -> Optional[Dict[str, Any]]:
+        """会话模式：改走 /api/generate（带上次的 context），响应转换回 /api/chat 格式；返回最终记录"""
+        assert self.sessions is not None
+        capture = Capture()
+        generate = replace(req, target="/api/generate", body=turn.generate_body)
+        try:
+            await self._generate(generate, resp, capture, headers, transform=turn.converter)
+        finally:
+            final = capture.final_record() if capture.status == 200 else None
+            self.sessions.complete(turn, final)
+        if self.warm is not None:
+            self.warm.record(payload["model"], final)
+        return final
+
+    async def _handle_deterministic(
+        self, req: Request, resp: Response, payload: Dict[str, Any], capture: Capture, headers: Dict[str, str]
+    ) -> None:
+        assert self.response_cache is not None
+        key = await self._response_cache_key(req.path, payload)
+        if key is None:
+            self.response_cache.skipped += 1
+            await self._generate(req, resp, capture, headers)
+            return
+
+        cached = await self.response_cache.get(key)
+        if cached is not None:
+            headers = dict(headers, **{"X-Panel-Response-Cache": "HIT"})
+            if payload.get("stream", True) is not False:
+                # 整段回放，不模拟逐 token 的节奏
+                await resp.start(cached.status, content_type=cached.content_type, headers=headers)
+                await resp.write(cached.body)
+                await resp.end()
+            else:
+                await resp.send(cached.status, cached.body, content_type=cached.content_type, headers=headers)
+            return
+
+        await self._generate(req, resp, capture, dict(headers, **{"X-Panel-Response-Cache": "MISS"}))
+        body = capture.body
+        if capture.status == 200 and final_record_ok(body):
+            await self.response_cache.put(key, capture.status, capture.content_type, body)
+
+    async def _generate(
+        self,
+        req: Request,
+        resp: Response,
+        capture: Optional[Capture] = None,
+        extra_headers: Optional[Dict[str, str]] = None,
+        transform: Any = None,
+    ) -> None:
+        """transform：可选的响应改写器（feed(chunk) -> bytes、flush() -> bytes），例如 generate -> chat 格式"""
+        if self.scheduler is not None and self.scheduler.applies(req):
+            await self._forward_scheduled(req, resp, capture, extra_headers, transform)
+        else:
+            await self._forward(req, resp, extra_headers, capture, transform)
+
+    async def _forward_scheduled(
+        self,
+        req: Request,
+        resp: Response,
+        capture: Optional[Capture] = None,
+        extra_headers: Optional[Dict[str, str]] = None,
+        transform: Any = None,
+    ) -> None:
+        assert self.scheduler is not None
+        try:
+            payload = req.json() or {}
+        except ValueError:
+            payload = {}
+        model = payload.get("model") if isinstance(payload, dict) else None
+        if not model:
+            await self._forward(req, resp, extra_headers, capture, transform)
+            return
+        streaming = payload.get("stream", True) is not False and req.path in ("/api/chat", "/api/generate")
+
+        try:
+            ticket = self.scheduler.submit(model, user_key(req))
+        except QueueFull as e:
+            if self.metrics is not None:
+                self.metrics.requests.inc(model=model, status="503")
+            await resp.send_json(503, {"error": str(e)}, headers={"Retry-After": str(e.retry_after)})
+            return
+        try:
+            if not ticket.admitted:
+                if streaming:
+                    # 先把排队信息作为第一条 NDJSON 事件发出，前端可以立刻显示“排队中”
+                    await resp.start(200, headers={"X-Accel-Buffering": "no"})
+                    await resp.write(_ndjson({"panel_queue": {"model": model, "position": ticket.position}}))
+                # 排队期间浏览器断开：不再占着队列位置
+                await self._until_disconnect(resp, ticket.wait())
+                if streaming:
+                    await resp.write(_ndjson({"panel_queue": {"model": model, "position": 0, "wait_ms": round(ticket.wait_ms, 1)}}))
+            if self.metrics is not None:
+                self.metrics.queue_wait.observe(ticket.wait_ms / 1000, model=model)
+            headers = dict(extra_headers or {})
+            headers["X-Panel-Queue-Wait-Ms"] = f"{ticket.wait_ms:.0f}"
+            await self._forward(req, resp, headers, capture, transform)
+        finally:
+            self.scheduler.release(ticket)
+
+    async def _forward(
+        self,
+        req: Request,
+        resp: Response,
+        extra_headers: Optional[Dict[str, str]] = None,
+        capture: Optional[Capture] = None,
+        transform: Any = None,
+    ) -> None:
+        tracker = self.metrics.track(req) if self.metrics is not None else None
+        status = "cancelled"  # 浏览器中途断开等异常退出时记为 cancelled
+        progress = _Progress()
+
+        def on_chunk(chunk: bytes) -> None:
+            progress.feed(chunk)
+            if capture is not None:
+                capture.parts.append(chunk)
+            if tracker is not None:
+                tracker.feed(chunk)
+
+        async def relay() -> str:
+            try:
+                up = await self.pool.request(req.method, req.target, req.body, self._request_headers(req))
+            except UpstreamError as e:
+                if resp.started:
+                    await resp.write(_ndjson({"error": str(e)}))
+                    await resp.end()
+                    return "502"
+                await resp.send_error(502, str(e))
+                return "502"
+
+            if capture is not None:
+                capture.status = up.status
+                capture.content_type = up.headers.get("content-type")
+            try:
+                await self._relay(resp, up, extra_headers, on_chunk, transform)
+                return str(up.status)
+            finally:
+                # 被取消时响应体不完整，release() 会直接关闭上游连接，Ollama 随之停止生成
+                up.release()
+
+        try:
+            if req.method == "POST" and req.path in SCHEDULED_PATHS:
+                try:
+                    status = await self._until_disconnect(resp, relay())
+                except ConnectionError:
+                    await self._record_abort(req, progress)
+                    raise
+            else:
+                status = await relay()
+        finally:
+            if tracker is not None:
+                tracker.finish(status)
+
+    async def _until_disconnect(self, resp: Response, coro: Any) -> Any:
+        """运行 coro，同时监视浏览器连接；断开时取消 coro 并抛出 ConnectionResetError
+
+        流式输出时写入失败也能发现断开，但 Ollama 加载模型、处理长 prompt 或排队时
+        长时间没有输出，只能靠监视读端及时发现。
+        """
+        task = asyncio.ensure_future(coro)
+        watcher = asyncio.ensure_future(resp.wait_disconnected())
+        try:
+            await asyncio.wait((task, watcher), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            watcher.cancel()
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        if task.cancelled():
+            resp.keep_alive = False
+            raise ConnectionResetError("浏览器已断开")
+        return task.result()
+
+    async def _record_abort(self, req: Request, progress: "_Progress") -> None:
+        if self.metrics is None:
+            return
+        try:
+            payload = req.json() or {}
+        except ValueError:
+            payload = {}
+        if not isinstance(payload, dict):
+            payload = {}
+        model = str(payload.get("model") or "unknown")
+        options = payload.get("options") if isinstance(payload.get("options"), dict) else {}
+        num_predict = options.get("num_predict")
+        if not isinstance(num_predict, int):
+            show = await self.fetch_json("POST", "/api/show", {"name": model}) if payload.get("model") else None
+            value = parse_parameters((show or {}).get("parameters") or "").get("num_predict")
+            num_predict = int(value) if isinstance(value, str) and value.lstrip("-").isdigit() else None
+        self.metrics.record_abort(model, progress.records, progress.rate(), num_predict)
+
+    async def _relay(
+        self,
+        resp: Response,
+        up: UpstreamResponse,
+        extra_headers: Optional[Dict[str, str]],
+        on_chunk: Callable[[bytes], None],
+        transform: Any = None,
+    ) -> None:
+        def rewrite(chunk: bytes) -> bytes:
+            return transform.feed(chunk) if transform is not None else chunk
+
+        if resp.started:
+            # 已经发过排队事件（200 + NDJSON）：上游出错时按 Ollama 的习惯写一条 {"error": ...}
+            if up.status >= 400:
+                body = await up.read()
+                try:
+                    message = json.loads(body).get("error") or body.decode("utf-8", "replace")
+                except (ValueError, AttributeError):
+                    message = body.decode("utf-8", "replace")
+                await resp.write(_ndjson({"error": message}))
+            else:
+                async for chunk in up.iter_chunks():
+                    on_chunk(chunk)
+                    await resp.write(rewrite(chunk))
+                if transform is not None:
+                    await resp.write(transform.flush())
+            await resp.end()
+            return
+
+        out_headers = {"X-Accel-Buffering": "no"}
+        out_headers.update(extra_headers or {})
+        for k in FORWARD_RESPONSE_HEADERS:
+            if k in up.headers:
+                out_headers[k.title()] = up.headers[k]
+        content_type = out_headers.pop("Content-Type", None)
+
+        if not up.chunked:
+            # 非流式响应（/api/tags、/api/show 等）：整体转发，保留 Content-Length
+            body = await up.read()
+            on_chunk(body)
+            if transform is not None and up.status == 200:
+                body = transform.feed(body) + transform.flush()
+            await resp.send(up.status, body, content_type=content_type, headers=out_headers)
+            return
+
+        # 流式响应：上游每到一个 chunk 就立即写给浏览器
+        await resp.start(up.status, content_type=content_type, headers=out_headers)
+        async for chunk in up.iter_chunks():
+            on_chunk(chunk)
+            await resp.write(rewrite(chunk))
+        if transform is not None:
+            await resp.write(transform.flush())
+        await resp.end()
+
+
+class _Progress:
+    """统计已转发的 NDJSON 记录数（流式生成时约等于已生成的 token 数）及其时间跨度"""
+
+    def __init__(self):
+        self.records = 0
+        self.first_at: Optional[float] = None
+        self.last_at: Optional[float] = None
+
+    def feed(self, chunk: bytes) -> None:
+        n = chunk.count(b"\n")
+        if not n:
+            return
+        now = time.monotonic()
+        if self.first_at is None:
+            self.first_at = now
+        self.last_at = now
+        self.records += n
+
+    def rate(self) -> Optional[float]:
+        """本次流实测的 token/s；记录太少时返回 None"""
+        if self.records < 2 or self.first_at is None or self.last_at is None or self.last_at <= self.first_at:
+            return None
+        return (self.records - 1) / (self.last_at - self.first_at)
+
+
+def _ndjson(obj: dict) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+"""
+离线 Ollama 桩服务：没有 GPU / 没有真实 Ollama 时用于压测和 CI
+- 实现 /api/tags、/api/show、/api/ps、/api/chat、/api/generate、/api/pull、/api/create、/api/delete、/api/version
+- 生成按配置的节奏输出：模型冷加载延迟、首 token 延迟（TTFT）、prompt 处理速度、生成速度（tokens/s）
+- 最终记录带 load_duration / prompt_eval_* / eval_* 字段，与真实 Ollama 一致，便于验证 /metrics 与预热池
+- 故障注入：按概率返回 500、在流式输出中途断开连接，或拉取中途在流里报错；--seed 固定随机序列
+- 每个模型同时处理的请求数受 --parallel 限制（对应 OLLAMA_NUM_PARALLEL），多出的请求在桩内排队
+
+用法:
+    python ollama_stub.py --port 11435 --ttft 0.2 --tokens-per-sec 30 --load-delay 2
+    python server.py --ollama http://127.0.0.1:11435
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from async_server import AsyncHTTPServer, Request, Response, create_listen_socket
+from chat_store import normalize_agent
+from context_budget import estimate_tokens
+from modelfile import parse_modelfile
+
+DEFAULT_MODELS = ("qwen2.5:0.5b", "qwen2.5:7b", "linzhi-lora:latest")
+# Modelfile 未写 TEMPLATE 时使用的模板（Qwen2.5 ChatML，省略 tools 部分）
+DEFAULT_TEMPLATE = """{{- if .Messages }}
+{{- if .System }}<|im_start|>system
+{{ .System }}<|im_end|>
+{{ end }}
+{{- range $i, $_ := .Messages }}
+{{- $last := eq (len (slice $.Messages $i)) 1 -}}
+{{- if eq .Role "user" }}<|im_start|>user
+{{ .Content }}<|im_end|>
+{{ else if eq .Role "assistant" }}<|im_start|>assistant
+{{ .Content }}{{ if not $last }}<|im_end|>
+{{ end }}
+{{- end }}
+{{- if and (ne .Role "assistant") $last }}<|im_start|>assistant
+{{ end }}
+{{- end }}
+{{- else }}
+{{- if .System }}<|im_start|>system
+{{ .System }}<|im_end|>
+{{ end }}{{ if .Prompt }}<|im_start|>user
+{{ .Prompt }}<|im_end|>
+{{ end }}<|im_start|>assistant
+{{ .Response }}{{ if .Response }}<|im_end|>{{ end }}
+{{- end }}"""
+WORDS = ("你好", "，", "这是", "一段", "用于", "压测", "的", "模拟", "回复", "。")
+
+
+@dataclass
+class StubConfig:
+    models: List[str] = field(default_factory=lambda: list(DEFAULT_MODELS))
+    modelfiles: Dict[str, str] = field(default_factory=dict)  # 额外注册的模型：名称 -> Modelfile（可带 SYSTEM / PARAMETER）
+    load_delay: float = 1.0  # 模型未加载时首个请求的额外等待（秒）
+    ttft: float = 0.1  # 收到请求到首个 token 的固定延迟（秒），不含加载
+    prompt_tokens_per_sec: float = 0.0  # prompt 处理速度，0 表示不按 prompt 长度增加延迟
+    tokens_per_sec: float = 50.0
+    response_tokens: int = 32  # 未设置 num_predict 时每次回复的 token 数
+    parallel: int = 1  # 每个模型同时处理的请求数
+    keep_alive: float = 300.0  # 模型空闲多久后卸载（秒）
+    error_rate: float = 0.0  # 直接返回 500 的概率
+    drop_rate: float = 0.0  # 流式输出中途断开连接的概率
+    pull_error_rate: float = 0.0  # 拉取中途在流里返回 {"error": ...} 的概率（模拟 registry 下载失败）
+    pull_steps: int = 5
+    pull_delay: float = 0.05
+    show_delay: float = 0.0  # /api/show 的响应延迟（秒）
+    seed: Optional[int] = None
+
+
+def _digest(name: str) -> str:
+    return hashlib.sha256(name.encode("utf-8")).hexdigest()
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _ndjson(obj: Dict[str, Any]) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class OllamaStub:
+    def __init__(self, config: Optional[StubConfig] = None):
+        self.config = config or StubConfig()
+        self.rng = random.Random(self.config.seed)
+        self.models: Dict[str, Dict[str, Any]] = {}
+        for name in self.config.models:
+            self._add_model(name, f"FROM {name}\n")
+        for name, modelfile in self.config.modelfiles.items():
+            self._add_model(name, modelfile)
+        self.loaded: Dict[str, float] = {}  # 模型 -> 过期时间（monotonic）
+        self._load_locks: Dict[str, asyncio.Lock] = {}
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+        self.calls: Dict[str, int] = {}
+        self.active = 0
+        self.max_active = 0
+        self.cancelled = 0  # 客户端中途断开而提前停止的生成
+        self.received: Deque[Tuple[str, Dict[str, Any]]] = deque(maxlen=100)  # 最近的生成请求（路径, 请求体），供测试检查
+        self.app = self._build_app()
+
+    # ------------------------------------------------------------------ 模型
+    def _add_model(self, name: str, modelfile: str) -> None:
+        name = normalize_agent(name)
+        mf = parse_modelfile(modelfile)
+        parent = normalize_agent(mf.from_) if mf.from_ and mf.from_ != name else ""
+        self.models[name] = {
+            "name": name,
+            "model": name,
+            "digest": _digest(name + modelfile),
+            "size": 400_000_000 if "0.5b" in name else 4_700_000_000,
+            "modified_at": _now_iso(),
+            "modelfile": modelfile,
+            "details": {"parent_model": parent, "format": "gguf", "family": "qwen2"},
+            "parameters": mf.parameters,
+            "system": mf.system,
+            "messages": mf.messages,
+            "template": mf.template or DEFAULT_TEMPLATE,
+        }
+
+    def _find(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        name = payload.get("model") or payload.get("name")
+        if not isinstance(name, str) or not name:
+            return None
+        return self.models.get(normalize_agent(name))
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for name in [m for m, until in self.loaded.items() if until <= now]:
+            del self.loaded[name]
+
+    def _keep_alive(self, value: Any) -> float:
+        if isinstance(value, (int, float)):
+            return float(value)
+        if isinstance(value, str) and value:
+            units = {"s": 1, "m": 60, "h": 3600}
+            try:
+                if value[-1] in units:
+                    return float(value[:-1]) * units[value[-1]]
+                return float(value)
+            except ValueError:
+                pass
+        return self.config.keep_alive
+
+    async def _ensure_loaded(self, name: str) -> int:
+        """返回本次加载耗时（纳秒），已加载时为一个很小的值，与真实 Ollama 相同"""
+        self._expire()
+        lock = self._load_locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            if name in self.loaded:
+                return 2_000_000
+            t0 = time.monotonic()
+            await asyncio.sleep(self.config.load_delay)
+            self.loaded[name] = time.monotonic() + self.config.keep_alive
+            return int((time.monotonic() - t0) * 1e9)
+
+    # ------------------------------------------------------------------ 生成
+    def _prompt_tokens(self, payload: Dict[str, Any]) -> int:
+        if isinstance(payload.get("messages"), list):
+            text = "".join(str(m.get("content") or "") for m in payload["messages"] if isinstance(m, dict))
+            overhead = 4 * len(payload["messages"])
+        else:
+            text = str(payload.get("system") or "") + str(payload.get("prompt") or "")
+            overhead = 4
+        return max(1, int(estimate_tokens(text)) + overhead)
+
+    async def _generate(self, req: Request, resp: Response, chat: bool) -> None:
+        self.calls[req.path] = self.calls.get(req.path, 0) + 1
+        try:
+            payload = req.json() or {}
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            await resp.send_json(400, {"error": "invalid JSON"})
+            return
+        self.received.append((req.path, payload))
+        model = self._find(payload)
+        if model is None:
+            await resp.send_json(404, {"error": f"model '{payload.get('model')}' not found"})
+            return
+        name = model["name"]
+        if self.rng.random() < self.config.error_rate:
+            await resp.send_json(500, {"error": "stub: injected failure"})
+            return
+
+        keep_alive = self._keep_alive(payload.get("keep_alive"))
+        empty = not payload.get("messages") if chat else not payload.get("prompt")
+        if empty:
+            # 空请求：只加载（或 keep_alive=0 时卸载）模型
+            if keep_alive == 0:
+                self.loaded.pop(name, None)
+                await resp.send_json(200, {"model": name, "created_at": _now_iso(), "done": True, "done_reason": "unload"})
+                return
+            load_ns = await self._ensure_loaded(name)
+            self.loaded[name] = time.monotonic() + keep_alive
+            await resp.send_json(200, {"model": name, "created_at": _now_iso(), "done": True,
+                                       "done_reason": "load", "load_duration": load_ns})
+            return
+
+        slot = self._slots.setdefault(name, asyncio.Semaphore(max(1, self.config.parallel)))
+        async with slot:
+            await self._run_generation(req, resp, payload, name, chat, keep_alive)
+
+    async def _run_generation(
+        self, req: Request, resp: Response, payload: Dict[str, Any], name: str, chat: bool, keep_alive: float
+    ) -> None:
+        cfg = self.config
+        started = time.monotonic()
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            load_ns = await self._ensure_loaded(name)
+            options = payload.get("options") if isinstance(payload.get("options"), dict) else {}
+            limit = options.get("num_predict")
+            n_tokens = limit if isinstance(limit, int) and limit > 0 else cfg.response_tokens
+            prompt_tokens = self._prompt_tokens(payload)
+            prompt_s = cfg.ttft + (prompt_tokens / cfg.prompt_tokens_per_sec if cfg.prompt_tokens_per_sec > 0 else 0.0)
+            drop_at = self.rng.randint(1, max(1, n_tokens)) if self.rng.random() < cfg.drop_rate else None
+            stream = payload.get("stream", True) is not False
+
+            await asyncio.sleep(prompt_s)
+            if stream:
+                await resp.start(200)
+            eval_started = time.monotonic()
+            interval = 1.0 / cfg.tokens_per_sec if cfg.tokens_per_sec > 0 else 0.0
+            pieces: List[str] = []
+            for i in range(n_tokens):
+                if drop_at is not None and i == drop_at:
+                    resp.keep_alive = False
+                    resp.writer.close()
+                    raise ConnectionResetError("stub: injected disconnect")
+                if resp.client_gone:
+                    self.cancelled += 1  # 与 Ollama 一样：客户端走了就停止生成
+                    return
+                word = WORDS[i % len(WORDS)]
+                pieces.append(word)
+                if stream:
+                    await resp.write(_ndjson(self._record(name, chat, word, done=False)))
+                # 按绝对时间排期，避免 sleep 的误差累积
+                delay = eval_started + (i + 1) * interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            now = time.monotonic()
+            final = self._record(name, chat, "" if stream else "".join(pieces), done=True)
+            final.update(
+                done_reason="length" if isinstance(limit, int) and limit > 0 else "stop",
+                total_duration=int((now - started) * 1e9),
+                load_duration=load_ns,
+                prompt_eval_count=prompt_tokens,
+                prompt_eval_duration=int(prompt_s * 1e9),
+                eval_count=n_tokens,
+                eval_duration=max(1, int((now - eval_started) * 1e9)),
+            )
+            if not chat and not payload.get("raw"):
+                # 带 context 的请求只处理新增的 prompt（对应 Ollama 复用 KV 缓存）；与 Ollama 相同，raw 模式不返回 context
+                previous = payload.get("context") if isinstance(payload.get("context"), list) else []
+                final["context"] = list(previous) + list(range(len(previous), len(previous) + prompt_tokens + n_tokens))
+            self.loaded[name] = time.monotonic() + keep_alive
+            if stream:
+                await resp.write(_ndjson(final))
+            else:
+                await resp.send_json(200, final)
+        finally:
+            self.active -= 1
+
+    @staticmethod
+    def _record(name: str, chat: bool, text: str, done: bool) -> Dict[str, Any]:
+        record: Dict[str, Any] = {"model": name, "created_at": _now_iso()}
+        if chat:
+            record["message"] = {"role": "assistant", "content": text}
+        else:
+            record["response"] = text
+        record["done"] = done
+        return record
+
+    # ------------------------------------------------------------------ 路由
+    async def handle_chat(self, req: Request, resp: Response) -> None:
+        await self._generate(req, resp, chat=True)
+
+    async def handle_generate(self, req: Request, resp: Response) -> None:
+        await self._generate(req, resp, chat=False)
+
+    async def handle_tags(self, req: Request, resp: Response) -> None:
+        self.calls[req.path] = self.calls.get(req.path, 0) + 1
+        keys = ("name", "model", "digest", "size", "modified_at", "details")
+        await resp.send_json(200, {"models": [{k: m[k] for k in keys} for m in self.models.values()]})
+
+    async def handle_ps(self, req: Request, resp: Response) -> None:
+        self.calls[req.path] = self.calls.get(req.path, 0) + 1
+        self._expire()
+        models = [
+            {"name": n, "model": n, "digest": self.models[n]["digest"], "size": self.models[n]["size"]}
+            for n in self.loaded
+            if n in self.models
+        ]
+        await resp.send_json(200, {"models": models})
+
+    async def handle_show(self, req: Request, resp: Response) -> None:
+        self.calls[req.path] = self.calls.get(req.path, 0) + 1
+        if self.config.show_delay > 0:
+            await asyncio.sleep(self.config.show_delay)
+        try:
+            model = self._find(req.json() or {})
+        except (ValueError, AttributeError):
+            model = None
+        if model is None:
+            await resp.send_json(404, {"error": "model not found"})
+            return
+        parameters = "\n".join(
+            f"{k:<30} {json.dumps(v, ensure_ascii=False) if isinstance(v, str) else v}"
+            for k, values in model["parameters"].items()
+            for v in (values if isinstance(values, list) else [values])
+        )
+        show = {
+            "modelfile": model["modelfile"],
+            "parameters": parameters,
+            "system": model["system"],
+            "template": model["template"],
+            "details": model["details"],
+            "modified_at": model["modified_at"],
+        }
+        if model["messages"]:  # 与 Ollama 相同：没有 MESSAGE 时省略该字段
+            show["messages"] = model["messages"]
+        await resp.send_json(200, show)
+
+    async def handle_pull(self, req: Request, resp: Response) -> None:
+        self.calls[req.path] = self.calls.get(req.path, 0) + 1
+        try:
+            payload = req.json() or {}
+        except ValueError:
+            payload = {}
+        name = (payload.get("model") or payload.get("name")) if isinstance(payload, dict) else None
+        if not isinstance(name, str) or not name:
+            await resp.send_json(400, {"error": "model is required"})
+            return
+        if self.rng.random() < self.config.error_rate:
+            await resp.send_json(500, {"error": "stub: injected failure"})
+            return
+        await resp.start(200)
+        await resp.write(_ndjson({"status": "pulling manifest"}))
+        total = self.models.get(normalize_agent(name), {}).get("size") or 400_000_000
+        steps = max(1, self.config.pull_steps)
+        drop_at = self.rng.randint(1, steps) if self.rng.random() < self.config.drop_rate else None
+        error_at = self.rng.randint(1, steps) if self.rng.random() < self.config.pull_error_rate else None
+        for i in range(1, steps + 1):
+            await asyncio.sleep(self.config.pull_delay)
+            if i == drop_at:
+                resp.keep_alive = False
+                resp.writer.close()
+                raise ConnectionResetError("stub: injected disconnect")
+            if i == error_at:
+                # 与 Ollama 相同：HTTP 200 已发出，错误作为流里的一行返回
+                await resp.write(_ndjson({"error": "max retries exceeded: stub: injected download failure"}))
+                return
+            await resp.write(_ndjson({"status": f"pulling {_digest(name)[:12]}", "digest": "sha256:" + _digest(name),
+                                      "total": total, "completed": total * i // steps}))
+        if normalize_agent(name) not in self.models:
+            self._add_model(name, f"FROM {name}\n")
+        await resp.write(_ndjson({"status": "verifying sha256 digest"}))
+        await resp.write(_ndjson({"status": "success"}))
+
+    async def handle_create(self, req: Request, resp: Response) -> None:
+        self.calls[req.path] = self.calls.get(req.path, 0) + 1
+        try:
+            payload = req.json() or {}
+        except ValueError:
+            payload = {}
+        name = (payload.get("model") or payload.get("name")) if isinstance(payload, dict) else None
+        if not isinstance(name, str) or not name:
+            await resp.send_json(400, {"error": "model is required"})
+            return
+        modelfile = payload.get("modelfile")
+        if not isinstance(modelfile, str):
+            # 新版 API：from / system / parameters 字段
+            lines = [f"FROM {payload.get('from') or 'qwen2.5:0.5b'}"]
+            if payload.get("system"):
+                lines.append(f'SYSTEM """{payload["system"]}"""')
+            for k, v in (payload.get("parameters") or {}).items():
+                for item in v if isinstance(v, list) else [v]:
+                    lines.append(f"PARAMETER {k} {json.dumps(item, ensure_ascii=False) if isinstance(item, str) else item}")
+            modelfile = "\n".join(lines) + "\n"
+        base = parse_modelfile(modelfile).from_
+        if base and normalize_agent(base) not in self.models:
+            await resp.send_json(400, {"error": f"base model '{base}' not found"})
+            return
+        self._add_model(name, modelfile)
+        events = [{"status": "using existing layer"}, {"status": "writing manifest"}, {"status": "success"}]
+        if payload.get("stream", True) is False:
+            await resp.send_json(200, events[-1])
+            return
+        await resp.start(200)
+        for event in events:
+            await resp.write(_ndjson(event))
+
+    async def handle_delete(self, req: Request, resp: Response) -> None:
+        self.calls[req.path] = self.calls.get(req.path, 0) + 1
+        try:
+            model = self._find(req.json() or {})
+        except (ValueError, AttributeError):
+            model = None
+        if model is None:
+            await resp.send_json(404, {"error": "model not found"})
+            return
+        del self.models[model["name"]]
+        self.loaded.pop(model["name"], None)
+        await resp.send(200, content_type=None)
+
+    async def handle_version(self, req: Request, resp: Response) -> None:
+        await resp.send_json(200, {"version": "0.0.0-stub"})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": dict(self.calls),
+            "loaded": sorted(self.loaded),
+            "active": self.active,
+            "max_active": self.max_active,
+            "cancelled": self.cancelled,
+        }
+
+    def _build_app(self) -> AsyncHTTPServer:
+        app = AsyncHTTPServer(root=".", log_requests=False)
+        app.add_route("/api/chat", self.handle_chat, methods=("POST",))
+        app.add_route("/api/generate", self.handle_generate, methods=("POST",))
+        app.add_route("/api/tags", self.handle_tags, methods=("GET",))
+        app.add_route("/api/ps", self.handle_ps, methods=("GET",))
+        app.add_route("/api/show", self.handle_show, methods=("POST",))
+        app.add_route("/api/pull", self.handle_pull, methods=("POST",))
+        app.add_route("/api/create", self.handle_create, methods=("POST",))
+        app.add_route("/api/delete", self.handle_delete, methods=("DELETE",))
+        app.add_route("/api/version", self.handle_version, methods=("GET",))
+        return app
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="离线 Ollama 桩服务（压测 / CI 用）")
+    ap.add_argument("--host", type=str, default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11435)
+    ap.add_argument("--models", type=str, default=",".join(DEFAULT_MODELS), help="逗号分隔的模型名")
+    ap.add_argument("--load-delay", type=float, default=1.0, help="模型冷加载耗时（秒）")
+    ap.add_argument("--ttft", type=float, default=0.1, help="首 token 延迟（秒，不含加载）")
+    ap.add_argument("--prompt-tokens-per-sec", type=float, default=0.0, help="prompt 处理速度，0 表示忽略 prompt 长度")
+    ap.add_argument("--tokens-per-sec", type=float, default=50.0, help="生成速度")
+    ap.add_argument("--response-tokens", type=int, default=32, help="未指定 num_predict 时的回复长度")
+    ap.add_argument("--parallel", type=int, default=1, help="每个模型同时处理的请求数")
+    ap.add_argument("--keep-alive", type=float, default=300.0, help="模型空闲多久后卸载（秒）")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的概率")
+    ap.add_argument("--drop-rate", type=float, default=0.0, help="流式输出中途断开的概率")
+    ap.add_argument("--pull-error-rate", type=float, default=0.0, help="拉取中途在流里报错的概率")
+    ap.add_argument("--seed", type=int, default=None, help="故障注入的随机种子")
+    args = ap.parse_args()
+
+    config = StubConfig(
+        models=[m.strip() for m in args.models.split(",") if m.strip()],
+        load_delay=args.load_delay,
+        ttft=args.ttft,
+        prompt_tokens_per_sec=args.prompt_tokens_per_sec,
+        tokens_per_sec=args.tokens_per_sec,
+        response_tokens=args.response_tokens,
+        parallel=args.parallel,
+        keep_alive=args.keep_alive,
+        error_rate=args.error_rate,
+        drop_rate=args.drop_rate,
+        pull_error_rate=args.pull_error_rate,
+        seed=args.seed,
+    )
+    sock = create_listen_socket(args.host, args.port)
+    print(f"🧪 Ollama 桩服务 http://{args.host}:{args.port}  模型: {', '.join(config.models)}")
+
+    async def serve() -> None:
+        await OllamaStub(config).app.serve(sock)
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+服务端托管的模型拉取（替代浏览器直接流式读取 /api/pull）
+- 同一模型同时只跑一个拉取任务，谁发起都复用它；任务在后台 task 里运行，与浏览器连接无关
+- 进度通过 SSE 广播给任意多个订阅者；新订阅者先收到当前最新进度
+- 上游连接中断或 Ollama 在流中报告下载错误时按间隔重试（Ollama 会续传已下载的分片）；未完成的任务记在状态文件里，服务重启后自动继续
+- 拉取成功后让 /api/tags 缓存失效
+
+HTTP 接口（挂在 /panel/pulls 下）:
+    POST /panel/pulls                 {"model": "qwen2.5:7b"}  -> 启动或复用任务
+    GET  /panel/pulls                 -> 全部任务概况
+    GET  /panel/pulls/events?model=   -> text/event-stream 进度
+多 worker 时每个进程各自去重，建议拉取时使用单 worker。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from async_server import Request, Response
+from chat_store import normalize_agent
+
+SUBSCRIBER_QUEUE = 100
+SSE_KEEPALIVE = 15.0
+FINISHED_TTL = 600.0  # 结束的任务保留一段时间，供晚到的订阅者看到结果
+# 流中的这些错误重试也不会成功（模型名错误、仓库里没有该模型）
+PERMANENT_ERRORS = ("file does not exist", "not found", "invalid model name", "unauthorized")
+
+
+class PullStreamError(Exception):
+    """拉取流中途收到 {"error": ...}（多为 registry 下载超时、连接被重置），可重试"""
+
+
+class PullJob:
+    def __init__(self, model: str):
+        self.model = model
+        self.status = "running"  # running / success / error
+        self.error: Optional[str] = None
+        self.last: Dict[str, Any] = {"status": "queued"}
+        self.attempts = 0
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.subscribers: Set["asyncio.Queue[Dict[str, Any]]"] = set()
+        self.task: Optional["asyncio.Task[None]"] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status != "running"
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        self.last = event
+        for q in self.subscribers:
+            if q.full():
+                q.get_nowait()  # 慢订阅者丢弃最旧的进度，最终结果总能送达
+            q.put_nowait(event)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "status": self.status,
+            "error": self.error,
+            "attempts": self.attempts,
+            "progress": self.last,
+            "subscribers": len(self.subscribers),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class PullManager:
+    def __init__(self, proxy, state_path: str, max_attempts: int = 5, retry_delay: float = 5.0):
+        self.proxy = proxy
+        self.state_path = state_path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.jobs: Dict[str, PullJob] = {}
+        self.started = 0
+        self.deduplicated = 0
+        self.resumed = 0
+
+    # ------------------------------------------------------------------ 状态文件
+    def _pending(self) -> List[str]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return [m for m in json.load(f).get("pending", []) if isinstance(m, str)]
+        except (OSError, ValueError, AttributeError):
+            return []
+
+    def _save(self) -> None:
+        pending = sorted(m for m, job in self.jobs.items() if not job.done)
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+            tmp = f"{self.state_path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"pending": pending}, f, ensure_ascii=False)
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            print(f"⚠️  保存拉取任务状态失败: {e}", file=sys.stderr)
+
+    async def resume(self) -> None:
+        """启动时继续上次未完成的拉取"""
+        for model in self._pending():
+            if model not in self.jobs:
+                self.resumed += 1
+                self.start(model)
+
+    async def close(self) -> None:
+        # 不清除状态文件里的 pending：下次启动接着拉
+        for job in self.jobs.values():
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
+
+    # ------------------------------------------------------------------ 任务
+    def start(self, model: str) -> PullJob:
+        model = normalize_agent(model)
+        self._expire()
+        job = self.jobs.get(model)
+        if job is not None and not job.done:
+            self.deduplicated += 1
+            return job
+        job = PullJob(model)
+        self.jobs[model] = job
+        job.task = asyncio.ensure_future(self._run(job))
+        self.started += 1
+        self._save()
+        return job
+
+    def _expire(self) -> None:
+        now = time.time()
+        for model in [m for m, j in self.jobs.items() if j.done and not j.subscribers]:
+            if now - (self.jobs[model].finished_at or now) > FINISHED_TTL:
+                del self.jobs[model]
+
+    async def _attempt(self, job: PullJob) -> Optional[str]:
+        """执行一次拉取；返回 None 表示成功，否则返回不可重试的错误。连接类错误与可重试的流内错误直接抛出"""
+        # 新版 Ollama 用 model，旧版用 name，两个都带上
+        body = json.dumps({"model": job.model, "name": job.model, "stream": True}).encode("utf-8")
+        up = await self.proxy.pool.request("POST", "/api/pull", body, {"content-type": "application/json"})
+        try:
+            if up.status != 200:
+                text = (await up.read()).decode("utf-8", "replace")
+                try:
+                    return json.loads(text).get("error") or text
+                except (ValueError, AttributeError):
+                    return text or f"HTTP {up.status}"
+            tail = b""
+            async for chunk in up.iter_chunks():
+                lines = (tail + chunk).split(b"\n")
+                tail = lines.pop()
+                for line in lines:
+                    error = self._handle_line(job, line)
+                    if error is not None:
+                        return error
+            error = self._handle_line(job, tail)
+            if error is not None:
+                return error
+            if job.last.get("status") != "success":
+                raise ConnectionError("拉取流在完成前结束")
+            return None
+        finally:
+            up.release()
+
+    @staticmethod
+    def _handle_line(job: PullJob, line: bytes) -> Optional[str]:
+        if not line.strip():
+            return None
+        try:
+            event = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(event, dict):
+            return None
+        if "error" in event:
+            error = str(event["error"])
+            if any(marker in error.lower() for marker in PERMANENT_ERRORS):
+                return error
+            raise PullStreamError(error)
+        job.publish(event)
+        return None
+
+    async def _run(self, job: PullJob) -> None:
+        error: Optional[str] = None
+        while job.attempts < self.max_attempts:
+            job.attempts += 1
+            try:
+                error = await self._attempt(job)
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # 连接被重置、上游重启、registry 下载出错等：稍后重试
+                error = str(e) if isinstance(e, PullStreamError) else f"{type(e).__name__}: {e}"
+                if job.attempts >= self.max_attempts:
+                    break
+                reason = "拉取出错" if isinstance(e, PullStreamError) else "连接中断"
+                job.publish({"status": f"{reason}，{self.retry_delay:.0f} 秒后重试（第 {job.attempts} 次）",
+                             "retrying": True, "error": error})
+                await asyncio.sleep(self.retry_delay)
+
+        job.finished_at = time.time()
+        if error is None:
+            job.status = "success"
+            if self.proxy.cache is not None:
+                self.proxy.cache.invalidate()
+        else:
+            job.status = "error"
+            job.error = error
+        job.publish({"status": job.status, "error": job.error, "done": True})
+        self._save()
+
+    # ------------------------------------------------------------------ HTTP
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": sum(1 for j in self.jobs.values() if not j.done),
+            "started": self.started,
+            "deduplicated": self.deduplicated,
+            "resumed": self.resumed,
+            "subscribers": sum(len(j.subscribers) for j in self.jobs.values()),
+        }
+
+    def install(self, app) -> None:
+        app.add_route("/panel/pulls", self.handle, methods=("GET", "POST"))
+        app.add_route("/panel/pulls/events", self.handle_events, methods=("GET",))
+        app.on_startup(self.resume)
+        app.on_shutdown(self.close)
+
+    async def handle(self, req: Request, resp: Response) -> None:
+        if req.method == "GET":
+            self._expire()
+            await resp.send_json(200, {"pulls": [j.snapshot() for j in self.jobs.values()]})
+            return
+        try:
+            payload = req.json() or {}
+        except ValueError:
+            payload = {}
+        model = (payload.get("model") or payload.get("name")) if isinstance(payload, dict) else None
+        if not isinstance(model, str) or not model.strip():
+            await resp.send_error(400, "需要 model")
+            return
+        existing = self.jobs.get(normalize_agent(model))
+        job = self.start(model.strip())
+        await resp.send_json(200, dict(job.snapshot(), created=job is not existing))
+
+    async def handle_events(self, req: Request, resp: Response) -> None:
+        job = self.jobs.get(normalize_agent(req.query.get("model", "")))
+        if job is None:
+            await resp.send_error(404, "没有该模型的拉取任务")
+            return
+        queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(SUBSCRIBER_QUEUE)
+        job.subscribers.add(queue)
+        try:
+            await resp.start(
+                200,
+                content_type="text/event-stream; charset=utf-8",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+            event: Optional[Dict[str, Any]] = job.last
+            if job.done:
+                event = {"status": job.status, "error": job.error, "done": True}
+            while True:
+                if event is not None:
+                    await resp.write(b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n")
+                    if event.get("done"):
+                        break
+                try:
+                    event = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    event = None
+                    await resp.write(b": keep-alive\n\n")
+            await resp.end()
+        finally:
+            job.subscribers.discard(queue)
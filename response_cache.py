@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+确定性生成结果的磁盘缓存（/api/chat、/api/generate）
+- 只缓存可复现的请求：temperature 为 0，或固定了 seed（请求 options 优先，其次是模型 Modelfile 的 PARAMETER）
+- key = 模型 digest + 模型模板/参数 + 规范化后的请求体（messages/prompt、options、system、template、format 等）
+- 命中时整段回放上游当时的 NDJSON（或非流式 JSON），不经过 Ollama，也不占调度名额
+- 按总字节数做 LRU 淘汰；文件按 mtime 记录最近使用时间，重启后顺序不丢
+- 多 worker 时每个进程各自维护索引，共享同一目录；被别的进程淘汰掉的文件按未命中处理
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import shlex
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from api_cache import canonical_body
+from async_server import Request
+
+CACHED_PATHS = ("/api/chat", "/api/generate")
+# 不影响生成内容的字段，不参与 key
+IGNORED_FIELDS = ("keep_alive",)
+SUFFIX = ".resp"
+
+
+@dataclass
+class CachedResponse:
+    status: int
+    content_type: Optional[str]
+    body: bytes
+
+
+def parse_parameters(text: str) -> Dict[str, Any]:
+    """解析 /api/show 返回的 parameters 文本（每行 `名称  值`），stop 等重复参数合并为列表"""
+    params: Dict[str, Any] = {}
+    for line in (text or "").splitlines():
+        parts = line.strip().split(None, 1)
+        if len(parts) != 2:
+            continue
+        name, raw = parts
+        try:
+            value: Any = json.loads(raw)
+        except ValueError:
+            try:
+                value = " ".join(shlex.split(raw))
+            except ValueError:
+                value = raw
+        if name in params:
+            prev = params[name]
+            params[name] = (prev if isinstance(prev, list) else [prev]) + [value]
+        else:
+            params[name] = value
+    return params
+
+
+def is_deterministic(options: Dict[str, Any]) -> bool:
+    temperature = options.get("temperature")
+    if isinstance(temperature, (int, float)) and temperature == 0:
+        return True
+    seed = options.get("seed")
+    # Ollama 中 seed = -1（或不设置）表示每次随机
+    return isinstance(seed, int) and not isinstance(seed, bool) and seed >= 0
+
+
+def make_key(path: str, digest: str, template: str, parameters: str, payload: Dict[str, Any]) -> str:
+    body = {k: v for k, v in payload.items() if k not in IGNORED_FIELDS}
+    body["stream"] = body.get("stream", True) is not False
+    material = "\n".join([path, digest, template, parameters, canonical_body(json.dumps(body).encode("utf-8"))])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024, max_entry_bytes: Optional[int] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max(1, max_bytes // 8)
+        self._index: "OrderedDict[str, int]" = OrderedDict()  # key -> 文件大小，按最近使用排序
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.skipped = 0  # 非确定性请求（不查缓存）
+        self._scan()
+
+    def applies(self, req: Request) -> bool:
+        return req.method == "POST" and req.path in CACHED_PATHS
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + SUFFIX)
+
+    def _scan(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        found: List[Tuple[float, str, int]] = []
+        for dirpath, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(SUFFIX):
+                    continue
+                try:
+                    st = os.stat(os.path.join(dirpath, name))
+                except OSError:
+                    continue
+                found.append((st.st_mtime, name[: -len(SUFFIX)], st.st_size))
+        for _, key, size in sorted(found):
+            self._index[key] = size
+            self.total_bytes += size
+        for victim in self._evict():
+            try:
+                os.unlink(self._path(victim))
+            except OSError:
+                pass
+
+    # ------------------------------------------------------------------ 同步实现（线程池内）
+    def _read_sync(self, key: str) -> Optional[CachedResponse]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline().decode("utf-8"))
+                body = f.read()
+            os.utime(path)  # 刷新 mtime，作为重启后的 LRU 顺序
+        except (OSError, ValueError):
+            return None
+        return CachedResponse(int(header["status"]), header.get("content_type"), body)
+
+    def _write_sync(self, key: str, data: bytes, victims: List[str]) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        for victim in victims:
+            try:
+                os.unlink(self._path(victim))
+            except OSError:
+                pass
+
+    # ------------------------------------------------------------------ 异步接口
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        if key not in self._index:
+            self.misses += 1
+            return None
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(None, self._read_sync, key)
+        if cached is None:
+            # 文件被其他 worker 淘汰或已损坏
+            self.total_bytes -= self._index.pop(key, 0)
+            self.misses += 1
+            return None
+        if key in self._index:
+            self._index.move_to_end(key)
+        self.hits += 1
+        return cached
+
+    async def put(self, key: str, status: int, content_type: Optional[str], body: bytes) -> bool:
+        header = json.dumps({"status": status, "content_type": content_type, "stored_at": time.time()})
+        data = header.encode("utf-8") + b"\n" + body
+        if len(data) > self.max_entry_bytes:
+            return False
+        self.total_bytes -= self._index.pop(key, 0)
+        self._index[key] = len(data)
+        self.total_bytes += len(data)
+        victims = self._evict()
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._write_sync, key, data, victims)
+        except OSError:
+            self.total_bytes -= self._index.pop(key, 0)
+            return False
+        self.stores += 1
+        return True
+
+    def _evict(self) -> List[str]:
+        victims = []
+        while self.total_bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            victims.append(key)
+        return victims
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._index),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "skipped": self.skipped,
+        }
+
+
+def final_record_ok(body: bytes) -> bool:
+    """上游响应完整结束（最后一条 done: true 且没有 error）才值得缓存"""
+    lines = [l for l in body.splitlines() if l.strip()]
+    if not lines:
+        return False
+    try:
+        records = [json.loads(l) for l in lines]
+    except ValueError:
+        return False
+    return records[-1].get("done") is True and not any("error" in r for r in records)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+/api/chat、/api/generate 的准入控制与公平调度
+- 全局并发上限 + 每个模型的并发上限；超出的请求进入按模型划分的有界队列，队满返回 503
+- 同一模型的队列内按用户轮转（round-robin），一个人连发多条不会饿死别人
+- 批处理：刚放行过的模型若还有排队请求，优先继续放行（最多 batch_limit 个），减少 Ollama 来回换模型
+- 排队位置/等待时长由代理以首个 NDJSON 事件告知前端（见 OllamaProxy._forward_scheduled）
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Optional
+
+from async_server import Request
+
+SCHEDULED_PATHS = ("/api/chat", "/api/generate", "/api/embed", "/api/embeddings")
+
+
+class QueueFull(Exception):
+    def __init__(self, model: str, retry_after: int = 5):
+        super().__init__(f"模型 {model} 的排队请求已满，请稍后重试")
+        self.model = model
+        self.retry_after = retry_after
+
+
+@dataclass
+class Ticket:
+    model: str
+    user: str
+    enqueued_at: float = field(default_factory=time.monotonic)
+    position: int = 0  # 入队时前面还有几个同模型请求（0 表示直接放行）
+    admitted_at: Optional[float] = None
+    released: bool = False
+    _event: asyncio.Event = field(default_factory=asyncio.Event)
+
+    @property
+    def admitted(self) -> bool:
+        return self.admitted_at is not None
+
+    @property
+    def wait_ms(self) -> float:
+        end = self.admitted_at if self.admitted_at is not None else time.monotonic()
+        return (end - self.enqueued_at) * 1000
+
+    async def wait(self) -> None:
+        await self._event.wait()
+
+
+class _ModelQueue:
+    """单个模型的等待队列：按用户分桶，桶之间轮转"""
+
+    def __init__(self):
+        self.users: "OrderedDict[str, Deque[Ticket]]" = OrderedDict()
+        self.size = 0
+
+    def push(self, ticket: Ticket) -> None:
+        self.users.setdefault(ticket.user, deque()).append(ticket)
+        self.size += 1
+
+    def pop(self) -> Optional[Ticket]:
+        while self.users:
+            user, bucket = next(iter(self.users.items()))
+            ticket = bucket.popleft()
+            if bucket:
+                self.users.move_to_end(user)  # 该用户还有请求：排到队尾，下一个轮到别人
+            else:
+                del self.users[user]
+            self.size -= 1
+            return ticket
+        return None
+
+    def remove(self, ticket: Ticket) -> bool:
+        bucket = self.users.get(ticket.user)
+        if bucket is None or ticket not in bucket:
+            return False
+        bucket.remove(ticket)
+        if not bucket:
+            del self.users[ticket.user]
+        self.size -= 1
+        return True
+
+
+class Scheduler:
+    def __init__(self, global_limit: int = 4, per_model_limit: int = 2, max_queue: int = 32, batch_limit: int = 4):
+        self.global_limit = global_limit
+        self.per_model_limit = per_model_limit
+        self.max_queue = max_queue
+        self.batch_limit = batch_limit
+        self.running = 0
+        self.running_by_model: Dict[str, int] = {}
+        self.queues: "OrderedDict[str, _ModelQueue]" = OrderedDict()
+        self.active_model: Optional[str] = None
+        self._batch_count = 0
+        self.admitted_total = 0
+        self.queued_total = 0
+        self.rejected_total = 0
+        self.wait_ms_total = 0.0
+
+    def applies(self, req: Request) -> bool:
+        return req.method == "POST" and req.path in SCHEDULED_PATHS
+
+    @property
+    def queued(self) -> int:
+        return sum(q.size for q in self.queues.values())
+
+    def _can_run(self, model: str) -> bool:
+        return self.running < self.global_limit and self.running_by_model.get(model, 0) < self.per_model_limit
+
+    def _admit(self, ticket: Ticket) -> None:
+        ticket.admitted_at = time.monotonic()
+        self.running += 1
+        self.running_by_model[ticket.model] = self.running_by_model.get(ticket.model, 0) + 1
+        self.admitted_total += 1
+        self.wait_ms_total += ticket.wait_ms
+        if ticket.model == self.active_model:
+            self._batch_count += 1
+        else:
+            self.active_model = ticket.model
+            self._batch_count = 1
+        ticket._event.set()
+
+    def submit(self, model: str, user: str) -> Ticket:
+        """登记一个请求；能直接放行则立即 admitted，否则入队（队满抛 QueueFull）"""
+        ticket = Ticket(model=model, user=user)
+        queue = self.queues.get(model)
+        if (queue is None or queue.size == 0) and self._can_run(model):
+            self._admit(ticket)
+            return ticket
+        if queue is not None and queue.size >= self.max_queue:
+            self.rejected_total += 1
+            raise QueueFull(model)
+        if queue is None:
+            queue = self.queues[model] = _ModelQueue()
+        ticket.position = queue.size + 1
+        queue.push(ticket)
+        self.queued_total += 1
+        self._dispatch()
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        """请求结束（或排队中放弃）时调用，幂等"""
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.admitted:
+            self.running -= 1
+            left = self.running_by_model.get(ticket.model, 1) - 1
+            if left > 0:
+                self.running_by_model[ticket.model] = left
+            else:
+                self.running_by_model.pop(ticket.model, None)
+        else:
+            queue = self.queues.get(ticket.model)
+            if queue is not None:
+                queue.remove(ticket)
+        self._dispatch()
+
+    def _next_model(self) -> Optional[str]:
+        # 批处理：当前活跃模型还有排队且没超过批次上限，继续放行它
+        active = self.active_model
+        if active is not None and self._batch_count < self.batch_limit:
+            queue = self.queues.get(active)
+            if queue is not None and queue.size > 0 and self._can_run(active):
+                return active
+        # 否则按模型轮转，挑第一个能运行的
+        for model in list(self.queues.keys()):
+            queue = self.queues[model]
+            if queue.size == 0:
+                del self.queues[model]
+                continue
+            if model != active and self._can_run(model):
+                self.queues.move_to_end(model)
+                return model
+        # 别的模型都没有可放行的请求：当前模型即使批次已满也继续，避免空转
+        if active is not None:
+            queue = self.queues.get(active)
+            if queue is not None and queue.size > 0 and self._can_run(active):
+                return active
+        return None
+
+    def _dispatch(self) -> None:
+        while self.running < self.global_limit:
+            model = self._next_model()
+            if model is None:
+                return
+            ticket = self.queues[model].pop()
+            if ticket is None:
+                return
+            self._admit(ticket)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "running": self.running,
+            "queued": self.queued,
+            "running_by_model": dict(self.running_by_model),
+            "queued_by_model": {m: q.size for m, q in self.queues.items() if q.size},
+            "active_model": self.active_model,
+            "admitted_total": self.admitted_total,
+            "queued_total": self.queued_total,
+            "rejected_total": self.rejected_total,
+            "avg_wait_ms": round(self.wait_ms_total / self.admitted_total, 1) if self.admitted_total else 0.0,
+        }
+
+
+def user_key(req: Request) -> str:
+    """公平调度的“用户”：优先用 X-Panel-User 头，否则按客户端 IP 区分"""
+    return req.headers.get("x-panel-user") or req.peer or "anonymous"
+
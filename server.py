@@ -1,12 +1,44 @@
 #!/usr/bin/env python3
 """
 简单的 HTTP 服务器，用于托管 Ollama Web 面板
+默认使用 asyncio 并发服务（见 async_server.py）；--legacy 回退到原来的单线程 TCPServer
 """
+import argparse
 import http.server
 import socketserver
 import os
 
+from agent_index import AgentIndex
+from api_cache import ApiCache
+from arena import Arena
+from async_server import AsyncHTTPServer, run_server
+from bundler import ScriptBundler
+from chat_store import ChatStore, ChatStoreAPI
+from compaction import Compactor
+from context_budget import ContextBudget
+from metrics import Metrics
+from ollama_proxy import DEFAULT_OLLAMA, OllamaProxy, UpstreamPool
+from pull_manager import PullManager
+from response_cache import ResponseCache
+from scheduler import Scheduler
+from session_context import SessionContexts
+from singleflight import SingleFlight
+from static_cache import AssetCache
+from upstream_router import UpstreamRouter
+from warm_pool import WarmPool
+
 PORT = 8080
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR_NAME = "ollama-web-panel"
+
+
+def default_data_dir() -> str:
+    """聊天记录、缓存等服务端状态的默认目录：放在静态根目录之外，避免被当作静态文件下载"""
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.path.join(base, DATA_DIR_NAME)
 
 class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     def end_headers(self):
@@ -16,16 +48,227 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         super().end_headers()
 
-if __name__ == '__main__':
-    os.chdir(os.path.dirname(os.path.abspath(__file__)))
-    
-    with socketserver.TCPServer(("", PORT), MyHTTPRequestHandler) as httpd:
-        print(f"🚀 Ollama Web 面板已启动！")
-        print(f"📱 访问地址: http://localhost:{PORT}")
-        print(f"⚠️  请确保 Ollama 服务正在运行")
-        print(f"💡 按 Ctrl+C 停止服务\n")
-        
+
+def parse_args(argv=None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Ollama Web 面板服务器")
+    ap.add_argument("--host", type=str, default="", help="监听地址，默认所有网卡")
+    ap.add_argument("--port", type=int, default=PORT)
+    ap.add_argument("--workers", type=int, default=1, help="worker 进程数（仅 POSIX，共享同一端口）；大于 1 时需同时指定 --no-scheduler")
+    ap.add_argument("--legacy", action="store_true", help="使用原单线程 socketserver.TCPServer")
+    ap.add_argument("--quiet", action="store_true", help="不打印每个请求的访问日志")
+    ap.add_argument("--ollama", type=str, default=DEFAULT_OLLAMA, help="上游 Ollama 地址，多个节点用逗号分隔")
+    ap.add_argument("--health-interval", type=float, default=10.0, help="多节点时轮询各节点 /api/tags、/api/ps 的间隔（秒）")
+    ap.add_argument("--health-failures", type=int, default=2, help="多节点时连续失败多少次摘除该节点")
+    ap.add_argument("--upstream-connections", type=int, default=32, help="到 Ollama 的最大并发连接数")
+    ap.add_argument("--no-proxy", action="store_true", help="不启用 /api 代理，浏览器直连 Ollama")
+    ap.add_argument("--api-cache-ttl", type=float, default=30.0, help="/api/tags、/api/show 缓存秒数，0 表示关闭")
+    ap.add_argument("--max-concurrent", type=int, default=4, help="同时转发给 Ollama 的生成请求上限（整个服务；调度器只支持单 worker）")
+    ap.add_argument("--max-per-model", type=int, default=2, help="单个模型同时运行的生成请求上限")
+    ap.add_argument("--max-queue", type=int, default=32, help="每个模型最多排队的请求数，超出返回 503")
+    ap.add_argument("--batch-limit", type=int, default=4, help="同一模型连续放行的最大个数（减少换模型）")
+    ap.add_argument("--response-cache", action="store_true", help="缓存 temperature 0 / 固定 seed 的生成结果并直接回放")
+    ap.add_argument("--response-cache-dir", type=str, default="response_cache", help="生成结果缓存目录（相对 --data-dir）")
+    ap.add_argument("--response-cache-mb", type=int, default=256, help="生成结果缓存的总大小上限（MB）")
+    ap.add_argument("--context-fraction", type=float, default=0.75, help="聊天历史最多占用 num_ctx 的比例")
+    ap.add_argument("--no-context-trim", action="store_true", help="不裁剪聊天历史，原样转发")
+    ap.add_argument("--session-context", action="store_true",
+                    help="带 X-Panel-Session 的对话改走 /api/generate 并复用 context，不再每轮重发整段历史")
+    ap.add_argument("--session-max", type=int, default=256, help="最多保留的会话 context 数")
+    ap.add_argument("--session-ttl", type=float, default=1800.0, help="会话 context 闲置多久后丢弃（秒）")
+    ap.add_argument("--compact-model", type=str, default=None, help="用该（小）模型在后台把长对话的早期轮次总结成摘要")
+    ap.add_argument("--compact-threshold", type=float, default=0.6, help="对话超过 num_ctx 的这个比例时开始使用摘要")
+    ap.add_argument("--compact-keep", type=float, default=0.3, help="使用摘要时原样保留的最近消息占 num_ctx 的比例")
+    ap.add_argument("--tokenizer", action="append", default=[], metavar="模型=路径",
+                    help="用 tokenizer.json 精确计数（需 pip install tokenizers），可重复")
+    ap.add_argument("--warm-top", type=int, default=0, help="按最近使用预热并常驻的模型数，0 表示只统计冷启动不预热")
+    ap.add_argument("--warm-ram-gb", type=float, default=16.0, help="常驻模型的总内存预算（GB）")
+    ap.add_argument("--warm-keep-alive", type=str, default="30m", help="预热时传给 Ollama 的 keep_alive")
+    ap.add_argument("--warm-interval", type=float, default=60.0, help="预热池刷新间隔（秒）")
+    ap.add_argument("--warm-state", type=str, default="warm_pool.json", help="使用与冷启动统计文件（相对 --data-dir）")
+    ap.add_argument("--pull-state", type=str, default="pulls.json", help="未完成的模型拉取任务，重启后继续（相对 --data-dir）")
+    ap.add_argument("--pull-retries", type=int, default=5, help="拉取连接中断时的最大尝试次数")
+    ap.add_argument("--arena-concurrency", type=int, default=2, help="/panel/arena 同时请求的模型数上限")
+    ap.add_argument("--no-scheduler", action="store_true", help="生成请求不排队，直接转发")
+    ap.add_argument("--no-asset-cache", action="store_true", help="静态文件每次从磁盘读取（不压缩、不缓存）")
+    ap.add_argument("--bundle", action="store_true", help="把 js/*.js 按依赖顺序打成一个带内容哈希的 bundle")
+    ap.add_argument("--data-dir", type=str, default=None,
+                    help=f"聊天记录、缓存等服务端状态的目录，默认 {default_data_dir()}")
+    ap.add_argument("--chat-db", type=str, default="chats.db", help="聊天记录 SQLite 文件（相对 --data-dir）")
+    ap.add_argument("--no-chat-store", action="store_true", help="聊天记录仍只保存在浏览器 localStorage")
+    args = ap.parse_args(argv)
+    if args.workers > 1 and not (args.legacy or args.no_proxy or args.no_scheduler):
+        # 调度器的并发上限、按模型成批放行与排队位置都只在单个进程内成立，
+        # 多 worker 时实际上限会变成 N 倍，Ollama 又会来回换模型
+        ap.error("调度器不在 worker 进程间共享：--workers 大于 1 时请同时指定 --no-scheduler，或使用单 worker")
+    return args
+
+
+def stats_handler(sources):
+    """/panel/stats：汇总各组件的计数（连接池、缓存、请求合并等）"""
+    async def handle(req, resp):
+        await resp.send_json(200, {name: fn() for name, fn in sources.items()})
+    return handle
+
+
+def build_app(args: argparse.Namespace) -> AsyncHTTPServer:
+    app = AsyncHTTPServer(root=ROOT, log_requests=not args.quiet)
+    data_dir = os.path.abspath(os.path.expanduser(args.data_dir or default_data_dir()))
+    # 用户把状态放进了项目目录时，也不能经静态文件下载
+    app.hide(data_dir)
+
+    def data_path(path: str, *sidecars: str) -> str:
+        full = os.path.abspath(os.path.join(data_dir, os.path.expanduser(path)))
+        if not full.startswith(data_dir + os.sep):  # 用绝对路径指到了数据目录之外
+            for suffix in ("",) + sidecars:
+                app.hide(full + suffix)
+        return full
+
+    stats = {}
+    metrics = Metrics()
+    app.add_route("/panel/stats", stats_handler(stats), methods=("GET",))
+    app.add_route("/metrics", metrics.handle, methods=("GET",))
+    store = None if args.no_chat_store else ChatStore(data_path(args.chat_db, "-wal", "-shm", "-journal"))
+    if not args.no_proxy:
+        upstreams = [u.strip() for u in args.ollama.split(",") if u.strip()]
+        if len(upstreams) > 1:
+            pool = UpstreamRouter(
+                upstreams,
+                max_connections=args.upstream_connections,
+                interval=args.health_interval,
+                fail_threshold=args.health_failures,
+            )
+            app.on_startup(pool.start)
+        else:
+            pool = UpstreamPool(upstreams[0] if upstreams else DEFAULT_OLLAMA, max_connections=args.upstream_connections)
+        cache = ApiCache(ttl=args.api_cache_ttl)
+        singleflight = SingleFlight()
+        scheduler = None
+        if not args.no_scheduler:
+            scheduler = Scheduler(
+                global_limit=args.max_concurrent,
+                per_model_limit=args.max_per_model,
+                max_queue=args.max_queue,
+                batch_limit=args.batch_limit,
+            )
+            stats["scheduler"] = scheduler.stats
+        response_cache = None
+        if args.response_cache:
+            response_cache = ResponseCache(
+                data_path(args.response_cache_dir), max_bytes=args.response_cache_mb * 1024 * 1024
+            )
+            stats["response_cache"] = response_cache.stats
+        context = None
+        if not args.no_context_trim:
+            tokenizer_paths = dict(item.split("=", 1) for item in args.tokenizer if "=" in item)
+            context = ContextBudget(fraction=args.context_fraction, tokenizer_paths=tokenizer_paths)
+            stats["context"] = context.stats
+        sessions = None
+        if args.session_context:
+            sessions = SessionContexts(max_sessions=args.session_max, ttl=args.session_ttl)
+            stats["sessions"] = sessions.stats
+        proxy = OllamaProxy(
+            pool,
+            cache=cache,
+            singleflight=singleflight,
+            scheduler=scheduler,
+            response_cache=response_cache,
+            metrics=metrics,
+            context=context,
+            sessions=sessions,
+        )
+        stats.update(upstream_pool=pool.stats, api_cache=cache.stats, singleflight=singleflight.stats)
+        warm = WarmPool(
+            proxy,
+            data_path(args.warm_state),
+            top_n=args.warm_top,
+            ram_budget=int(args.warm_ram_gb * 1024**3),
+            keep_alive=args.warm_keep_alive,
+            interval=args.warm_interval,
+        )
+        proxy.warm = warm
+        warm.install(app)
+        stats["warm_pool"] = warm.stats
+        pulls = PullManager(proxy, data_path(args.pull_state), max_attempts=args.pull_retries)
+        pulls.install(app)
+        stats["pulls"] = pulls.stats
+        arena = Arena(proxy, max_concurrency=args.arena_concurrency)
+        arena.install(app)
+        if args.compact_model:
+            compactor = Compactor(
+                proxy,
+                args.compact_model,
+                store=store,
+                threshold=args.compact_threshold,
+                keep=args.compact_keep,
+                counter=context,
+            )
+            proxy.compactor = compactor
+            app.on_shutdown(compactor.close)
+            stats["compaction"] = compactor.stats
+        agent_index = AgentIndex(proxy)
+        agent_index.install(app)
+        stats["agent_index"] = agent_index.stats
+        app.add_route("/api/", proxy.handle)
+        app.on_shutdown(pool.close)
+        # 前端据此把 API_BASE 切到同源代理（见 js/state.js）
+        app.head_snippets.append("<script>window.__PANEL_PROXY__ = true;</script>")
+        app.head_snippets.append("<script>window.__PANEL_WARM__ = true;</script>")
+        app.head_snippets.append("<script>window.__PANEL_PULLS__ = true;</script>")
+        app.head_snippets.append("<script>window.__PANEL_AGENTS__ = true;</script>")
+        if sessions is not None:
+            app.head_snippets.append("<script>window.__PANEL_SESSIONS__ = true;</script>")
+    if store is not None:
+        ChatStoreAPI(store).install(app)
+        app.on_shutdown(store.close)
+        app.head_snippets.append("<script>window.__PANEL_CHAT_STORE__ = true;</script>")
+    if not args.no_asset_cache or args.bundle:
+        assets = AssetCache(app)
+        stats["assets"] = assets.stats
+        if not args.no_asset_cache:
+            assets.install()
+        if args.bundle:
+            ScriptBundler(app, assets).install()
+    # 连接池、缓存、调度器等组件的计数同时以 gauge 形式出现在 /metrics
+    for name, fn in stats.items():
+        metrics.add_stats(name, fn)
+    return app
+
+
+def print_banner(args: argparse.Namespace) -> None:
+    print(f"🚀 Ollama Web 面板已启动！")
+    print(f"📱 访问地址: http://localhost:{args.port}")
+    if not args.legacy:
+        print(f"⚙️  模式: asyncio，workers={args.workers}")
+        if not args.no_proxy:
+            print(f"🔀 /api 代理 -> {args.ollama}")
+    print(f"⚠️  请确保 Ollama 服务正在运行")
+    print(f"💡 按 Ctrl+C 停止服务\n")
+
+
+def run_legacy(args: argparse.Namespace) -> None:
+    with socketserver.TCPServer((args.host, args.port), MyHTTPRequestHandler) as httpd:
+        print_banner(args)
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
             print("\n\n👋 服务已停止")
+
+
+if __name__ == '__main__':
+    os.chdir(ROOT)
+    args = parse_args()
+
+    legacy_data = os.path.join(ROOT, "panel_data")
+    if args.data_dir is None and os.path.isdir(legacy_data):
+        print(f"⚠️  服务端状态已改存到 {default_data_dir()}；旧数据仍在 {legacy_data}，"
+              f"可移动过去或用 --data-dir 指定（该目录不再经静态文件提供）")
+
+    if args.legacy:
+        run_legacy(args)
+    else:
+        print_banner(args)
+        try:
+            run_server(args.host, args.port, lambda: build_app(args), workers=args.workers)
+        except KeyboardInterrupt:
+            pass
+        print("\n\n👋 服务已停止")
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+会话上下文复用（--session-context）：同一对话的后续轮次不再重发整段历史
+- 浏览器在 /api/chat 请求里带 X-Panel-Session: <对话 id>（单用户的一段对话）
+- 对话第一轮（只有 system + 一条 user）改走 /api/generate，记下 Ollama 返回的 context 与这一轮的回复
+- 之后每一轮：历史前缀与记录一致（哈希比对）且只新增一条 user 消息时，只把这条消息连同 context
+  发给 /api/generate，Ollama 不必重新处理之前的 prompt
+- 状态失效时回退到完整历史：edit（历史被修改 / 重新生成 / 摘要压缩）、model（换了模型）、
+  evicted（状态过期或被淘汰、服务重启、页面重新加载）、unsupported（图片、tools 等）
+- 除 unsupported 外，回退的这一轮用模型 TEMPLATE 把完整历史渲染成 prompt 发给 /api/generate（重新播种），
+  记下返回的 context，下一轮即可重新走 context；模板无法渲染时才原样转发 /api/chat
+- /api/generate 的 NDJSON 转换成 /api/chat 的格式返回，浏览器无感知；
+  最终记录附加 panel_session：本轮复用的 token 数与估算省下的 prompt 处理时间
+- 走 context 的轮次不经过摘要压缩与历史裁剪（超出 num_ctx 时由 Ollama 自行截断）
+"""
+
+from __future__ import annotations
+
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from async_server import Request
+from chat_store import normalize_agent
+from compaction import prefix_hashes
+from go_template import TemplateError, render, uses_field
+from modelfile import parse_modelfile
+
+SESSION_HEADER = "x-panel-session"
+PASSTHROUGH_FIELDS = ("options", "keep_alive", "format")
+RESEED_REASONS = ("edit", "model", "evicted")
+# 重新播种时 prompt 已经按模型模板渲染好：用只输出 .Prompt 的模板让 Ollama 原样使用
+# （raw: true 同样不套模板，但 Ollama 在 raw 模式下不返回 context）
+RAW_PROMPT_TEMPLATE = "{{ .Prompt }}"
+
+
+def render_history(
+    template: str,
+    messages: List[Dict[str, Any]],
+    default_system: str = "",
+    model_messages: Optional[List[Dict[str, Any]]] = None,
+) -> Optional[str]:
+    """按 Ollama /api/chat 的方式把对话历史渲染成 prompt（以等待 assistant 回复结尾）；无法渲染时返回 None
+
+    与 Ollama 相同：Modelfile 的 MESSAGE（model_messages）排在历史之前，历史第一条不是 system 消息时
+    再在最前面补上模型的默认 SYSTEM，相邻同角色消息合并；
+    模板用到 .Messages 时整体渲染，否则按旧式模板逐轮（System / Prompt / Response）渲染，最后一轮渲染到 .Response 为止。
+    """
+    msgs = [
+        {"Role": m.get("role"), "Content": str(m.get("content") or ""), "ToolCalls": None}
+        for m in list(model_messages or []) + list(messages)
+    ]
+    if default_system and (not messages or messages[0].get("role") != "system"):
+        msgs.insert(0, {"Role": "system", "Content": default_system, "ToolCalls": None})
+    collated: List[Dict[str, Any]] = []
+    for m in msgs:
+        if collated and collated[-1]["Role"] == m["Role"]:
+            collated[-1]["Content"] += "\n\n" + m["Content"]
+        else:
+            collated.append(m)
+    system = "\n\n".join(m["Content"] for m in collated if m["Role"] == "system")
+    try:
+        if uses_field(template, "Messages"):
+            return render(template, {"System": system, "Messages": collated, "Tools": None, "Response": ""})
+        out: List[str] = []
+        turn = {"System": "", "Prompt": "", "Response": ""}
+        for m in collated:
+            role, content = m["Role"], m["Content"]
+            if (role == "system" and (turn["Prompt"] or turn["Response"])) or (role == "user" and turn["Response"]):
+                out.append(render(template, turn))
+                turn = {"System": "", "Prompt": "", "Response": ""}
+            key = {"system": "System", "user": "Prompt", "assistant": "Response"}.get(role)
+            if key:
+                turn[key] = content
+        out.append(render(template, turn, stop_at="Response"))
+        return "".join(out)
+    except TemplateError:
+        return None
+
+
+@dataclass
+class SessionState:
+    model: str
+    prefix_hash: str  # 已被 context 覆盖的消息（含上一轮回复）的哈希
+    covered: int
+    context: List[int]
+    last_used: float = field(default_factory=time.monotonic)
+    turns: int = 0
+
+
+class ChatRecordConverter:
+    """把 /api/generate 的 NDJSON 逐行转换成 /api/chat 的格式"""
+
+    def __init__(self, turn: "SessionTurn"):
+        self.turn = turn
+        self.text: List[str] = []
+        self._tail = b""
+
+    def feed(self, chunk: bytes) -> bytes:
+        lines = (self._tail + chunk).split(b"\n")
+        self._tail = lines.pop()
+        return b"".join(self._convert(line) + b"\n" for line in lines if line.strip())
+
+    def flush(self) -> bytes:
+        tail, self._tail = self._tail, b""
+        return self._convert(tail) + b"\n" if tail.strip() else b""
+
+    def _convert(self, line: bytes) -> bytes:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return line
+        if not isinstance(record, dict) or "response" not in record:
+            return line  # {"error": ...} 等原样转发
+        text = record.pop("response") or ""
+        self.text.append(text)
+        context = record.pop("context", None)
+        out: Dict[str, Any] = {k: record.pop(k) for k in ("model", "created_at") if k in record}
+        out["message"] = {"role": "assistant", "content": text}
+        out.update(record)
+        if record.get("done"):
+            out["panel_session"] = self.turn.report(record, context)
+        return json.dumps(out, ensure_ascii=False).encode("utf-8")
+
+
+@dataclass
+class SessionTurn:
+    session_id: str
+    model: str
+    mode: str  # start / context / fallback
+    reason: str = ""
+    reseeded: bool = False  # 回退轮次改用渲染好的完整历史走 /api/generate
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+    generate_body: Optional[bytes] = None
+    reused_tokens: int = 0  # 本轮带上的旧 context 长度
+    previous_turns: int = 0
+    converter: Optional[ChatRecordConverter] = None
+    saved: Optional[Dict[str, Any]] = None
+
+    def headers(self) -> Dict[str, str]:
+        value = self.mode if not self.reason else f"{self.mode}; reason={self.reason}"
+        if self.reseeded:
+            value += "; reseed"
+        return {"X-Panel-Session": value}
+
+    @property
+    def reseedable(self) -> bool:
+        return self.mode == "fallback" and self.reason in RESEED_REASONS
+
+    def report(self, final: Dict[str, Any], context: Any = None) -> Dict[str, Any]:
+        """根据最终记录估算本轮省下的 prompt 处理量
+
+        新 context = 旧 context + 本轮 prompt + 本轮回复，其中没有被 prompt_eval 计入的部分就是复用的；
+        模型被重新加载时 Ollama 会重新处理整个 context，此时节省自然为 0。
+        """
+        prompt_eval = final.get("prompt_eval_count") if isinstance(final.get("prompt_eval_count"), int) else 0
+        generated = final.get("eval_count") if isinstance(final.get("eval_count"), int) else 0
+        total = len(context) if isinstance(context, list) else self.reused_tokens + prompt_eval + generated
+        saved = max(0, total - generated - prompt_eval) if self.mode == "context" else 0
+        duration = final.get("prompt_eval_duration")
+        per_token_ms = duration / 1e6 / prompt_eval if isinstance(duration, (int, float)) and prompt_eval > 0 else None
+        self.saved = {
+            "mode": self.mode,
+            "reused_tokens": self.reused_tokens,
+            "prompt_eval_count": prompt_eval,
+            "saved_prompt_tokens": saved,
+            "saved_prompt_ms": round(saved * per_token_ms, 1) if per_token_ms is not None else None,
+        }
+        return self.saved
+
+
+class SessionContexts:
+    def __init__(self, max_sessions: int = 256, ttl: float = 1800.0):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, SessionState]" = OrderedDict()
+        self.turns: Dict[str, int] = {}  # 模式 -> 轮数
+        self.fallbacks: Dict[str, int] = {}  # 原因 -> 次数
+        self.reseeds = 0
+        self.saved_prompt_tokens = 0
+        self.saved_prompt_ms = 0.0
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for sid in [s for s, st in self._sessions.items() if now - st.last_used > self.ttl]:
+            del self._sessions[sid]
+
+    @staticmethod
+    def _unsupported(payload: Dict[str, Any]) -> bool:
+        if payload.get("tools"):
+            return True
+        return any(m.get("images") or m.get("tool_calls") or m.get("role") == "tool" for m in payload["messages"])
+
+    def plan(self, req: Request, payload: Dict[str, Any]) -> Optional[SessionTurn]:
+        """决定本轮怎么发：返回 None 表示请求没带会话 id（完全不参与）"""
+        sid = req.headers.get(SESSION_HEADER, "").strip()
+        messages = payload.get("messages")
+        model = payload.get("model")
+        if not sid or not isinstance(model, str) or not isinstance(messages, list) or not messages:
+            return None
+        if not all(isinstance(m, dict) for m in messages):
+            return None
+        self._expire()
+        model = normalize_agent(model)
+        state = self._sessions.pop(sid, None)  # 本轮结束时由 complete() 写入新状态
+        turn = SessionTurn(session_id=sid, model=model, mode="fallback", messages=messages)
+
+        start = 0
+        while start < len(messages) and messages[start].get("role") == "system":
+            start += 1
+        last = messages[-1]
+        if self._unsupported(payload) or last.get("role") != "user":
+            turn.reason = "unsupported"
+        elif start == len(messages) - 1:
+            turn.mode = "start"  # 新对话的第一轮
+        elif state is None:
+            turn.reason = "evicted"
+        elif state.model != model:
+            turn.reason = "model"
+        elif len(messages) != state.covered + 1 or prefix_hashes(messages[:-1])[-1] != state.prefix_hash:
+            turn.reason = "edit"
+        else:
+            turn.mode = "context"
+            turn.reused_tokens = len(state.context)
+
+        if turn.mode == "fallback":
+            self.fallbacks[turn.reason] = self.fallbacks.get(turn.reason, 0) + 1
+            self.turns["fallback"] = self.turns.get("fallback", 0) + 1
+            return turn
+
+        body: Dict[str, Any] = {"model": payload["model"], "prompt": str(last.get("content") or "")}
+        system = "\n".join(str(m.get("content") or "") for m in messages[:start])
+        if turn.mode == "start" and system:
+            body["system"] = system
+        if turn.mode == "context":
+            body["context"] = state.context
+        self._set_body(turn, body, payload)
+        if state is not None:
+            turn.previous_turns = state.turns
+        return turn
+
+    @staticmethod
+    def _set_body(turn: SessionTurn, body: Dict[str, Any], payload: Dict[str, Any]) -> None:
+        body["stream"] = payload.get("stream", True) is not False
+        for key in PASSTHROUGH_FIELDS:
+            if key in payload:
+                body[key] = payload[key]
+        turn.generate_body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        turn.converter = ChatRecordConverter(turn)
+
+    def reseed(self, turn: SessionTurn, payload: Dict[str, Any], show: Optional[Dict[str, Any]]) -> bool:
+        """回退轮次：用模型 TEMPLATE（/api/show）渲染 payload 中的完整历史，改走 /api/generate 以重新拿到 context
+
+        payload 可以是摘要压缩、裁剪之后的历史；会话状态仍按浏览器发来的原始历史（turn.messages）记录。
+        """
+        show = show or {}
+        template = show.get("template")
+        if not turn.reseedable or not isinstance(template, str) or not template:
+            return False
+        # Modelfile 的 MESSAGE（few-shot 示例）：新版 Ollama 直接在 /api/show 里返回，否则从 modelfile 解析
+        preset = show.get("messages")
+        if not isinstance(preset, list):
+            preset = parse_modelfile(show.get("modelfile")).messages
+        preset = [m for m in preset if isinstance(m, dict)]
+        prompt = render_history(template, payload["messages"], str(show.get("system") or ""), preset)
+        if prompt is None:
+            return False
+        turn.reseeded = True
+        self.reseeds += 1
+        body = {"model": payload["model"], "prompt": prompt, "template": RAW_PROMPT_TEMPLATE}
+        self._set_body(turn, body, payload)
+        return True
+
+    def complete(self, turn: SessionTurn, final: Optional[Dict[str, Any]]) -> None:
+        """一轮走 /api/generate 的对话结束：保存新 context；失败或中断时丢弃会话状态"""
+        if turn.converter is None:
+            return
+        if turn.mode != "fallback":  # 回退轮次在 plan() 时已计数
+            self.turns[turn.mode] = self.turns.get(turn.mode, 0) + 1
+        context = (final or {}).get("context")
+        if not isinstance(context, list):
+            return
+        if turn.saved:
+            self.saved_prompt_tokens += turn.saved["saved_prompt_tokens"]
+            self.saved_prompt_ms += turn.saved["saved_prompt_ms"] or 0.0
+        covered = turn.messages + [{"role": "assistant", "content": "".join(turn.converter.text)}]
+        self._sessions[turn.session_id] = SessionState(
+            model=turn.model,
+            prefix_hash=prefix_hashes(covered)[-1],
+            covered=len(covered),
+            context=context,
+            turns=turn.previous_turns + 1,
+        )
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "sessions": len(self._sessions),
+            "turns_start": self.turns.get("start", 0),
+            "turns_context": self.turns.get("context", 0),
+            "turns_fallback": self.turns.get("fallback", 0),
+            "fallback_reasons": dict(self.fallbacks),
+            "reseeds": self.reseeds,
+            "saved_prompt_tokens": self.saved_prompt_tokens,
+            "saved_prompt_ms": round(self.saved_prompt_ms, 1),
+        }
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+请求合并（single-flight）：相同的幂等请求同时到达时只向 Ollama 发一次
+- key = 方法 + 路径 + 规范化后的 JSON 请求体
+- 上游调用在独立 task 里执行：领头的浏览器中途断开也不会连累其他等待者
+- leaders/coalesced 计数可直接看出省下了多少次上游调用
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from api_cache import canonical_body
+from async_server import Request
+
+T = TypeVar("T")
+
+IDEMPOTENT = {
+    ("GET", "/api/tags"),
+    ("GET", "/api/ps"),
+    ("GET", "/api/version"),
+    ("POST", "/api/show"),
+}
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[str, "asyncio.Future"] = {}
+        self.leaders = 0  # 实际发出的上游调用
+        self.coalesced = 0  # 搭便车的调用（= 节省的上游调用）
+
+    def key(self, req: Request) -> Optional[str]:
+        if (req.method, req.path) not in IDEMPOTENT:
+            return None
+        return f"{req.method} {req.target} {canonical_body(req.body)}"
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """返回 (结果, 是否为合并得到的共享结果)"""
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        self.leaders += 1
+
+        def _done(t: "asyncio.Future", k: str = key) -> None:
+            if self._inflight.get(k) is t:
+                del self._inflight[k]
+            if not t.cancelled():
+                t.exception()  # 标记异常已取走，避免 "exception was never retrieved"
+
+        task.add_done_callback(_done)
+        return await asyncio.shield(task), False
+
+    def stats(self):
+        return {"inflight": len(self._inflight), "leaders": self.leaders, "coalesced": self.coalesced}
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+静态资源内存缓存（index.html、style.css、app*.js、js/*.js 等）
+- 首次访问时读入内存，并预先计算 gzip（装了 brotli 时再加 br）压缩版本
+- 强 ETag + Cache-Control，浏览器再次访问走 If-None-Match -> 304
+- 按 mtime/size 检测文件变化（最多每 check_interval 秒 stat 一次），改完刷新即可生效
+"""
+
+from __future__ import annotations
+
+import asyncio
+import gzip
+import hashlib
+import mimetypes
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+from api_cache import etag_matches
+from async_server import AsyncHTTPServer, Request, Response, http_date
+
+
+def _try_import(name: str):
+    try:
+        return __import__(name)
+    except Exception:
+        return None
+
+
+brotli = _try_import("brotli")
+
+COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+MIN_COMPRESS_BYTES = 512
+
+
+@dataclass
+class Asset:
+    path: str
+    mtime_ns: int
+    size: int
+    content_type: str
+    etag: str
+    variants: Dict[str, bytes] = field(default_factory=dict)  # "identity" | "gzip" | "br"
+    checked_at: float = 0.0
+
+    def variant_etag(self, encoding: str) -> str:
+        if encoding == "identity":
+            return self.etag
+        return self.etag[:-1] + f"-{encoding}" + '"'
+
+
+def content_type_for(path: str) -> str:
+    ctype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if ctype.startswith("text/") or ctype in ("application/javascript", "application/json"):
+        ctype += "; charset=utf-8"
+    return ctype
+
+
+def choose_encoding(accept_encoding: str, available: Dict[str, bytes]) -> str:
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        token, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    pass
+        if q > 0:
+            accepted.add(token.strip().lower())
+    for enc in ("br", "gzip"):
+        if enc in available and (enc in accepted or "*" in accepted):
+            return enc
+    return "identity"
+
+
+def build_asset(path: str, st: os.stat_result, transform: Optional[Callable[[str, bytes], bytes]] = None) -> Asset:
+    """在线程池里执行：读文件 + 预压缩（一次性开销，之后每个请求都直接发内存里的字节）"""
+    with open(path, "rb") as f:
+        body = f.read()
+    if transform is not None:
+        body = transform(path, body)
+    return make_asset(path, body, st.st_mtime_ns, st.st_size)
+
+
+def make_asset(path: str, body: bytes, mtime_ns: int, size: int) -> Asset:
+    """由内存中的内容构造 Asset（path 只用于推断 Content-Type），同时预压缩"""
+    ctype = content_type_for(path)
+    asset = Asset(
+        path=path,
+        mtime_ns=mtime_ns,
+        size=size,
+        content_type=ctype,
+        etag='"' + hashlib.sha256(body).hexdigest()[:24] + '"',
+        variants={"identity": body},
+        checked_at=time.monotonic(),
+    )
+    if len(body) >= MIN_COMPRESS_BYTES and ctype.startswith(COMPRESSIBLE):
+        gz = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(gz) < len(body):
+            asset.variants["gzip"] = gz
+        if brotli is not None:
+            br = brotli.compress(body, quality=11)
+            if len(br) < len(body):
+                asset.variants["br"] = br
+    return asset
+
+
+class AssetCache:
+    def __init__(
+        self,
+        app: AsyncHTTPServer,
+        check_interval: float = 1.0,
+        max_file_bytes: int = 8 * 1024 * 1024,
+        cache_control: str = "no-cache",
+    ):
+        self.app = app
+        self.check_interval = check_interval
+        self.max_file_bytes = max_file_bytes
+        self.cache_control = cache_control
+        self._assets: Dict[str, Asset] = {}
+        self._loading: Dict[str, "asyncio.Future[Asset]"] = {}
+        self.hits = 0
+        self.loads = 0
+        self.not_modified = 0
+
+    def install(self) -> None:
+        """接管 app 的静态文件处理；大文件和目录跳转仍交给 app.serve_static"""
+        self.app.static_handler = self.handle
+
+    def _transform(self, path: str, body: bytes) -> bytes:
+        if self.app.head_snippets and path.endswith(".html"):
+            return self.app.inject_head(body)
+        return body
+
+    async def get(self, path: str) -> Optional[Asset]:
+        asset = self._assets.get(path)
+        now = time.monotonic()
+        if asset is not None and now - asset.checked_at < self.check_interval:
+            return asset
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._assets.pop(path, None)
+            return None
+        if asset is not None and asset.mtime_ns == st.st_mtime_ns and asset.size == st.st_size:
+            asset.checked_at = now
+            return asset
+
+        # 同一文件的并发首次加载只读一次盘
+        pending = self._loading.get(path)
+        if pending is not None:
+            return await pending
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(None, build_asset, path, st, self._transform)
+        self._loading[path] = fut
+        try:
+            asset = await fut
+        finally:
+            self._loading.pop(path, None)
+        self._assets[path] = asset
+        self.loads += 1
+        return asset
+
+    async def handle(self, req: Request, resp: Response) -> None:
+        if req.method not in ("GET", "HEAD"):
+            await self.app.serve_static(req, resp)
+            return
+        full = self.app.translate_path(req.path)
+        if full is None:
+            await self.app.serve_static(req, resp)
+            return
+        if req.path.endswith("/"):
+            full = os.path.join(full, "index.html")
+        cached = self._assets.get(full)
+        if cached is None or time.monotonic() - cached.checked_at >= self.check_interval:
+            # 未缓存/需要复查时才碰文件系统；目录跳转、超大文件等交给 serve_static
+            if not os.path.isfile(full) or os.path.getsize(full) > self.max_file_bytes:
+                self._assets.pop(full, None)
+                await self.app.serve_static(req, resp)
+                return
+
+        asset = await self.get(full)
+        if asset is None:
+            await resp.send_error(404, "File not found")
+            return
+        self.hits += 1
+        await self.send_asset(req, resp, asset, self.cache_control)
+
+    async def send_asset(self, req: Request, resp: Response, asset: Asset, cache_control: str) -> None:
+        encoding = choose_encoding(req.headers.get("accept-encoding", ""), asset.variants)
+        headers = {
+            "ETag": asset.variant_etag(encoding),
+            "Cache-Control": cache_control,
+            "Last-Modified": http_date(asset.mtime_ns / 1e9),
+        }
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if etag_matches(req.headers.get("if-none-match"), asset.variant_etag(encoding)) or etag_matches(
+            req.headers.get("if-none-match"), asset.etag
+        ):
+            self.not_modified += 1
+            await resp.send(304, content_type=None, headers=headers)
+            return
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        await resp.send(200, asset.variants[encoding], content_type=asset.content_type, headers=headers)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "assets": len(self._assets),
+            "bytes": sum(len(v) for a in self._assets.values() for v in a.variants.values()),
+            "hits": self.hits,
+            "loads": self.loads,
+            "not_modified": self.not_modified,
+        }
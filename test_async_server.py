@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+测试异步面板服务器 - 静态文件、keep-alive、CORS 与越界路径
+"""
+
+import asyncio
+import gzip
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from async_server import AsyncHTTPServer
+from bench_server import read_response
+from bundler import ScriptBundler, build_bundle
+from conftest import serve_app, stop_tasks
+from static_cache import AssetCache
+
+ROOT = Path(__file__).parent
+
+
+async def _request(reader, writer, raw: bytes):
+    writer.write(raw)
+    head = await reader.readuntil(b"\r\n\r\n")
+    text = head.decode("latin-1")
+    length = 0
+    for line in text.split("\r\n")[1:]:
+        if line.lower().startswith("content-length:"):
+            length = int(line.split(":", 1)[1])
+    body = await reader.readexactly(length) if length else b""
+    return text, body
+
+
+async def _with_server(fn, root=ROOT, asset_cache=False):
+    app = AsyncHTTPServer(root=str(root), log_requests=False)
+    if asset_cache:
+        AssetCache(app, check_interval=0).install()
+    task, port = await serve_app(app)
+    try:
+        await fn(port)
+    finally:
+        await stop_tasks(task)
+
+
+def test_static_keepalive_and_cors():
+    async def check(port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        head, body = await _request(reader, writer, b"GET / HTTP/1.1\r\nHost: x\r\n\r\n")
+        assert head.startswith("HTTP/1.1 200")
+        assert "Access-Control-Allow-Origin: *" in head
+        assert b"<script" in body
+        # 同一连接上的第二个请求
+        head, body = await _request(reader, writer, b"GET /js/state.js HTTP/1.1\r\nHost: x\r\n\r\n")
+        assert head.startswith("HTTP/1.1 200")
+        assert b"API_BASE" in body
+        writer.close()
+
+    asyncio.run(_with_server(check))
+
+
+def test_options_and_traversal():
+    async def check(port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        head, _ = await _request(reader, writer, b"OPTIONS /api/chat HTTP/1.1\r\nHost: x\r\n\r\n")
+        assert head.startswith("HTTP/1.1 204")
+        assert "Access-Control-Allow-Methods" in head
+        writer.write(b"GET /../../etc/passwd HTTP/1.1\r\nHost: x\r\n\r\n")
+        status, _ = await read_response(reader)
+        assert status == 404
+        writer.close()
+
+    asyncio.run(_with_server(check))
+
+
+def test_private_state_and_dotfiles_are_not_served():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        (root / "index.html").write_text("<html></html>", encoding="utf-8")
+        (root / "panel_data").mkdir()
+        (root / "panel_data" / "chats.db").write_bytes(b"SQLite format 3")
+        (root / ".env").write_text("TOKEN=x", encoding="utf-8")
+
+        async def check(port):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            for path in (b"/panel_data/chats.db", b"/Panel_Data/chats.db", b"/panel_data/", b"/.env", b"/x/../.env"):
+                writer.write(b"GET %s HTTP/1.1\r\nHost: x\r\n\r\n" % path)
+                status, _ = await read_response(reader)
+                assert status == 404, path
+            writer.write(b"GET /index.html HTTP/1.1\r\nHost: x\r\n\r\n")
+            status, _ = await read_response(reader)
+            assert status == 200
+            writer.close()
+
+        asyncio.run(_with_server(check, root=root))
+        asyncio.run(_with_server(check, root=root, asset_cache=True))
+
+        app = AsyncHTTPServer(root=tmp, log_requests=False)
+        app.hide(str(root / "state"))
+        app.hide(tmp + "/../elsewhere")  # 不在 root 下，无需隐藏
+        assert app.translate_path("/state/chats.db") is None
+        assert app.translate_path("/statefile") is not None and len(app.private_paths) == 2
+
+
+def test_malformed_and_slow_bodies_get_4xx():
+    async def run():
+        app = AsyncHTTPServer(root=str(ROOT), log_requests=False, keepalive_timeout=0.3)
+        task, port = await serve_app(app)
+        chunked = b"POST /x HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n"
+        cases = [
+            (chunked + b"zz\r\nhello\r\n0\r\n\r\n", 400),
+            (chunked + b"1" * 100_000 + b"\r\n", 400),
+            (chunked + b"5\r\nhelloXX0\r\n\r\n", 400),
+            # 慢速发送者：请求体迟迟不发完，超时后回 408 并关闭连接
+            (b"POST /x HTTP/1.1\r\nHost: x\r\nContent-Length: 10\r\n\r\nabc", 408),
+            (chunked + b"5\r\nhel", 408),
+        ]
+        try:
+            for raw, expected in cases:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(raw)
+                status, _ = await asyncio.wait_for(read_response(reader), 2)
+                assert status == expected, raw[:80]
+                writer.close()
+        finally:
+            await stop_tasks(task)
+
+    asyncio.run(run())
+
+
+def test_serve_signals_ready_after_startup_hooks():
+    async def run():
+        app = AsyncHTTPServer(root=str(ROOT), log_requests=False)
+        started = []
+
+        async def slow_startup():
+            await asyncio.sleep(0.2)
+            started.append(True)
+
+        app.on_startup(slow_startup)
+        # 启动钩子比以前固定等待的 50ms 慢：就绪后才返回，第一个请求不会撞上未就绪的服务
+        task, port = await serve_app(app)
+        assert started
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /style.css HTTP/1.1\r\nHost: x\r\n\r\n")
+        status, _ = await read_response(reader)
+        assert status == 200
+        writer.close()
+        await stop_tasks(task)
+
+        broken = AsyncHTTPServer(root=str(ROOT), log_requests=False)
+
+        async def fail():
+            raise RuntimeError("startup failed")
+
+        broken.on_startup(fail)
+        try:
+            await serve_app(broken)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("启动失败应直接抛出，而不是永远等待就绪")
+
+    asyncio.run(run())
+
+
+def test_slow_client_does_not_block():
+    async def check(port):
+        _, slow = await asyncio.open_connection("127.0.0.1", port)
+        slow.write(b"GET / HTTP/1.1\r\nHost: lo")
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /style.css HTTP/1.1\r\nHost: x\r\n\r\n")
+        status, _ = await asyncio.wait_for(read_response(reader), 2)
+        assert status == 200
+        writer.close()
+        slow.close()
+
+    asyncio.run(_with_server(check))
+
+
+def test_asset_cache_gzip_etag_and_reload():
+    with tempfile.TemporaryDirectory() as tmp:
+        asset = Path(tmp) / "app.js"
+        asset.write_text("console.log('v1');\n" * 100, encoding="utf-8")
+
+        async def check(port):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            head, body = await _request(reader, writer, b"GET /app.js HTTP/1.1\r\nAccept-Encoding: gzip\r\n\r\n")
+            assert "Content-Encoding: gzip" in head
+            assert b"v1" in gzip.decompress(body)
+            etag = [l.split(": ", 1)[1] for l in head.split("\r\n") if l.startswith("ETag")][0]
+            raw = f"GET /app.js HTTP/1.1\r\nAccept-Encoding: gzip\r\nIf-None-Match: {etag}\r\n\r\n".encode()
+            head, _ = await _request(reader, writer, raw)
+            assert head.startswith("HTTP/1.1 304")
+            # 修改文件后（mtime 变化）立即生效
+            asset.write_text("console.log('v2');\n" * 100, encoding="utf-8")
+            os.utime(asset, (asset.stat().st_atime, asset.stat().st_mtime + 5))
+            head, body = await _request(reader, writer, raw)
+            assert head.startswith("HTTP/1.1 200")
+            assert b"v2" in gzip.decompress(body)
+            writer.close()
+
+        asyncio.run(_with_server(check, root=Path(tmp), asset_cache=True))
+
+
+_SHUTDOWN_SCRIPT = """
+import os, sys
+sys.path.insert(0, sys.argv[1])
+from async_server import AsyncHTTPServer, run_server
+
+def factory():
+    app = AsyncHTTPServer(root=sys.argv[1], log_requests=False)
+
+    async def mark(name):
+        open(os.path.join(sys.argv[2], f"{name}-{os.getpid()}"), "w").close()
+
+    app.on_startup(lambda: mark("up"))
+    app.on_shutdown(lambda: mark("down"))
+    return app
+
+run_server("127.0.0.1", 0, factory, workers=int(sys.argv[3]))
+"""
+
+
+def test_sigterm_runs_shutdown_hooks_in_every_worker():
+    if not hasattr(os, "fork"):
+        return
+    for workers in (1, 2):
+        with tempfile.TemporaryDirectory() as tmp:
+            proc = subprocess.Popen([sys.executable, "-c", _SHUTDOWN_SCRIPT, str(ROOT), tmp, str(workers)])
+            try:
+                deadline = time.monotonic() + 10
+                while len(list(Path(tmp).glob("up-*"))) < workers and time.monotonic() < deadline:
+                    time.sleep(0.02)
+                proc.send_signal(signal.SIGTERM)
+                proc.wait(10)
+            finally:
+                if proc.poll() is None:
+                    proc.kill()
+            # systemd/docker stop 只发 SIGTERM：每个 worker 都要执行 on_shutdown（关闭 SQLite、保存状态等）
+            assert len(list(Path(tmp).glob("down-*"))) == workers
+
+
+def test_bundle_keeps_script_order():
+    bundle = build_bundle(str(ROOT), "index.html")
+    code = bundle.script.variants["identity"].decode("utf-8")
+    order = [code.index(f"// ---- {src} ----") for src in bundle.sources]
+    assert bundle.sources[0] == "js/state.js" and bundle.sources[-1] == "js/main.js"
+    assert order == sorted(order)
+    html = bundle.index.variants["identity"].decode("utf-8")
+    assert html.count("<script src=") == 1
+    assert f'<script src="{bundle.name}"></script>' in html
+
+
+def test_requests_during_first_build_wait_for_bundle():
+    async def run():
+        app = AsyncHTTPServer(root=str(ROOT), log_requests=False)
+        bundler = ScriptBundler(app, AssetCache(app))
+        # 首次打包还在进行时到达的请求也应拿到 bundle，而不是未打包的 index.html
+        bundles = await asyncio.gather(*(bundler.current() for _ in range(5)))
+        assert bundles[0] is not None and all(b is bundles[0] for b in bundles)
+        assert bundler.builds == 1
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_static_keepalive_and_cors()
+    test_options_and_traversal()
+    test_private_state_and_dotfiles_are_not_served()
+    test_malformed_and_slow_bodies_get_4xx()
+    test_serve_signals_ready_after_startup_hooks()
+    test_slow_client_does_not_block()
+    test_asset_cache_gzip_etag_and_reload()
+    test_sigterm_runs_shutdown_hooks_in_every_worker()
+    test_bundle_keeps_script_order()
+    test_requests_during_first_build_wait_for_bundle()
+    print("✅ 全部通过")
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+测试服务端聊天记录 - 追加写、游标分页、清空与别名归一
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from chat_store import ChatStore
+
+
+def test_append_page_and_clear():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ChatStore(str(Path(tmp) / "chats.db"))
+        msgs = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"m{i}"} for i in range(10000)]
+        store.append_sync("linzhi-lora", msgs)
+
+        page = store.page_sync("linzhi-lora:latest", limit=50)
+        assert [m["content"] for m in page["messages"]] == [f"m{i}" for i in range(9950, 10000)]
+        assert page["has_more"] is True
+
+        older = store.page_sync("linzhi-lora", before=page["next_before"], limit=50)
+        assert older["messages"][-1]["content"] == "m9949"
+
+        # 已有记录时 only_if_empty 不重复导入（localStorage 迁移）
+        assert store.append_sync("linzhi-lora", msgs[:3], only_if_empty=True) == []
+        assert store.count_sync("linzhi-lora") == 10000
+
+        assert store.clear_sync("linzhi-lora") == 10000
+        assert store.page_sync("linzhi-lora")["messages"] == []
+
+
+if __name__ == "__main__":
+    test_append_page_and_clear()
+    print("✅ 全部通过")
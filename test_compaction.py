@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+测试长对话摘要压缩 - 超过阈值后台生成摘要、按前缀哈希复用、滚动更新、上游只收到摘要 + 最近轮次
+"""
+
+import asyncio
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from async_server import AsyncHTTPServer
+from chat_store import ChatStore
+from conftest import serve_app, stop_tasks
+from compaction import SUMMARY_HEADER, Compactor, prefix_hashes
+from ollama_proxy import OllamaProxy, UpstreamPool
+from ollama_stub import OllamaStub, StubConfig
+
+ROOT = Path(__file__).parent
+
+
+def _history(turns: int):
+    msgs = [{"role": "system", "content": "你是林栀，一位温柔的花店店主。"}]
+    for i in range(turns):
+        msgs.append({"role": "user", "content": f"第{i}轮：" + "今天店里来了什么客人？" * 10})
+        msgs.append({"role": "assistant", "content": f"回答{i}：" + "一位买白玫瑰的老先生。" * 10})
+    msgs.append({"role": "user", "content": "还记得我们第一次见面吗？"})
+    return msgs
+
+
+async def _chat(port, messages):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps({"model": "linzhi-lora", "messages": messages, "stream": False}, ensure_ascii=False).encode()
+    writer.write(b"POST /api/chat HTTP/1.1\r\nHost: x\r\nConnection: close\r\nContent-Length: %d\r\n\r\n%s"
+                 % (len(body), body))
+    data = await reader.read()
+    writer.close()
+    head = data.split(b"\r\n\r\n", 1)[0].decode()
+    return dict(l.split(": ", 1) for l in head.split("\r\n")[1:] if ": " in l)
+
+
+def test_prefix_hashes_are_incremental():
+    msgs = _history(2)
+    assert prefix_hashes(msgs)[:4] == prefix_hashes(msgs[:3])
+    assert len(set(prefix_hashes(msgs))) == len(msgs) + 1
+
+
+def test_summary_replaces_old_turns_and_rolls_forward():
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            stub = OllamaStub(StubConfig(models=["qwen2.5:0.5b", "linzhi-lora"], load_delay=0, ttft=0, tokens_per_sec=0))
+            stub_task, stub_port = await serve_app(stub.app)
+            proxy = OllamaProxy(UpstreamPool(f"http://127.0.0.1:{stub_port}"))
+            store = ChatStore(str(Path(tmp) / "chats.db"))
+            compactor = Compactor(proxy, "qwen2.5:0.5b", store=store, threshold=0.5, keep=0.25)
+            proxy.compactor = compactor
+            panel = AsyncHTTPServer(root=str(ROOT), log_requests=False)
+            panel.add_route("/api/", proxy.handle)
+            panel_task, port = await serve_app(panel)
+
+            history = _history(30)
+            # 第一次：还没有摘要，原样转发，同时在后台生成摘要
+            headers = await _chat(port, history)
+            assert "X-Panel-Compacted-Messages" not in headers
+            await asyncio.gather(*compactor._jobs.values())
+            summaries = await store.summaries("linzhi-lora")
+            assert len(summaries) == 1 and summaries[0]["summary"]
+            covered = summaries[0]["covered"]
+            assert 1 < covered < len(history)
+            summarize_call = [p for path, p in stub.received if p["model"] == "qwen2.5:0.5b"][-1]
+            assert summarize_call["stream"] is False and "林栀" in summarize_call["messages"][1]["content"]
+
+            # 第二次：同一前缀 + 新一轮，上游只收到 system + 摘要 + 摘要之后的消息
+            history += [{"role": "assistant", "content": "当然记得。"}, {"role": "user", "content": "那天下雨了吗？"}]
+            headers = await _chat(port, history)
+            assert headers["X-Panel-Compacted-Messages"] == str(covered)
+            sent = [p for path, p in stub.received if p["model"] == "linzhi-lora"][-1]["messages"]
+            assert sent[0] == history[0] and sent[1]["content"].startswith(SUMMARY_HEADER)
+            assert sent[2:] == history[covered:]
+            assert compactor.stats()["saved_tokens"] > 0
+
+            # 再聊很多轮：旧消息积累到一定量后滚动生成覆盖更多轮次的新摘要，并带上旧摘要
+            for i in range(12):
+                history += [{"role": "assistant", "content": "嗯。" * 50}, {"role": "user", "content": f"追问{i}" * 30}]
+                await _chat(port, history)
+            await asyncio.gather(*compactor._jobs.values())
+            rows = await store.summaries("linzhi-lora")
+            assert len(rows) >= 2 and rows[-1]["covered"] > covered
+            last_summarize = [p for path, p in stub.received if p["model"] == "qwen2.5:0.5b"][-1]
+            assert "已有摘要" in last_summarize["messages"][1]["content"]
+
+            await compactor.close()
+            await store.close()
+            await stop_tasks(panel_task, stub_task)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_prefix_hashes_are_incremental()
+    test_summary_replaces_old_turns_and_rolls_forward()
+    print("✅ 全部通过")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+测试聊天历史裁剪 - 保留 system 与最近轮次、丢弃孤立回复、按 prompt_eval_count 校准
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from context_budget import ContextBudget
+
+
+def _history(turns: int):
+    msgs = [{"role": "system", "content": "你是林知。"}]
+    for i in range(turns):
+        msgs.append({"role": "user", "content": f"问题{i} " + "字" * 40})
+        msgs.append({"role": "assistant", "content": f"回答{i} " + "字" * 40})
+    msgs.append({"role": "user", "content": "最新的问题"})
+    return msgs
+
+
+def test_keeps_system_and_recent_turns():
+    budget = ContextBudget(fraction=0.5)
+    payload = {"model": "linzhi-lora", "messages": _history(20), "options": {"num_ctx": 400}}
+    result = budget.trim(payload)
+    assert result.budget == 200
+    assert result.kept_tokens <= result.budget
+    assert result.messages[0]["role"] == "system"
+    assert result.messages[1]["role"] == "user"  # 不以孤立的 assistant 开头
+    assert result.messages[-1]["content"] == "最新的问题"
+    assert result.dropped_messages == len(payload["messages"]) - len(result.messages) > 0
+    assert result.dropped_tokens > 0
+
+    # 放得下时不裁剪
+    assert budget.trim({"model": "linzhi-lora", "messages": _history(1)}).dropped_messages == 0
+
+
+def test_calibration_from_prompt_eval_count():
+    budget = ContextBudget()
+    result = budget.trim({"model": "m", "messages": _history(2)})
+    for _ in range(20):
+        budget.calibrate(result, {"prompt_eval_count": int(result.raw_estimate * 2)})
+    assert 1.9 < budget.scale("m") <= 2.0
+    # KV 缓存命中导致的偏小样本被忽略
+    budget.calibrate(result, {"prompt_eval_count": 3})
+    assert budget.scale("m") > 1.9
+
+
+if __name__ == "__main__":
+    test_keeps_system_and_recent_turns()
+    test_calibration_from_prompt_eval_count()
+    print("✅ 全部通过")
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+测试 Modelfile 解析 - 三引号多行值、带引号参数、重复参数合并、注释与大小写
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from modelfile import parse_modelfile
+
+SAMPLE = '''# Modelfile generated by "ollama show"
+FROM /root/.ollama/models/blobs/sha256-1234
+template """{{ if .System }}<|im_start|>system
+{{ .System }}<|im_end|>{{ end }}"""
+SYSTEM """
+你是林知，一名耐心的助教。
+回答尽量简洁。
+"""
+PARAMETER temperature 0.7
+PARAMETER num_ctx 4096
+PARAMETER stop "<|im_start|>"
+PARAMETER stop "<|im_end|>"
+PARAMETER stop "42"
+MESSAGE user 你好
+MESSAGE assistant "你好！有什么可以帮你？"
+ADAPTER ./lora.gguf
+'''
+
+
+def test_parses_all_instructions():
+    mf = parse_modelfile(SAMPLE)
+    assert mf.from_ == "/root/.ollama/models/blobs/sha256-1234"
+    assert mf.template.startswith("{{ if .System }}") and mf.template.endswith("{{ end }}")
+    assert mf.system == "你是林知，一名耐心的助教。\n回答尽量简洁。"
+    assert mf.parameters == {"temperature": 0.7, "num_ctx": 4096, "stop": ["<|im_start|>", "<|im_end|>", "42"]}
+    assert mf.messages == [
+        {"role": "user", "content": "你好"},
+        {"role": "assistant", "content": "你好！有什么可以帮你？"},
+    ]
+    assert mf.adapters == ["./lora.gguf"]
+
+
+def test_single_line_system_and_empty_input():
+    mf = parse_modelfile('FROM qwen2.5:7b\nSYSTEM "只用中文回答"\n')
+    assert mf.to_dict()["from"] == "qwen2.5:7b" and mf.system == "只用中文回答"
+    assert parse_modelfile("").to_dict()["parameters"] == {}
+    assert parse_modelfile(None).from_ == ""
+
+
+if __name__ == "__main__":
+    test_parses_all_instructions()
+    test_single_line_system_and_empty_input()
+    print("✅ 全部通过")
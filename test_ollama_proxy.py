@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+"""
+测试 /api 代理 - 对接 ollama_stub 桩服务，验证流式透传与上游连接复用
+"""
+
+import asyncio
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from agent_index import AgentIndex
+from api_cache import ApiCache
+from arena import Arena
+from async_server import AsyncHTTPServer, create_listen_socket
+from conftest import serve_app, stop_tasks
+from metrics import Metrics
+from ollama_stub import OllamaStub, StubConfig
+from ollama_proxy import OllamaProxy, UpstreamPool
+from pull_manager import PullManager
+from response_cache import ResponseCache
+from scheduler import Scheduler
+from singleflight import SingleFlight
+
+ROOT = Path(__file__).parent
+TOKEN_DELAY = 0.1
+LINZHI_MODELFILE = 'FROM qwen2.5:0.5b\nSYSTEM """\n你是林知。\n"""\nPARAMETER temperature 0.3\nPARAMETER stop "<|im_end|>"\n'
+
+
+def make_stub(**config) -> OllamaStub:
+    """每 TOKEN_DELAY 输出一个 token、每次回复 3 个 token 的桩；/api/show 与拉取的每一步也耗时 TOKEN_DELAY"""
+    defaults = dict(
+        models=["qwen2.5:0.5b"],
+        modelfiles={"linzhi-lora:latest": LINZHI_MODELFILE},
+        load_delay=0.0,
+        ttft=0.02,
+        tokens_per_sec=1 / TOKEN_DELAY,
+        response_tokens=3,
+        show_delay=TOKEN_DELAY,
+        pull_steps=2,
+        pull_delay=TOKEN_DELAY,
+    )
+    return OllamaStub(StubConfig(**dict(defaults, **config)))
+
+
+async def _setup(cache=None, singleflight=None, scheduler=None, response_cache=None, metrics=None):
+    stub = make_stub()
+    stub_task, stub_port = await serve_app(stub.app)
+    pool = UpstreamPool(f"http://127.0.0.1:{stub_port}")
+    panel = AsyncHTTPServer(root=str(ROOT), log_requests=False)
+    panel.add_route("/api/", OllamaProxy(
+        pool, cache=cache, singleflight=singleflight, scheduler=scheduler, response_cache=response_cache, metrics=metrics
+    ).handle)
+    panel_task, panel_port = await serve_app(panel)
+    return stub, pool, panel_port, (panel_task, stub_task)
+
+
+def test_stream_is_not_buffered():
+    async def run():
+        _, _, port, tasks = await _setup()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        body = json.dumps({"model": "qwen2.5:0.5b", "messages": [{"role": "user", "content": "hi"}]}).encode()
+        t0 = time.perf_counter()
+        writer.write(b"POST /api/chat HTTP/1.1\r\nHost: x\r\nContent-Type: application/json\r\n"
+                     b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+        head = await reader.readuntil(b"\r\n\r\n")
+        assert b"200" in head.split(b"\r\n")[0]
+        assert b"chunked" in head.lower()
+        size = int(await reader.readuntil(b"\r\n"), 16)
+        first = json.loads(await reader.readexactly(size))
+        # 第一个 token 必须在上游结束（3 * TOKEN_DELAY）之前到达
+        assert time.perf_counter() - t0 < 2 * TOKEN_DELAY
+        assert first["message"]["content"] == "你好"
+        writer.close()
+        await stop_tasks(*tasks)
+
+    asyncio.run(run())
+
+
+def test_upstream_connection_is_reused():
+    async def run():
+        _, pool, port, tasks = await _setup()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for _ in range(3):
+            writer.write(b"GET /api/tags HTTP/1.1\r\nHost: x\r\n\r\n")
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int([l for l in head.split(b"\r\n") if l.lower().startswith(b"content-length")][0].split(b":")[1])
+            data = json.loads(await reader.readexactly(length))
+            assert data["models"][0]["name"] == "qwen2.5:0.5b"
+        assert pool.opened == 1
+        assert pool.reused == 2
+        writer.close()
+        await stop_tasks(*tasks)
+
+    asyncio.run(run())
+
+
+async def _get(reader, writer, raw: bytes):
+    writer.write(raw)
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+    headers = dict(l.lower().split(": ", 1) for l in head.split("\r\n")[1:] if ": " in l)
+    body = await reader.readexactly(int(headers.get("content-length", "0")))
+    return int(head.split()[1]), headers, body
+
+
+def test_tags_cache_etag_and_invalidation():
+    async def run():
+        stub, _, port, tasks = await _setup(cache=ApiCache(ttl=60))
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        status, headers, _ = await _get(reader, writer, b"GET /api/tags HTTP/1.1\r\nHost: x\r\n\r\n")
+        assert status == 200 and headers["x-panel-cache"] == "miss"
+        etag = headers["etag"]
+        raw = b"GET /api/tags HTTP/1.1\r\nHost: x\r\nIf-None-Match: %s\r\n\r\n" % etag.encode()
+        status, headers, _ = await _get(reader, writer, raw)
+        assert status == 304
+        assert stub.calls["/api/tags"] == 1
+        # 删除模型后缓存立即失效
+        body = b'{"name":"qwen2.5:0.5b"}'
+        await _get(reader, writer, b"DELETE /api/delete HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n%s"
+                   % (len(body), body))
+        status, headers, _ = await _get(reader, writer, b"GET /api/tags HTTP/1.1\r\nHost: x\r\n\r\n")
+        assert status == 200 and headers["x-panel-cache"] == "miss"
+        assert stub.calls["/api/tags"] == 2
+        writer.close()
+        await stop_tasks(*tasks)
+
+    asyncio.run(run())
+
+
+def test_identical_show_requests_are_coalesced():
+    async def run():
+        sf = SingleFlight()
+        stub, _, port, tasks = await _setup(cache=ApiCache(ttl=0), singleflight=sf)
+
+        async def show(body: bytes):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            raw = b"POST /api/show HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+            status, _, data = await _get(reader, writer, raw)
+            writer.close()
+            return status, data
+
+        # 字段顺序不同但语义相同的请求体也应合并
+        bodies = [b'{"name":"qwen2.5:0.5b","verbose":false}', b'{"verbose": false, "name": "qwen2.5:0.5b"}'] * 5
+        results = await asyncio.gather(*(show(b) for b in bodies))
+        assert all(status == 200 for status, _ in results)
+        assert stub.calls["/api/show"] == 1
+        assert sf.leaders == 1 and sf.coalesced == 9
+        await stop_tasks(*tasks)
+
+    asyncio.run(run())
+
+
+async def _read_chunks(reader):
+    lines = []
+    while True:
+        size = int(await reader.readuntil(b"\r\n"), 16)
+        if size == 0:
+            await reader.readuntil(b"\r\n")
+            return lines
+        lines.extend(json.loads(l) for l in (await reader.readexactly(size + 2))[:-2].splitlines() if l)
+
+
+def test_scheduler_queues_and_reports_position():
+    async def run():
+        sched = Scheduler(global_limit=1, per_model_limit=1, max_queue=1)
+        _, _, port, tasks = await _setup(scheduler=sched)
+        body = json.dumps({"model": "qwen2.5:0.5b", "messages": [{"role": "user", "content": "hi"}]}).encode()
+        raw = b"POST /api/chat HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+
+        async def chat():
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(raw)
+            head = await reader.readuntil(b"\r\n\r\n")
+            status = int(head.split()[1])
+            lines = await _read_chunks(reader) if status == 200 else []
+            writer.close()
+            return status, lines
+
+        first = asyncio.ensure_future(chat())
+        await asyncio.sleep(0.02)
+        second = asyncio.ensure_future(chat())
+        await asyncio.sleep(0.02)
+        third = await chat()  # 队列容量 1：第三个请求直接 503
+        assert third[0] == 503
+
+        (s1, l1), (s2, l2) = await asyncio.gather(first, second)
+        assert s1 == 200 and "panel_queue" not in l1[0]
+        assert s2 == 200 and l2[0]["panel_queue"]["position"] == 1
+        assert l2[1]["panel_queue"]["position"] == 0 and l2[1]["panel_queue"]["wait_ms"] >= 2 * TOKEN_DELAY * 1000
+        assert l2[-1]["done"] is True
+        assert sched.running == 0 and sched.queued == 0 and sched.rejected_total == 1
+        await stop_tasks(*tasks)
+
+    asyncio.run(run())
+
+
+def test_deterministic_chat_is_replayed_from_disk():
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            rc = ResponseCache(tmp)
+            stub, _, port, tasks = await _setup(cache=ApiCache(ttl=60), response_cache=rc)
+
+            async def chat(options):
+                body = json.dumps({"model": "qwen2.5:0.5b", "messages": [{"role": "user", "content": "hi"}],
+                                   "options": options}).encode()
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(b"POST /api/chat HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+                head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").lower()
+                lines = await _read_chunks(reader)
+                writer.close()
+                return head, lines
+
+            head, first = await chat({"temperature": 0})
+            assert "x-panel-response-cache: miss" in head
+            t0 = time.perf_counter()
+            head, replay = await chat({"temperature": 0})
+            assert "x-panel-response-cache: hit" in head
+            assert replay == first and time.perf_counter() - t0 < TOKEN_DELAY
+            assert stub.calls["/api/chat"] == 1
+
+            # 未固定 temperature/seed：不查也不写缓存
+            head, _ = await chat({"temperature": 0.8})
+            assert "x-panel-response-cache" not in head
+            assert stub.calls["/api/chat"] == 2
+            assert rc.stats()["entries"] == 1 and rc.skipped == 1
+
+            # 重启后从磁盘重建索引
+            assert ResponseCache(tmp).stats()["entries"] == 1
+            await stop_tasks(*tasks)
+
+    asyncio.run(run())
+
+
+def _metric(text, name):
+    return float(next(l for l in text.splitlines() if l.startswith(name + " ")).split()[-1])
+
+
+def test_generation_metrics_from_final_record():
+    async def run():
+        metrics = Metrics()
+        _, pool, port, tasks = await _setup(metrics=metrics)
+        metrics.add_stats("upstream_pool", pool.stats)
+        body = json.dumps({"model": "qwen2.5:0.5b", "messages": [{"role": "user", "content": "hi"}]}).encode()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"POST /api/chat HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+        await reader.readuntil(b"\r\n\r\n")
+        final = (await _read_chunks(reader))[-1]
+        writer.close()
+
+        text = metrics.render()
+        assert 'panel_generation_requests_total{model="qwen2.5:0.5b",status="200"} 1' in text
+        assert 'panel_generation_inflight{model="qwen2.5:0.5b"} 0' in text
+        # 速度取自最终记录：eval 约 3 token / 0.3s = 10 tok/s；prompt 按 ttft 处理完
+        eval_rate = _metric(text, 'panel_eval_tokens_per_second_sum{model="qwen2.5:0.5b"}')
+        assert abs(eval_rate - final["eval_count"] / (final["eval_duration"] / 1e9)) < 0.01 and 8 < eval_rate <= 10
+        prompt_rate = _metric(text, 'panel_prompt_eval_tokens_per_second_sum{model="qwen2.5:0.5b"}')
+        assert abs(prompt_rate - final["prompt_eval_count"] / 0.02) < 0.01
+        assert 'panel_time_to_first_token_seconds_bucket{model="qwen2.5:0.5b",le="0.25"} 1' in text
+        assert "panel_upstream_pool_opened 1" in text
+        await stop_tasks(*tasks)
+
+    asyncio.run(run())
+
+
+def test_pull_manager_dedupes_retries_and_fans_out():
+    async def run():
+        stub = make_stub(drop_rate=1.0)  # 第一次下载中途断线
+        stub_task, stub_port = await serve_app(stub.app)
+        cache = ApiCache(ttl=60)
+        proxy = OllamaProxy(UpstreamPool(f"http://127.0.0.1:{stub_port}"), cache=cache)
+        with tempfile.TemporaryDirectory() as tmp:
+            pulls = PullManager(proxy, str(Path(tmp) / "pulls.json"), retry_delay=0.2)
+            panel = AsyncHTTPServer(root=str(ROOT), log_requests=False)
+            pulls.install(panel)
+            panel_task, port = await serve_app(panel)
+
+            async def post():
+                body = b'{"model":"qwen2.5:0.5b"}'
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                status, _, data = await _get(reader, writer, b"POST /panel/pulls HTTP/1.1\r\nHost: x\r\n"
+                                             b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+                writer.close()
+                return json.loads(data)
+
+            async def subscribe():
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(b"GET /panel/pulls/events?model=qwen2.5:0.5b HTTP/1.1\r\nHost: x\r\n\r\n")
+                head = await reader.readuntil(b"\r\n\r\n")
+                assert b"text/event-stream" in head
+                events = []
+                while not events or not events[-1].get("done"):
+                    size = int(await reader.readuntil(b"\r\n"), 16)
+                    data = (await reader.readexactly(size + 2))[:-2]
+                    if data.startswith(b"data: "):
+                        events.append(json.loads(data[6:]))
+                writer.close()
+                return events
+
+            first, second = await post(), await post()
+            assert first["created"] is True and second["created"] is False
+            # 订阅后浏览器断开，不影响拉取
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /panel/pulls/events?model=qwen2.5:0.5b HTTP/1.1\r\nHost: x\r\n\r\n")
+            writer.close()
+
+            subscribers = asyncio.gather(subscribe(), subscribe())
+            job = pulls.jobs["qwen2.5:0.5b"]
+            while not job.last.get("retrying"):
+                await asyncio.sleep(0.01)
+            stub.config.drop_rate = 0.0
+            for events in await subscribers:
+                assert events[-1] == {"status": "success", "error": None, "done": True}
+                assert any(e.get("retrying") for e in events)
+                assert any(e.get("total") and e.get("completed") == e["total"] for e in events)
+            assert stub.calls["/api/pull"] == 2  # 断线后重试一次，两次 POST 只拉取一次
+            assert pulls.stats()["deduplicated"] == 1
+            assert cache.invalidations == 1
+            assert json.load(open(Path(tmp) / "pulls.json"))["pending"] == []
+            await stop_tasks(panel_task, stub_task)
+
+    asyncio.run(run())
+
+
+def test_pull_manager_retries_in_stream_errors():
+    async def run():
+        stub = make_stub(pull_delay=0.01, pull_error_rate=1.0)
+        stub_task, stub_port = await serve_app(stub.app)
+        proxy = OllamaProxy(UpstreamPool(f"http://127.0.0.1:{stub_port}"))
+        with tempfile.TemporaryDirectory() as tmp:
+            pulls = PullManager(proxy, str(Path(tmp) / "pulls.json"), max_attempts=3, retry_delay=0.2)
+            job = pulls.start("qwen2.5:0.5b")
+            while not job.last.get("retrying"):
+                await asyncio.sleep(0.01)
+            # 流里的 {"error": ...} 与断线一样按间隔重试，而不是直接判定失败
+            assert "max retries exceeded" in job.last["error"] and not job.done
+            stub.config.pull_error_rate = 0.0
+            await job.task
+            assert job.status == "success" and job.attempts == 2 and stub.calls["/api/pull"] == 2
+
+            stub.config.pull_error_rate = 1.0
+            job = pulls.start("linzhi-lora")
+            await job.task
+            assert job.status == "error" and job.attempts == 3 and "max retries exceeded" in job.error
+            await pulls.close()
+        await stop_tasks(stub_task)
+
+    asyncio.run(run())
+
+
+def test_arena_streams_models_concurrently():
+    async def run():
+        stub_task, stub_port = await serve_app(make_stub().app)
+        proxy = OllamaProxy(UpstreamPool(f"http://127.0.0.1:{stub_port}"), scheduler=Scheduler())
+        panel = AsyncHTTPServer(root=str(ROOT), log_requests=False)
+        Arena(proxy, max_concurrency=2).install(panel)
+        panel_task, port = await serve_app(panel)
+
+        body = json.dumps({"models": ["linzhi-lora", "qwen2.5:0.5b"], "messages": [{"role": "user", "content": "hi"}]}).encode()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        t0 = time.perf_counter()
+        writer.write(b"POST /panel/arena HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+        await reader.readuntil(b"\r\n\r\n")
+        lines = await _read_chunks(reader)
+        elapsed = time.perf_counter() - t0
+        writer.close()
+
+        tags = [l["arena"]["model"] for l in lines if "arena" in l]
+        # 两个模型交错到达，总耗时接近单个模型而不是两倍
+        assert tags.index("qwen2.5:0.5b") < len(tags) - tags[::-1].index("linzhi-lora") - 1
+        assert elapsed < 5 * TOKEN_DELAY
+        summary = lines[-1]["arena_summary"]
+        assert lines[-1]["done"] is True and set(summary) == {"linzhi-lora", "qwen2.5:0.5b"}
+        for stats in summary.values():
+            assert stats["status"] == "ok" and stats["ttft_ms"] < stats["total_ms"]
+            assert 8 < stats["eval_tokens_per_sec"] <= 10
+        await stop_tasks(panel_task, stub_task)
+
+    asyncio.run(run())
+
+
+def test_arena_disconnect_while_loading_cancels_upstream():
+    async def run():
+        stub = make_stub(load_delay=1.0)
+        stub_task, stub_port = await serve_app(stub.app)
+        pool = UpstreamPool(f"http://127.0.0.1:{stub_port}")
+        panel = AsyncHTTPServer(root=str(ROOT), log_requests=False)
+        Arena(OllamaProxy(pool), max_concurrency=2).install(panel)
+        panel_task, port = await serve_app(panel)
+
+        body = json.dumps({"models": ["qwen2.5:0.5b", "linzhi-lora"], "messages": [{"role": "user", "content": "hi"}]}).encode()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"POST /panel/arena HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+        await reader.readuntil(b"\r\n\r\n")
+        await asyncio.sleep(0.1)
+        assert pool.in_use == 2
+        writer.close()
+        # 模型还在加载、没有任何输出可写，也要在加载结束前发现断开并释放上游连接
+        await asyncio.sleep(0.5)
+        assert pool.in_use == 0
+        await asyncio.sleep(0.8)
+        assert stub.cancelled == 2
+        await stop_tasks(panel_task, stub_task)
+
+    asyncio.run(run())
+
+
+def test_agent_index_fetches_in_parallel_and_caches_by_digest():
+    async def run():
+        stub = make_stub()
+        stub_task, stub_port = await serve_app(stub.app)
+        proxy = OllamaProxy(UpstreamPool(f"http://127.0.0.1:{stub_port}"))
+        panel = AsyncHTTPServer(root=str(ROOT), log_requests=False)
+        index = AgentIndex(proxy)
+        index.install(panel)
+        panel_task, port = await serve_app(panel)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+        before = stub.calls.get("/api/show", 0)
+        t0 = time.perf_counter()
+        status, _, data = await _get(reader, writer, b"GET /panel/agents HTTP/1.1\r\nHost: x\r\n\r\n")
+        # 两个 /api/show 并发进行，总耗时约一次而不是两次
+        assert status == 200 and time.perf_counter() - t0 < 1.8 * TOKEN_DELAY
+        agents = {a["name"]: a for a in json.loads(data)["agents"]}
+        lora = agents["linzhi-lora:latest"]
+        assert lora["base_model"] == "qwen2.5:0.5b" and lora["system"] == "你是林知。"
+        assert lora["parameters"] == {"temperature": 0.3, "stop": "<|im_end|>"}
+        assert stub.calls.get("/api/show", 0) - before == 2
+
+        status, _, _ = await _get(reader, writer, b"GET /panel/agents HTTP/1.1\r\nHost: x\r\n\r\n")
+        assert status == 200 and stub.calls.get("/api/show", 0) - before == 2
+        assert index.stats()["hits"] == 2
+        writer.close()
+        await stop_tasks(panel_task, stub_task)
+
+    asyncio.run(run())
+
+
+def test_client_disconnect_aborts_upstream_generation():
+    async def run():
+        metrics = Metrics()
+        stub, _, port, tasks = await _setup(metrics=metrics)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        body = json.dumps({"model": "qwen2.5:0.5b", "prompt": "hi", "options": {"num_predict": 200}}).encode()
+        writer.write(b"POST /api/generate HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+        await reader.readuntil(b"\r\n\r\n")
+        for _ in range(3):
+            size = int(await reader.readuntil(b"\r\n"), 16)
+            await reader.readexactly(size + 2)
+        writer.close()
+        # 上游应在断开后很快停下，而不是把 200 个 token 生成完（约 20 秒）
+        for _ in range(40):
+            if stub.cancelled:
+                break
+            await asyncio.sleep(0.05)
+        assert stub.cancelled == 1 and stub.active == 0
+        text = metrics.render()
+        assert 'panel_generation_aborted_total{model="qwen2.5:0.5b"} 1' in text
+        assert 'panel_generation_requests_total{model="qwen2.5:0.5b",status="cancelled"} 1' in text
+        reclaimed = [l for l in text.splitlines() if l.startswith("panel_generation_reclaimed_seconds_total{")]
+        assert reclaimed and float(reclaimed[0].split()[-1]) > 0
+        await stop_tasks(*tasks)
+
+    asyncio.run(run())
+
+
+def test_upstream_down_returns_502():
+    async def run():
+        sock = create_listen_socket("127.0.0.1", 0)
+        dead_port = sock.getsockname()[1]
+        sock.close()
+        panel = AsyncHTTPServer(root=str(ROOT), log_requests=False)
+        panel.add_route("/api/", OllamaProxy(UpstreamPool(f"http://127.0.0.1:{dead_port}")).handle)
+        task, port = await serve_app(panel)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /api/tags HTTP/1.1\r\nHost: x\r\n\r\n")
+        head = await reader.readuntil(b"\r\n\r\n")
+        assert b" 502 " in head.split(b"\r\n")[0]
+        writer.close()
+        await stop_tasks(task)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_stream_is_not_buffered()
+    test_upstream_connection_is_reused()
+    test_tags_cache_etag_and_invalidation()
+    test_identical_show_requests_are_coalesced()
+    test_scheduler_queues_and_reports_position()
+    test_deterministic_chat_is_replayed_from_disk()
+    test_generation_metrics_from_final_record()
+    test_pull_manager_dedupes_retries_and_fans_out()
+    test_pull_manager_retries_in_stream_errors()
+    test_arena_streams_models_concurrently()
+    test_arena_disconnect_while_loading_cancels_upstream()
+    test_agent_index_fetches_in_parallel_and_caches_by_digest()
+    test_client_disconnect_aborts_upstream_generation()
+    test_upstream_down_returns_502()
+    print("✅ 全部通过")
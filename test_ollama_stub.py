@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+测试离线 Ollama 桩与压测工具 - 冷加载/TTFT/生成速度、故障注入、经面板代理的并发会话统计
+"""
+
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from async_server import AsyncHTTPServer
+from conftest import serve_app, stop_tasks
+from loadtest import run_load
+from ollama_proxy import OllamaProxy, UpstreamPool
+from ollama_stub import OllamaStub, StubConfig
+from scheduler import Scheduler
+
+ROOT = Path(__file__).parent
+
+
+async def _panel(stub: OllamaStub, scheduler=None):
+    stub_task, stub_port = await serve_app(stub.app)
+    panel = AsyncHTTPServer(root=str(ROOT), log_requests=False)
+    panel.add_route("/api/", OllamaProxy(UpstreamPool(f"http://127.0.0.1:{stub_port}"), scheduler=scheduler).handle)
+    panel_task, panel_port = await serve_app(panel)
+    return f"http://127.0.0.1:{panel_port}", (panel_task, stub_task)
+
+
+def test_cold_load_ttft_and_final_record():
+    async def run():
+        stub = OllamaStub(StubConfig(load_delay=0.2, ttft=0.05, tokens_per_sec=100, response_tokens=10))
+        url, tasks = await _panel(stub)
+        first = await run_load(url, "qwen2.5:0.5b", sessions=1, turns=1)
+        second = await run_load(url, "qwen2.5:0.5b", sessions=1, turns=1)
+        cold, warm = first.turns[0], second.turns[0]
+        assert cold.ok and warm.ok and cold.tokens == warm.tokens == 10
+        # 第一次包含冷加载，第二次只有 TTFT
+        assert cold.ttft >= 0.25 and warm.ttft < 0.2
+        assert 0.14 <= warm.latency < 0.5  # TTFT 50ms + 10 个 token × 10ms
+        assert stub.stats()["loaded"] == ["qwen2.5:0.5b"]
+        await stop_tasks(*tasks)
+
+    asyncio.run(run())
+
+
+def test_failure_injection_is_counted():
+    async def run():
+        stub = OllamaStub(StubConfig(load_delay=0, ttft=0, tokens_per_sec=0, error_rate=0.5, seed=1))
+        url, tasks = await _panel(stub)
+        report = await run_load(url, "qwen2.5:0.5b", sessions=4, turns=5)
+        summary = report.summary()
+        assert summary["requests"] == 20
+        assert 0 < summary["ok"] < 20 and summary["errors"].get("HTTP 500", 0) == 20 - summary["ok"]
+        await stop_tasks(*tasks)
+
+    asyncio.run(run())
+
+
+def test_concurrent_sessions_through_scheduler():
+    async def run():
+        stub = OllamaStub(StubConfig(load_delay=0, ttft=0.02, tokens_per_sec=200, response_tokens=10, parallel=2))
+        url, tasks = await _panel(stub, scheduler=Scheduler(global_limit=2, per_model_limit=2))
+        t0 = time.perf_counter()
+        report = await run_load(url, "qwen2.5:0.5b", sessions=6, turns=2)
+        summary = report.summary()
+        assert summary["ok"] == 12 and not summary["errors"]
+        assert stub.max_active == 2  # 调度器把同时进入上游的请求限制在 2 个
+        assert summary["ttft_ms_p50"] <= summary["ttft_ms_p99"] <= summary["latency_ms_p99"]
+        assert summary["queue_wait_ms_p90"] is not None and summary["tokens_per_sec"] > 0
+        assert time.perf_counter() - t0 < 5
+        await stop_tasks(*tasks)
+
+    asyncio.run(run())
+
+
+def test_create_and_show_round_trip():
+    async def run():
+        stub = OllamaStub(StubConfig(load_delay=0))
+        task, port = await serve_app(stub.app)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+        async def post(path, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode()
+            writer.write(b"POST %s HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n%s" % (path.encode(), len(body), body))
+            head = await reader.readuntil(b"\r\n\r\n")
+            headers = dict(l.split(": ", 1) for l in head.decode().split("\r\n")[1:] if ": " in l)
+            if "Content-Length" in headers:
+                return json.loads(await reader.readexactly(int(headers["Content-Length"])))
+            data = b""
+            while True:
+                size = int(await reader.readuntil(b"\r\n"), 16)
+                chunk = await reader.readexactly(size + 2)
+                if size == 0:
+                    return [json.loads(l) for l in data.splitlines() if l.strip()]
+                data += chunk[:-2]
+
+        events = await post("/api/create", {"model": "linzhi", "from": "qwen2.5:0.5b", "system": "你是林知。",
+                                             "parameters": {"temperature": 0.3}})
+        assert events[-1]["status"] == "success"
+        show = await post("/api/show", {"name": "linzhi"})
+        assert show["system"] == "你是林知。" and show["details"]["parent_model"] == "qwen2.5:0.5b"
+        assert "temperature" in show["parameters"]
+        writer.close()
+        await stop_tasks(task)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_cold_load_ttft_and_final_record()
+    test_failure_injection_is_counted()
+    test_concurrent_sessions_through_scheduler()
+    test_create_and_show_round_trip()
+    print("✅ 全部通过")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+测试生成请求调度 - 用户间轮转、同模型批处理、队满拒绝
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from scheduler import QueueFull, Scheduler
+
+
+def test_round_robin_and_batching():
+    sched = Scheduler(global_limit=1, per_model_limit=1, max_queue=8, batch_limit=2)
+    running = sched.submit("a", "alice")
+    assert running.admitted
+
+    # alice 连发三条，bob 后到一条：bob 不应排在 alice 的全部请求之后
+    queued = [sched.submit("a", "alice") for _ in range(3)] + [sched.submit("a", "bob")]
+    other = sched.submit("b", "carol")
+    assert [t.position for t in queued] == [1, 2, 3, 4]
+
+    order = []
+    current = running
+    while True:
+        sched.release(current)
+        nxt = [t for t in queued + [other] if t.admitted and not t.released]
+        if not nxt:
+            break
+        current = nxt[0]
+        order.append((current.model, current.user))
+
+    # 模型 a 连续放行到 batch_limit 后切到 b，再回到 a；a 内部 alice/bob 轮转
+    assert order == [("a", "alice"), ("b", "carol"), ("a", "bob"), ("a", "alice"), ("a", "alice")]
+    assert sched.running == 0 and sched.queued == 0
+
+
+def test_queue_full_and_cancel():
+    sched = Scheduler(global_limit=1, per_model_limit=1, max_queue=1)
+    first = sched.submit("a", "u")
+    waiting = sched.submit("a", "u")
+    try:
+        sched.submit("a", "u")
+        assert False, "应当抛出 QueueFull"
+    except QueueFull:
+        pass
+    # 排队中的请求放弃后不占位
+    sched.release(waiting)
+    assert sched.queued == 0
+    sched.release(first)
+    assert sched.running == 0 and not waiting.admitted
+
+
+if __name__ == "__main__":
+    test_round_robin_and_batching()
+    test_queue_full_and_cancel()
+    print("✅ 全部通过")
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+测试会话上下文复用 - 首轮与后续轮次改走 /api/generate 并带 context，响应转换成 /api/chat 格式，
+历史被修改、换模型、状态丢失时回退到完整历史，并用模型模板重新播种 context
+"""
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from async_server import AsyncHTTPServer
+from conftest import serve_app, stop_tasks
+from ollama_proxy import OllamaProxy, UpstreamPool
+from ollama_stub import OllamaStub, StubConfig
+from session_context import RAW_PROMPT_TEMPLATE, SessionContexts, render_history
+
+ROOT = Path(__file__).parent
+
+
+async def _chat(port, model, messages, stream=True, session="s1"):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps({"model": model, "messages": messages, "stream": stream}, ensure_ascii=False).encode()
+    writer.write(b"POST /api/chat HTTP/1.1\r\nHost: x\r\nConnection: close\r\nX-Panel-Session: %s\r\n"
+                 b"Content-Length: %d\r\n\r\n%s" % (session.encode(), len(body), body))
+    raw = await reader.read()
+    writer.close()
+    head, data = raw.split(b"\r\n\r\n", 1)
+    headers = dict(l.split(": ", 1) for l in head.decode().split("\r\n")[1:] if ": " in l)
+    if headers.get("Transfer-Encoding") == "chunked":
+        body, rest = b"", data
+        while True:
+            size_line, rest = rest.split(b"\r\n", 1)
+            size = int(size_line, 16)
+            if size == 0:
+                break
+            body, rest = body + rest[:size], rest[size + 2:]
+        data = body
+    records = [json.loads(l) for l in data.splitlines() if l.strip()]
+    reply = "".join(r["message"]["content"] for r in records if "message" in r)
+    return headers, records, reply
+
+
+def test_context_is_reused_and_falls_back_on_edit():
+    async def run():
+        stub = OllamaStub(StubConfig(models=["qwen2.5:0.5b", "qwen2.5:7b"], load_delay=0, ttft=0, tokens_per_sec=0,
+                                     response_tokens=5))
+        stub_task, stub_port = await serve_app(stub.app)
+        sessions = SessionContexts()
+        panel = AsyncHTTPServer(root=str(ROOT), log_requests=False)
+        panel.add_route("/api/", OllamaProxy(UpstreamPool(f"http://127.0.0.1:{stub_port}"), sessions=sessions).handle)
+        panel_task, port = await serve_app(panel)
+
+        history = [{"role": "user", "content": "你好，介绍一下你自己" * 5}]
+        headers, records, reply = await _chat(port, "qwen2.5:0.5b", history)
+        assert headers["X-Panel-Session"] == "start"
+        assert stub.received[-1][0] == "/api/generate" and "context" not in stub.received[-1][1]
+        assert records[-1]["done"] and "context" not in records[-1] and reply
+
+        # 第二轮：只发新消息 + context，Ollama 只处理新增的 prompt
+        history += [{"role": "assistant", "content": reply}, {"role": "user", "content": "再说说你的爱好"}]
+        headers, records, reply = await _chat(port, "qwen2.5:0.5b", history)
+        path, sent = stub.received[-1]
+        assert headers["X-Panel-Session"] == "context" and path == "/api/generate"
+        assert sent["prompt"] == "再说说你的爱好" and len(sent["context"]) > 0
+        report = records[-1]["panel_session"]
+        assert report["mode"] == "context" and report["saved_prompt_tokens"] == len(sent["context"])
+        assert report["prompt_eval_count"] < report["saved_prompt_tokens"]
+
+        # 非流式同样转换成 chat 格式
+        history += [{"role": "assistant", "content": reply}, {"role": "user", "content": "第三个问题"}]
+        headers, records, reply = await _chat(port, "qwen2.5:0.5b", history, stream=False)
+        assert headers["X-Panel-Session"] == "context" and len(records) == 1 and reply
+
+        # 修改了历史：回退到完整历史，按模型模板渲染后走 /api/generate 重新拿到 context
+        history[1] = {"role": "assistant", "content": "被编辑过的回复"}
+        history += [{"role": "assistant", "content": reply}, {"role": "user", "content": "第四个问题"}]
+        headers, _, reply = await _chat(port, "qwen2.5:0.5b", history)
+        path, sent = stub.received[-1]
+        assert headers["X-Panel-Session"] == "fallback; reason=edit; reseed" and reply
+        assert path == "/api/generate" and sent["template"] == RAW_PROMPT_TEMPLATE and "context" not in sent
+        assert "被编辑过的回复" in sent["prompt"] and sent["prompt"].endswith("第四个问题<|im_end|>\n<|im_start|>assistant\n")
+        # 下一轮重新走 context
+        history += [{"role": "assistant", "content": reply}, {"role": "user", "content": "第五个问题"}]
+        headers, _, reply = await _chat(port, "qwen2.5:0.5b", history)
+        assert headers["X-Panel-Session"] == "context" and stub.received[-1][1]["prompt"] == "第五个问题"
+
+        # 服务重启 / 页面重新加载后的会话同样重新播种，而不是一直回退
+        headers, _, _ = await _chat(port, "qwen2.5:0.5b", history, session="reloaded")
+        assert headers["X-Panel-Session"] == "fallback; reason=evicted; reseed"
+
+        # 换模型
+        fresh = [{"role": "user", "content": "你好"}]
+        _, _, reply = await _chat(port, "qwen2.5:0.5b", fresh, session="s2")
+        headers, _, reply = await _chat(port, "qwen2.5:7b", fresh + [{"role": "assistant", "content": reply},
+                                                                       {"role": "user", "content": "继续"}], session="s2")
+        assert headers["X-Panel-Session"] == "fallback; reason=model; reseed"
+
+        stats = sessions.stats()
+        assert stats["turns_context"] == 3 and stats["turns_start"] == 2 and stats["saved_prompt_tokens"] > 0
+        assert stats["fallback_reasons"] == {"edit": 1, "evicted": 1, "model": 1} and stats["reseeds"] == 3
+        await stop_tasks(panel_task, stub_task)
+
+    asyncio.run(run())
+
+
+def test_render_history_matches_ollama_chat_prompt():
+    from ollama_stub import DEFAULT_TEMPLATE
+
+    messages = [{"role": "user", "content": "U1"}, {"role": "assistant", "content": "A1"}, {"role": "user", "content": "U2"}]
+    expected = ("<|im_start|>system\nS<|im_end|>\n<|im_start|>user\nU1<|im_end|>\n<|im_start|>assistant\nA1<|im_end|>\n"
+                "<|im_start|>user\nU2<|im_end|>\n<|im_start|>assistant\n")
+    assert render_history(DEFAULT_TEMPLATE, messages, default_system="S") == expected
+    # 旧式模板（只有 .System / .Prompt / .Response）逐轮渲染，最后一轮停在 .Response 之前
+    legacy = "{{ if .System }}[S]{{ .System }}{{ end }}[U]{{ .Prompt }}[A]{{ .Response }}{{ if .Response }}[E]{{ end }}"
+    assert render_history(legacy, [{"role": "system", "content": "s"}] + messages) == "[S]s[U]U1[A]A1[E][U]U2[A]"
+    assert render_history("{{ template \"x\" }}", messages) is None
+
+
+def test_reseed_includes_modelfile_messages():
+    async def run():
+        modelfile = 'FROM qwen2.5:0.5b\nSYSTEM 你是林知。\nMESSAGE user 你是谁？\nMESSAGE assistant 我是林知。\n'
+        stub = OllamaStub(StubConfig(models=["qwen2.5:0.5b"], modelfiles={"linzhi-lora:latest": modelfile},
+                                     load_delay=0, ttft=0, tokens_per_sec=0, response_tokens=3))
+        stub_task, stub_port = await serve_app(stub.app)
+        panel = AsyncHTTPServer(root=str(ROOT), log_requests=False)
+        panel.add_route("/api/", OllamaProxy(UpstreamPool(f"http://127.0.0.1:{stub_port}"), sessions=SessionContexts()).handle)
+        panel_task, port = await serve_app(panel)
+
+        history = [{"role": "user", "content": "U1"}, {"role": "assistant", "content": "A1"}, {"role": "user", "content": "U2"}]
+        headers, _, _ = await _chat(port, "linzhi-lora", history)
+        assert headers["X-Panel-Session"] == "fallback; reason=evicted; reseed"
+        # 与 /api/chat 相同：默认 SYSTEM 之后先是 Modelfile 的 MESSAGE 示例，再是对话历史
+        assert stub.received[-1][1]["prompt"] == (
+            "<|im_start|>system\n你是林知。<|im_end|>\n<|im_start|>user\n你是谁？<|im_end|>\n"
+            "<|im_start|>assistant\n我是林知。<|im_end|>\n<|im_start|>user\nU1<|im_end|>\n"
+            "<|im_start|>assistant\nA1<|im_end|>\n<|im_start|>user\nU2<|im_end|>\n<|im_start|>assistant\n"
+        )
+        await stop_tasks(panel_task, stub_task)
+
+    asyncio.run(run())
+
+
+def test_requests_without_session_header_are_untouched():
+    sessions = SessionContexts()
+
+    class Req:
+        headers = {}
+
+    assert sessions.plan(Req(), {"model": "m", "messages": [{"role": "user", "content": "hi"}]}) is None
+
+
+if __name__ == "__main__":
+    test_context_is_reused_and_falls_back_on_edit()
+    test_render_history_matches_ollama_chat_prompt()
+    test_reseed_includes_modelfile_messages()
+    test_requests_without_session_header_are_untouched()
+    print("✅ 全部通过")
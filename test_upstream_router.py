@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+测试多节点路由 - 合并 /api/tags、按已加载模型亲和、在途请求最少优先、故障节点摘除与重试
+"""
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from async_server import AsyncHTTPServer, create_listen_socket
+from conftest import serve_app, stop_tasks
+from ollama_proxy import OllamaProxy
+from ollama_stub import OllamaStub, StubConfig
+from upstream_router import UpstreamRouter
+
+ROOT = Path(__file__).parent
+
+
+async def _call(port, method, path, payload=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode() if payload is not None else b""
+    writer.write(b"%s %s HTTP/1.1\r\nHost: x\r\nConnection: close\r\nContent-Length: %d\r\n\r\n%s"
+                 % (method.encode(), path.encode(), len(body), body))
+    raw = await reader.read()
+    writer.close()
+    head, data = raw.split(b"\r\n\r\n", 1)
+    lines = head.decode().split("\r\n")
+    headers = dict(l.split(": ", 1) for l in lines[1:] if ": " in l)
+    return int(lines[0].split()[1]), headers, data
+
+
+def test_routes_by_affinity_and_load_and_ejects_dead_nodes():
+    async def run():
+        config = dict(load_delay=0, ttft=0, tokens_per_sec=50, response_tokens=10)
+        stub_a = OllamaStub(StubConfig(models=["m1:latest", "m2:latest"], **config))
+        stub_b = OllamaStub(StubConfig(models=["m1:latest", "m2:latest", "m3:latest"], **config))
+        task_a, port_a = await serve_app(stub_a.app)
+        task_b, port_b = await serve_app(stub_b.app)
+        sock = create_listen_socket("127.0.0.1", 0)
+        dead_port = sock.getsockname()[1]
+        sock.close()
+        url_a, url_b = f"http://127.0.0.1:{port_a}", f"http://127.0.0.1:{port_b}"
+
+        router = UpstreamRouter([f"http://127.0.0.1:{dead_port}", url_a, url_b], interval=3600, fail_threshold=2)
+        await router.refresh()
+        await router.refresh()
+        dead = router.nodes[0]
+        assert not dead.healthy and dead.ejections == 1 and router.stats()["healthy"] == 2
+
+        panel = AsyncHTTPServer(root=str(ROOT), log_requests=False)
+        panel.add_route("/api/", OllamaProxy(router).handle)
+        panel_task, port = await serve_app(panel)
+
+        # 合并各节点的模型列表，同名模型只列一次
+        status, _, data = await _call(port, "GET", "/api/tags")
+        names = [m["name"] for m in json.loads(data)["models"]]
+        assert status == 200 and sorted(names) == ["m1:latest", "m2:latest", "m3:latest"]
+
+        # 只有 B 有 m3
+        _, headers, _ = await _call(port, "POST", "/api/chat", {"model": "m3", "messages": [], "stream": False})
+        assert headers["X-Panel-Upstream"] == url_b
+
+        # 都没加载 m1：B 刚处理完 m3 但已空闲，在途相同按节点顺序选 A；A 忙时 m2 落到空闲的 B
+        chat = {"messages": [{"role": "user", "content": "hi"}], "stream": False}
+        slow = asyncio.ensure_future(_call(port, "POST", "/api/chat", dict(chat, model="m1")))
+        await asyncio.sleep(0.05)
+        _, headers, _ = await _call(port, "POST", "/api/chat", dict(chat, model="m2"))
+        assert headers["X-Panel-Upstream"] == url_b
+        _, headers, _ = await slow
+        assert headers["X-Panel-Upstream"] == url_a
+
+        # 轮询后以 /api/ps 为准：m1 在 A、m2 在 B，即使另一个节点更空闲也走已加载的节点
+        await router.refresh()
+        assert "m1:latest" in router.nodes[1].loaded and "m2:latest" in router.nodes[2].loaded
+        busy = asyncio.ensure_future(_call(port, "POST", "/api/chat", dict(chat, model="m2")))
+        await asyncio.sleep(0.05)
+        _, headers, _ = await _call(port, "POST", "/api/chat", dict(chat, model="m2"))
+        assert headers["X-Panel-Upstream"] == url_b
+        await busy
+        assert stub_a.calls.get("/api/chat", 0) == 1
+
+        # 节点在两次轮询之间宕机：请求先落到它上面，连接失败后换下一个节点重试并再次摘除
+        dead.healthy, dead.failures, dead.loaded = True, 0, {"m3:latest"}
+        _, headers, _ = await _call(port, "POST", "/api/show", {"name": "m3"})
+        assert headers["X-Panel-Upstream"] == url_b
+        _, headers, _ = await _call(port, "POST", "/api/show", {"name": "m3"})
+        assert headers["X-Panel-Upstream"] == url_b
+        stats = router.stats()
+        assert stats["retries"] == 2 and stats["healthy"] == 2 and stats["ejections"] == 2
+        assert stats["affinity_hits"] >= 2
+
+        # 节点全部被摘除时仍会尝试
+        for node in router.nodes:
+            node.healthy = False
+        _, headers, _ = await _call(port, "POST", "/api/show", {"name": "m1"})
+        assert headers["X-Panel-Upstream"] in (url_a, url_b) and router.stats()["healthy"] == 1
+
+        await router.close()
+        await stop_tasks(panel_task, task_a, task_b)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_routes_by_affinity_and_load_and_ejects_dead_nodes()
+    print("✅ 全部通过")
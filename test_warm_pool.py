@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+测试模型预热池 - 按使用排名预热、超预算卸载最冷模型、冷启动统计持久化
+"""
+
+import asyncio
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from scheduler import Scheduler
+from warm_pool import WarmPool
+
+GB = 1024**3
+
+
+class FakeUpstream:
+    status = 200
+
+    async def read(self):
+        return b"{}"
+
+    def release(self):
+        pass
+
+
+class FakeProxy:
+    """只实现 WarmPool 用到的 fetch_json / pool.request"""
+
+    scheduler = None
+
+    def __init__(self, loaded):
+        self.loaded = dict(loaded)
+        self.calls = []
+        self.pool = self
+
+    async def fetch_json(self, method, path, payload=None):
+        if path == "/api/tags":
+            return {"models": [{"name": n, "size": 4 * GB} for n in ("a:latest", "b:latest", "c:latest")]}
+        return {"models": [{"name": n, "size": s} for n, s in self.loaded.items()]}
+
+    async def request(self, method, target, body, headers):
+        data = json.loads(body)
+        self.calls.append((data["model"], data["keep_alive"]))
+        if data["keep_alive"] == 0:
+            self.loaded.pop(data["model"], None)
+        else:
+            self.loaded[data["model"]] = 4 * GB
+        return FakeUpstream()
+
+
+def test_preload_top_models_and_unload_cold():
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            proxy = FakeProxy({"c:latest": 4 * GB})
+            warm = WarmPool(proxy, str(Path(tmp) / "warm.json"), top_n=2, ram_budget=8 * GB)
+            for _ in range(3):
+                warm.record("a", {"load_duration": 2_000_000_000})
+            warm.record("b", {"load_duration": 1_000_000})
+            await warm.reconcile()
+
+            assert warm.desired == ["a:latest", "b:latest"]
+            assert ("a:latest", "30m") in proxy.calls and ("c:latest", 0) in proxy.calls
+            assert set(proxy.loaded) == {"a:latest", "b:latest"}
+            assert warm.preloads == 2 and warm.unloads == 1
+
+            warm.save()
+            report = WarmPool(proxy, str(Path(tmp) / "warm.json"), top_n=0).report()
+            assert report["cold_starts"]["on"] == {"requests": 4, "cold_starts": 3, "cold_start_rate": 0.75}
+            assert report["usage"][0]["model"] == "a:latest"
+
+    asyncio.run(run())
+
+
+def test_preload_waits_while_scheduler_is_busy():
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            proxy = FakeProxy({"b:latest": 4 * GB})
+            proxy.scheduler = Scheduler(global_limit=1)
+            warm = WarmPool(proxy, str(Path(tmp) / "warm.json"), top_n=1, ram_budget=4 * GB)
+            warm.record("a", None)
+            running = proxy.scheduler.submit("b:latest", "u1")
+            queued = proxy.scheduler.submit("c:latest", "u2")
+            # 调度器忙：不预加载 a（会让 Ollama 换出 b），也不卸载正在生成的 b
+            await warm.reconcile()
+            assert warm.desired == ["a:latest"] and proxy.calls == [] and warm.deferred == 1
+
+            proxy.scheduler.release(running)
+            proxy.scheduler.release(queued)
+            await warm.reconcile()
+            assert proxy.calls == [("a:latest", "30m"), ("b:latest", 0)] and warm.preloads == 1
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_preload_top_models_and_unload_cold()
+    test_preload_waits_while_scheduler_is_busy()
+    print("✅ 全部通过")
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+多节点 Ollama 路由：--ollama 给出多个地址（逗号分隔）时代替单个 UpstreamPool
+- 每个节点一个 UpstreamPool；接口与 UpstreamPool 相同（request / stats / close），代理与各组件无需区分
+- 后台每隔 interval 秒轮询各节点的 /api/tags 与 /api/ps，记下每个节点有哪些模型、哪些已加载
+- 带模型的请求（chat / generate / show / pull 等）按以下顺序选节点：
+  已加载该模型 > 磁盘上有该模型 > 其他；同一档内选在途请求（占用连接数）最少的
+- 生成请求转发后立即把模型记为该节点已加载，下一次轮询前的后续请求也会落到同一节点
+- 健康检查：轮询或转发时连续失败 fail_threshold 次即摘除，之后轮询成功自动恢复；
+  连接失败的请求换下一个节点重试，全部节点都不可用时仍会尝试已摘除的节点
+- GET /api/tags、/api/ps 合并所有健康节点的结果（同名模型只列一次）；
+  管理类请求（pull / create / delete）只作用于选中的一个节点
+- 实际处理请求的节点通过响应头 X-Panel-Upstream 告知
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import sys
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Set
+
+from chat_store import normalize_agent
+from ollama_proxy import UpstreamError, UpstreamPool
+from scheduler import SCHEDULED_PATHS
+
+MERGED_PATHS = ("/api/tags", "/api/ps")
+UPSTREAM_HEADER = "x-panel-upstream"
+
+
+class MergedResponse:
+    """合并多个节点结果后的响应，接口与 UpstreamResponse 一致（整体已在内存里）"""
+
+    def __init__(self, status: int, body: bytes):
+        self.status = status
+        self.body = body
+        self.headers = {"content-type": "application/json; charset=utf-8", "content-length": str(len(body))}
+        self.method = "GET"
+        self.chunked = False
+        self.has_body = True
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        yield self.body
+
+    async def read(self) -> bytes:
+        return self.body
+
+    def release(self) -> None:
+        pass
+
+
+class UpstreamNode:
+    def __init__(self, pool: UpstreamPool):
+        self.pool = pool
+        self.healthy = True  # 第一次轮询之前默认可用
+        self.failures = 0  # 连续失败次数
+        self.ejections = 0
+        self.routed = 0
+        self.last_error = ""
+        self.checked_at: Optional[float] = None
+        self.models: Set[str] = set()
+        self.loaded: Set[str] = set()
+        self.tags: List[Dict[str, Any]] = []
+        self.ps: List[Dict[str, Any]] = []
+
+    @property
+    def base_url(self) -> str:
+        return self.pool.base_url
+
+    def rank(self, model: Optional[str]) -> int:
+        if model is None:
+            return 0
+        if model in self.loaded:
+            return 0
+        return 1 if model in self.models else 2
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.base_url,
+            "healthy": self.healthy,
+            "in_flight": self.pool.in_use,
+            "routed": self.routed,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "last_error": self.last_error,
+            "models": sorted(self.models),
+            "loaded": sorted(self.loaded),
+        }
+
+
+def _request_model(target: str, body: bytes) -> Optional[str]:
+    """请求体里的模型名（/api/show、/api/pull 等用 name，生成类用 model）"""
+    if not body or not target.startswith("/api/"):
+        return None
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(payload, dict):
+        return None
+    name = payload.get("model") or payload.get("name")
+    return normalize_agent(name) if isinstance(name, str) and name else None
+
+
+class UpstreamRouter:
+    def __init__(
+        self,
+        base_urls: Sequence[str],
+        max_connections: int = 32,
+        interval: float = 10.0,
+        fail_threshold: int = 2,
+        probe_timeout: float = 3.0,
+    ):
+        if not base_urls:
+            raise ValueError("至少需要一个 Ollama 节点")
+        self.nodes = [UpstreamNode(UpstreamPool(url, max_connections=max_connections)) for url in base_urls]
+        self.interval = interval
+        self.fail_threshold = fail_threshold
+        self.probe_timeout = probe_timeout
+        self.affinity_hits = 0  # 落到已加载该模型的节点
+        self.retries = 0
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    @property
+    def base_url(self) -> str:
+        return ",".join(node.base_url for node in self.nodes)
+
+    @property
+    def in_use(self) -> int:
+        return sum(node.pool.in_use for node in self.nodes)
+
+    # ------------------------------------------------------------------ 健康状态
+    def _ok(self, node: UpstreamNode) -> None:
+        node.failures = 0
+        if not node.healthy:
+            node.healthy = True
+            print(f"✅ Ollama 节点恢复: {node.base_url}", file=sys.stderr)
+
+    def _failed(self, node: UpstreamNode, error: Exception) -> None:
+        node.failures += 1
+        node.last_error = f"{type(error).__name__}: {error}"
+        if node.healthy and node.failures >= self.fail_threshold:
+            node.healthy = False
+            node.ejections += 1
+            node.loaded.clear()
+            print(f"⚠️  摘除 Ollama 节点 {node.base_url}（连续失败 {node.failures} 次）: {node.last_error}", file=sys.stderr)
+            asyncio.ensure_future(node.pool.close())  # 丢弃空闲连接，恢复后重新建立
+
+    # ------------------------------------------------------------------ 轮询
+    async def _get_json(self, node: UpstreamNode, path: str) -> Dict[str, Any]:
+        async def fetch() -> bytes:
+            up = await node.pool.request("GET", path)
+            try:
+                data = await up.read()
+            finally:
+                up.release()
+            if up.status != 200:
+                raise UpstreamError(f"{path} 返回 HTTP {up.status}")
+            return data
+
+        try:
+            data = await asyncio.wait_for(fetch(), self.probe_timeout)
+        except asyncio.TimeoutError as e:
+            raise UpstreamError(f"{path} 超时") from e
+        except (OSError, asyncio.IncompleteReadError) as e:
+            raise UpstreamError(f"{path} 读取失败: {e}") from e
+        try:
+            payload = json.loads(data)
+        except ValueError as e:
+            raise UpstreamError(f"{path} 返回了无效的 JSON") from e
+        return payload if isinstance(payload, dict) else {}
+
+    async def check(self, node: UpstreamNode) -> bool:
+        try:
+            tags = await self._get_json(node, "/api/tags")
+            ps = await self._get_json(node, "/api/ps")
+        except UpstreamError as e:
+            self._failed(node, e)
+            return False
+        node.checked_at = time.time()
+        node.tags = [m for m in tags.get("models") or [] if isinstance(m, dict) and m.get("name")]
+        node.ps = [m for m in ps.get("models") or [] if isinstance(m, dict) and m.get("name")]
+        node.models = {normalize_agent(m["name"]) for m in node.tags}
+        node.loaded = {normalize_agent(m["name"]) for m in node.ps}
+        self._ok(node)
+        return True
+
+    async def refresh(self) -> None:
+        await asyncio.gather(*(self.check(node) for node in self.nodes))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️  轮询 Ollama 节点失败: {type(e).__name__}: {e}", file=sys.stderr)
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    # ------------------------------------------------------------------ 路由
+    def candidates(self, model: Optional[str]) -> List[UpstreamNode]:
+        """按优先级排好的候选节点：健康的在前，摘除的垫底（全部不可用时仍尝试）"""
+        order = {id(node): i for i, node in enumerate(self.nodes)}
+        return sorted(
+            self.nodes,
+            key=lambda n: (not n.healthy, n.rank(model), n.pool.in_use, order[id(n)]),
+        )
+
+    async def _merged(self, path: str) -> MergedResponse:
+        nodes = [n for n in self.nodes if n.healthy] or list(self.nodes)
+        results = await asyncio.gather(*(self.check(n) for n in nodes))
+        if not any(results):
+            raise UpstreamError(f"所有 Ollama 节点都不可用: {nodes[-1].last_error}")
+        models: List[Dict[str, Any]] = []
+        seen: Set[str] = set()
+        for node in (n for n, ok in zip(nodes, results) if ok):
+            for m in node.tags if path == "/api/tags" else node.ps:
+                key = normalize_agent(m["name"])
+                if path == "/api/tags" and key in seen:
+                    continue  # 多个节点上的同名模型只列一次
+                seen.add(key)
+                models.append(m)
+        body = json.dumps({"models": models}, ensure_ascii=False).encode("utf-8")
+        return MergedResponse(200, body)
+
+    async def request(
+        self,
+        method: str,
+        target: str,
+        body: bytes = b"",
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        path = target.split("?", 1)[0]
+        if method == "GET" and path in MERGED_PATHS:
+            return await self._merged(path)
+
+        model = _request_model(target, body)
+        error: Optional[UpstreamError] = None
+        for attempt, node in enumerate(self.candidates(model)):
+            if attempt:
+                self.retries += 1
+            try:
+                up = await node.pool.request(method, target, body, headers)
+            except UpstreamError as e:
+                self._failed(node, e)
+                error = e
+                continue
+            self._ok(node)
+            node.routed += 1
+            if model is not None and model in node.loaded:
+                self.affinity_hits += 1
+            if model is not None and method == "POST" and path in SCHEDULED_PATHS:
+                node.loaded.add(model)  # Ollama 此时开始加载该模型
+            up.headers[UPSTREAM_HEADER] = node.base_url
+            return up
+        raise error or UpstreamError("没有可用的 Ollama 节点")
+
+    # ------------------------------------------------------------------ 统计与关闭
+    def stats(self) -> Dict[str, Any]:
+        pools = [node.pool.stats() for node in self.nodes]
+        totals = {k: sum(p[k] for p in pools) for k in ("in_use", "idle", "opened", "reused", "requests", "failures")}
+        return dict(
+            totals,
+            nodes=len(self.nodes),
+            healthy=sum(1 for n in self.nodes if n.healthy),
+            ejections=sum(n.ejections for n in self.nodes),
+            affinity_hits=self.affinity_hits,
+            retries=self.retries,
+            upstreams=[n.stats() for n in self.nodes],
+        )
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for node in self.nodes:
+            await node.pool.close()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+模型预热池：按最近使用情况让常用模型常驻内存，减少首条消息等待 Ollama 加载 GGUF
+- 每次生成请求记录一次使用（分数按半衰期衰减，越近越重要）；前端切换智能体时也会发一次提示
+- 后台每隔 interval 秒：取分数最高的 top_n 个模型（总大小不超过 RAM 预算）作为常驻集合，
+  未加载的用空的 /api/generate + keep_alive 预加载；不在常驻集合里的已加载模型在超预算时卸载（keep_alive=0）
+- 调度器里还有运行中或排队的生成请求时推迟预加载：预加载会让 Ollama 换出调度器正在成批放行的模型
+- 冷启动：Ollama 最终记录里 load_duration 超过阈值即视为一次冷启动；按“关闭/开启预热”分别累计，
+  统计持久化到 JSON 文件，GET /panel/warm 给出前后对比
+- top_n = 0 时只统计不预热（即“关闭”对照组）；多 worker 时各进程分别统计，文件以最后写入为准
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from async_server import Request, Response
+from chat_store import normalize_agent
+
+COLD_START_NS = 500_000_000  # load_duration 超过 0.5s 视为冷启动
+HALF_LIFE = 24 * 3600.0
+HINT_WEIGHT = 0.5  # 前端“选中智能体”的提示权重（一次真实请求为 1）
+HINT_TTL = 600.0  # 刚被选中的智能体在这段时间内优先进入常驻集合
+
+
+class WarmPool:
+    def __init__(
+        self,
+        proxy,
+        state_path: str,
+        top_n: int = 2,
+        ram_budget: int = 16 * 1024**3,
+        keep_alive: str = "30m",
+        interval: float = 60.0,
+    ):
+        self.proxy = proxy
+        self.state_path = state_path
+        self.top_n = top_n
+        self.ram_budget = ram_budget
+        self.keep_alive = keep_alive
+        self.interval = interval
+        self.usage: Dict[str, Dict[str, float]] = {}  # 模型 -> {score, count, last_used}
+        self.modes: Dict[str, Dict[str, int]] = {}  # "off"/"on" -> {requests, cold_starts}
+        self.preloads = 0
+        self.unloads = 0
+        self.failures = 0
+        self.deferred = 0  # 因调度器忙而推迟的刷新次数
+        self.desired: List[str] = []
+        self._hints: Dict[str, float] = {}  # 模型 -> 前端最近一次选中时间
+        self.loaded: List[Dict[str, Any]] = []
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._wake = asyncio.Event()
+        self._load()
+
+    @property
+    def mode(self) -> str:
+        return "on" if self.top_n > 0 else "off"
+
+    # ------------------------------------------------------------------ 状态持久化
+    def _load(self) -> None:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.usage = {k: dict(v) for k, v in (data.get("usage") or {}).items()}
+        self.modes = {k: dict(v) for k, v in (data.get("modes") or {}).items()}
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        tmp = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"usage": self.usage, "modes": self.modes}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.state_path)
+
+    # ------------------------------------------------------------------ 使用记录
+    def _score(self, model: str, now: float) -> float:
+        u = self.usage.get(model)
+        if not u:
+            return 0.0
+        return u["score"] * math.pow(0.5, (now - u["last_used"]) / HALF_LIFE)
+
+    def touch(self, model: str, weight: float = 1.0) -> None:
+        model = normalize_agent(model)
+        now = time.time()
+        u = self.usage.setdefault(model, {"score": 0.0, "count": 0, "last_used": now})
+        u["score"] = self._score(model, now) + weight
+        u["last_used"] = now
+        if weight >= 1.0:
+            u["count"] += 1
+
+    def record(self, model: str, final: Optional[Dict[str, Any]]) -> None:
+        """一次生成请求结束：记录使用，并根据 load_duration 判断是否冷启动"""
+        self.touch(model)
+        if not final:
+            return
+        stats = self.modes.setdefault(self.mode, {"requests": 0, "cold_starts": 0})
+        stats["requests"] += 1
+        load = final.get("load_duration")
+        if isinstance(load, (int, float)) and load > COLD_START_NS:
+            stats["cold_starts"] += 1
+
+    def ranking(self) -> List[Dict[str, Any]]:
+        now = time.time()
+        rows = [
+            {"model": m, "score": round(self._score(m, now), 3), "count": int(u["count"]), "last_used": u["last_used"]}
+            for m, u in self.usage.items()
+        ]
+        rows.sort(key=lambda r: r["score"], reverse=True)
+        return rows
+
+    # ------------------------------------------------------------------ 预热/卸载
+    async def _call(self, model: str, keep_alive: Any) -> bool:
+        body = json.dumps({"model": model, "keep_alive": keep_alive}).encode("utf-8")
+        try:
+            up = await self.proxy.pool.request("POST", "/api/generate", body, {"content-type": "application/json"})
+            try:
+                await up.read()
+            finally:
+                up.release()
+        except Exception as e:
+            self.failures += 1
+            print(f"⚠️  预热/卸载 {model} 失败: {type(e).__name__}: {e}", file=sys.stderr)
+            return False
+        return up.status == 200
+
+    def _plan(self, sizes: Dict[str, int]) -> List[str]:
+        now = time.time()
+        hinted = sorted((t, m) for m, t in self._hints.items() if now - t < HINT_TTL)
+        candidates = [m for _, m in reversed(hinted)] + [r["model"] for r in self.ranking()]
+        desired: List[str] = []
+        total = 0
+        for model in candidates:
+            if len(desired) >= self.top_n:
+                break
+            if model in desired or model not in sizes:
+                continue  # 模型已删除
+            if total + sizes[model] > self.ram_budget:
+                continue
+            desired.append(model)
+            total += sizes[model]
+        return desired
+
+    async def reconcile(self) -> None:
+        tags = await self.proxy.fetch_json("GET", "/api/tags") or {}
+        ps = await self.proxy.fetch_json("GET", "/api/ps") or {}
+        sizes = {normalize_agent(m.get("name", "")): int(m.get("size") or 0) for m in tags.get("models", [])}
+        loaded = {normalize_agent(m.get("name", "")): int(m.get("size") or 0) for m in ps.get("models", [])}
+        sizes.update(loaded)  # 已加载模型以实际占用为准
+        self.loaded = [{"model": m, "size": s} for m, s in loaded.items()]
+
+        self.desired = self._plan(sizes) if self.top_n > 0 else []
+        if self.top_n <= 0:
+            return
+        busy = set()
+        scheduler = getattr(self.proxy, "scheduler", None)
+        if scheduler is not None:
+            busy = {normalize_agent(m) for m, n in scheduler.running_by_model.items() if n > 0}
+            busy.update(normalize_agent(m) for m, q in scheduler.queues.items() if q.size > 0)
+        if busy:
+            # 预加载不经过调度器：这时加载别的模型可能让 Ollama 换出正在成批处理的模型，留到空闲时再做
+            self.deferred += 1
+        else:
+            # 已加载的也调用一次：相当于刷新 keep_alive，避免常驻模型到期被 Ollama 卸载
+            for model in self.desired:
+                if await self._call(model, self.keep_alive) and model not in loaded:
+                    self.preloads += 1
+                    loaded[model] = sizes.get(model, 0)
+
+        # 超预算时从最冷的开始卸载，不卸载正在生成或排队的模型
+        now = time.time()
+        total = sum(loaded.values())
+        for model in sorted(loaded, key=lambda m: self._score(m, now)):
+            if total <= self.ram_budget:
+                break
+            if model in self.desired or model in busy:
+                continue
+            if await self._call(model, 0):
+                self.unloads += 1
+                total -= loaded.pop(model)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.reconcile()
+                self.save()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️  预热池刷新失败: {type(e).__name__}: {e}", file=sys.stderr)
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        try:
+            self.save()
+        except OSError:
+            pass
+
+    # ------------------------------------------------------------------ HTTP
+    def report(self) -> Dict[str, Any]:
+        modes = {}
+        for name, s in self.modes.items():
+            rate = s["cold_starts"] / s["requests"] if s["requests"] else 0.0
+            modes[name] = dict(s, cold_start_rate=round(rate, 4))
+        return {
+            "mode": self.mode,
+            "top_n": self.top_n,
+            "ram_budget_mb": self.ram_budget // (1024 * 1024),
+            "keep_alive": self.keep_alive,
+            "desired": self.desired,
+            "loaded": self.loaded,
+            "usage": self.ranking()[:20],
+            "cold_starts": modes,
+            "preloads": self.preloads,
+            "unloads": self.unloads,
+            "failures": self.failures,
+            "deferred": self.deferred,
+        }
+
+    def stats(self) -> Dict[str, object]:
+        current = self.modes.get(self.mode, {})
+        return {
+            "preloads": self.preloads,
+            "unloads": self.unloads,
+            "failures": self.failures,
+            "deferred": self.deferred,
+            "requests": current.get("requests", 0),
+            "cold_starts": current.get("cold_starts", 0),
+        }
+
+    def install(self, app) -> None:
+        app.add_route("/panel/warm", self.handle, methods=("GET", "POST"))
+        app.on_startup(self.start)
+        app.on_shutdown(self.stop)
+
+    async def handle(self, req: Request, resp: Response) -> None:
+        if req.method == "GET":
+            await resp.send_json(200, self.report())
+            return
+        # POST {"model": ...}：前端选中智能体时的预热提示
+        try:
+            payload = req.json() or {}
+        except ValueError:
+            payload = {}
+        model = payload.get("model") if isinstance(payload, dict) else None
+        if not isinstance(model, str) or not model:
+            await resp.send_error(400, "需要 model")
+            return
+        self.touch(model, HINT_WEIGHT)
+        self._hints[normalize_agent(model)] = time.time()
+        if self.top_n > 0 and normalize_agent(model) not in {m["model"] for m in self.loaded}:
+            self._wake.set()
+        await resp.send_json(200, {"ok": True})